@@ -1,4 +1,16 @@
-from .caper import Caper
+import sys
 
 
 __version__ = '0.8.2.1'
+
+# Caper is imported lazily (Python >= 3.7) so that hook subcommands
+# called by Cromwell for each task/job don't import heavy modules
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name == 'Caper':
+            from .caper import Caper
+            return Caper
+        raise AttributeError(
+            'module {m} has no attribute {n}'.format(m=__name__, n=name))
+else:
+    from .caper import Caper
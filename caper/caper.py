@@ -1,3 +1,5 @@
+import gzip
+import hashlib
 import json
 import logging
 import os
@@ -7,22 +9,31 @@ import shutil
 import socket
 import sys
 import time
-from autouri import AutoURI, AbsPath, GCSURI, S3URI, URIBase
-from autouri.loc_aux import recurse_json
+from autouri import AutoURI, AbsPath, GCSURI, S3URI
+from collections import Counter
 from datetime import datetime
-from pyhocon import ConfigFactory, HOCONConverter
 from subprocess import Popen, check_call, PIPE, CalledProcessError
 from tempfile import TemporaryDirectory
-from threading import Thread
+from threading import Event, Thread, get_ident
 from .dict_tool import merge_dict
 from .caper_init import install_cromwell_jar, install_womtool_jar
+from .caper_cache import CaperCache
+from .caper_checksum_index import CaperChecksumIndex
+from .caper_deepcopy import CaperDeepcopy
 from .caper_wdl_parser import CaperWDLParser
 from .cromwell_rest_api import CromwellRestAPI
-from .caper_backend import BACKEND_GCP, BACKEND_AWS, BACKEND_LOCAL, \
-    CaperBackendCommon, CaperBackendDatabase, CaperBackendGCP, \
-    CaperBackendAWS, CaperBackendLocal, CaperBackendSLURM, \
-    CaperBackendSGE, CaperBackendPBS
-from .caper_backend import CaperBackendBase, CaperBackendBaseLocal
+from .metadata_index import MetadataIndex
+from .caper_server_supervisor import CaperServerSupervisor
+from .cluster_status import ClusterStatusCache
+from .slurm_array import SlurmArrayBroker
+from .singularity_bindpath import find_bindpath
+from .stderr_fetcher import StderrFetcher
+from .workflow_matcher import WorkflowMatcher
+from .workflow_mirror import WorkflowMirror
+from .workflow_table import WorkflowTable
+from .caper_backend import BACKEND_GCP, BACKEND_AWS, BACKEND_LOCAL
+from .caper_backend import BACKEND_SLURM
+from .caper_backend_conf import get_backend_conf_str, get_settings_hash
 
 
 logger = logging.getLogger(__name__)
@@ -31,9 +42,7 @@ logger = logging.getLogger(__name__)
 class Caper(object):
     """Cromwell/WDL wrapper
     """
-    BACKEND_CONF_HEADER = 'include required(classpath("application"))\n'
     DEFAULT_BACKEND = BACKEND_LOCAL
-    RE_PATTERN_BACKEND_CONF_HEADER = r'^\s*include\s'
     RE_PATTERN_STARTED_WORKFLOW_ID = \
         r'started WorkflowActor-(\b[0-9a-f]{8}\b-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-\b[0-9a-f]{12}\b)'
     RE_PATTERN_FINISHED_WORKFLOW_ID = \
@@ -45,10 +54,20 @@ class Caper(object):
     RE_PATTERN_DELIMITER_GCP_ZONES = r',| '
     USER_INTERRUPT_WARNING = '\n********** DO NOT CTRL+C MULTIPLE TIMES **********\n'
 
+    # same as CLI defaults of --ip and --port
+    DEFAULT_SERVER_IP = 'localhost'
+    DEFAULT_SERVER_PORT = 8000
     MAX_RETRY_UPDATING_METADATA = 3
     SEC_INTERVAL_UPDATE_METADATA = 1200.0
     SEC_INTERVAL_UPDATE_SERVER_HEARTBEAT = 60.0
     SEC_INTERVAL_RETRY_UPDATING_METADATA = 10.0
+    SEC_INTERVAL_SYNC_WORKFLOW_MIRROR = 60.0
+    CACHE_ACTION_INSPECT = 'inspect'
+    CACHE_ACTION_PURGE = 'purge'
+    METADATA_UPDATE_MODE_FULL = 'full'
+    METADATA_UPDATE_MODE_INCREMENTAL = 'incremental'
+    # tiny metadata with workflow's status and status of each call
+    METADATA_SIGNATURE_KEYS = ['status', 'executionStatus']
 
     # added to cromwell labels file
     KEY_CAPER_STR_LABEL = 'caper-str-label'
@@ -73,10 +92,26 @@ class Caper(object):
             port=args.get('port'),
             no_server_hearbeat=args.get('no_server_heartbeat'),
             server_hearbeat_file=args.get('server_heartbeat_file'),
-            server_hearbeat_timeout=args.get('server_heartbeat_timeout'))
+            server_hearbeat_timeout=args.get('server_heartbeat_timeout'),
+            rest_pool_size=args.get('rest_pool_size'),
+            rest_max_retries=args.get('rest_max_retries'),
+            rest_max_workers=args.get('rest_max_workers'))
 
         # java heap size
         self._java_heap_server = args.get('java_heap_server')
+
+        # metadata.json update for running/finished workflows on a server
+        self._metadata_update_mode = args.get('metadata_update_mode')
+        # workflow ID: signature of the last written metadata
+        self._metadata_signatures = {}
+        # workflow ID: md5 hash of the last written metadata.json
+        self._metadata_json_md5s = {}
+        self._gzip_metadata = args.get('gzip_metadata')
+        # local mirror of workflows written by a server
+        self._workflow_mirror_db = args.get('workflow_mirror_db')
+        self._workflow_mirror = None
+        self._stop_workflow_mirror_sync = Event()
+        self._live = args.get('live')
         self._java_heap_run = args.get('java_heap_run')
 
         # init others
@@ -85,6 +120,15 @@ class Caper(object):
         self._format = args.get('format')
         self._hide_result_before = args.get('hide_result_before')
         self._hide_subworkflow = args.get('hide_subworkflow')
+        self._hide_result_after = args.get('hide_result_after')
+        self._list_status = Caper.__split_comma_list(args.get('list_status'))
+        self._list_user = Caper.__split_comma_list(args.get('list_user'))
+        self._sort_by = args.get('sort_by')
+        self._reverse_sort = args.get('reverse_sort')
+        self._limit = args.get('limit')
+        self._output_format = args.get('output_format')
+        if self._output_format is None:
+            self._output_format = WorkflowTable.OUTPUT_FORMAT_TSV
         self._disable_call_caching = args.get('disable_call_caching')
         self._max_concurrent_workflows = args.get('max_concurrent_workflows')
         self._max_concurrent_tasks = args.get('max_concurrent_tasks')
@@ -110,10 +154,30 @@ class Caper(object):
         self._sge_extra_param = args.get('sge_extra_param')
         self._pbs_queue = args.get('pbs_queue')
         self._pbs_extra_param = args.get('pbs_extra_param')
+        self._cluster_status_dir = args.get('cluster_status_dir')
+        self._cluster_status_interval = args.get('cluster_status_interval')
+        self._no_cluster_status_cache = args.get('no_cluster_status_cache')
+        self._job_rate = args.get('job_rate')
+        self._job_burst = args.get('job_burst')
+        self._submit_max_retries = args.get('submit_max_retries')
+        self._check_alive_max_retries = args.get('check_alive_max_retries')
+        self._retry_backoff_sec = args.get('retry_backoff_sec')
+        self._retry_max_backoff_sec = args.get('retry_max_backoff_sec')
+        self._retry_jitter = args.get('retry_jitter')
+        self._slurm_array_broker = args.get('slurm_array_broker')
+        self._slurm_array_dir = args.get('slurm_array_dir')
+        self._slurm_array_window = args.get('slurm_array_window')
+        self._slurm_array_max_size = args.get('slurm_array_max_size')
+        self._local_slot = args.get('local_slot')
+        self._local_slot_dir = args.get('local_slot_dir')
+        self._local_max_cpu = args.get('local_max_cpu')
+        self._local_max_memory_mb = args.get('local_max_memory_mb')
 
         self._backend_file = AbsPath.get_abspath_if_exists(
             args.get('backend_file'))
         self._soft_glob_output = args.get('soft_glob_output')
+        self._script_epilogue_mode = args.get('script_epilogue_mode')
+        self._script_epilogue_wait_sec = args.get('script_epilogue_wait_sec')
         self._wdl = AbsPath.get_abspath_if_exists(
             args.get('wdl'))
         self._inputs = AbsPath.get_abspath_if_exists(
@@ -156,6 +220,17 @@ class Caper(object):
 
         # troubleshoot
         self._show_completed_task = args.get('show_completed_task')
+        self._stderr_tail_kb = args.get('stderr_tail_kb')
+        self._num_stderr_fetch_threads = args.get('num_stderr_fetch_threads')
+        if self._num_stderr_fetch_threads is None:
+            self._num_stderr_fetch_threads = StderrFetcher.DEFAULT_NUM_THREADS
+
+        # cache
+        self._cache_dir = args.get('cache_dir')
+        self._max_cache_size = args.get('max_cache_size')
+        self._cache_action = args.get('cache_action')
+        self._cache_namespace = args.get('cache_namespace')
+        self._force_revalidation = args.get('force_revalidation')
 
         # backend and default backend
         self._backend = args.get('backend')
@@ -169,6 +244,9 @@ class Caper(object):
 
         # deepcopy
         self._no_deepcopy = args.get('no_deepcopy')
+        self._deepcopy_num_threads = args.get('deepcopy_num_threads')
+        if self._deepcopy_num_threads is None:
+            self._deepcopy_num_threads = CaperDeepcopy.DEFAULT_NUM_THREADS
 
         # containers
         self._no_build_singularity = args.get('no_build_singularity')
@@ -222,11 +300,16 @@ class Caper(object):
         if imports_file is not None:
             cmd += ['-p', imports_file]
 
-        self.__validate_with_womtool(wdl, input_file, imports_file)
+        # do not send WDL/inputs to a server on default ip:port
+        # which can be another user's server on a shared node
+        self.__validate_with_womtool(
+            wdl, input_file, imports_file, use_server=self._server_located)
 
         logger.info('cmd: {cmd}'.format(cmd=cmd))
         if self._dry_run:
             return -1
+        cluster_status_cache = self.__start_cluster_status_cache()
+        slurm_array_broker = self.__start_slurm_array_broker()
         try:
             p = Popen(cmd, stdout=PIPE, universal_newlines=True)
             workflow_id = None
@@ -254,14 +337,22 @@ class Caper(object):
             while p.poll() is None:
                 stdout = p.stdout.readline().strip('\n')
                 print(stdout)
+        finally:
+            if cluster_status_cache is not None:
+                cluster_status_cache.stop()
+            if slurm_array_broker is not None:
+                slurm_array_broker.stop()
 
         # move metadata file to a workflow output directory
         if metadata_file is not None and workflow_id is not None and \
                 os.path.exists(metadata_file):
-            with open(metadata_file, 'r') as fp:
-                metadata_uri = self.__write_metadata_json(
-                    workflow_id,
-                    json.loads(fp.read()))
+            def write_to(fp):
+                with open(metadata_file, 'rb') as fp_src:
+                    shutil.copyfileobj(
+                        fp_src, fp, CromwellRestAPI.DEFAULT_CHUNK_SIZE)
+
+            metadata_uri = self.__write_metadata_json(
+                workflow_id, write_to)
             # remove original one
             os.remove(metadata_file)
         else:
@@ -300,71 +391,67 @@ class Caper(object):
                install_cromwell_jar(self._cromwell), 'server']
         logger.info('cmd: {cmd}'.format(cmd=cmd))
 
-        # pending/running workflows
-        started_wf_ids = set()
-        # completed, aborted or terminated workflows
-        finished_wf_ids = set()
-
         self._stop_heartbeat_thread = False
         t_heartbeat = Thread(
             target=self.__write_heartbeat_file)
         if self._dry_run:
             return -1
-        try:
-            p = Popen(cmd, stdout=PIPE, universal_newlines=True)
-            rc = None
-            t0 = time.perf_counter()  # tickcount
-            server_is_ready = False
 
-            while p.poll() is None:
-                stdout = p.stdout.readline().strip('\n')
-                if stdout != '':
-                    print(stdout)
+        def on_interrupt():
+            logger.error(Caper.USER_INTERRUPT_WARNING)
 
-                # find workflow id from Cromwell server's STDOUT
-                wf_ids_with_status = \
-                    Caper.__get_workflow_ids_from_cromwell_stdout(stdout)
-                if not server_is_ready:
-                    server_is_ready = \
-                        Caper.__check_cromwell_server_start_from_stdout(stdout)
-                    if server_is_ready:
-                        t_heartbeat.start()
-
-                for wf_id, status in wf_ids_with_status:
-                    if status in 'started':
-                        started_wf_ids.add(wf_id)
-                    elif status == 'finished':
-                        finished_wf_ids.add(wf_id)
-
-                for wf_id in finished_wf_ids:
-                    started_wf_ids.remove(wf_id)
-
-                # write metadata.json for finished workflows
-                self.__write_metadata_jsons(finished_wf_ids)
-                # flush finished workflow IDs
-                #   so that their metadata don't get updated any longer
-                finished_wf_ids.clear()
-
-                # write metadata.json for running workflows
-                #   every SEC_INTERVAL_UPDATE_METADATA
-                t1 = time.perf_counter()
-                if (t1 - t0) > Caper.SEC_INTERVAL_UPDATE_METADATA:
-                    t0 = t1
-                    self.__write_metadata_jsons(started_wf_ids)
+        t_workflow_mirror_sync = None
+        if self._workflow_mirror_db:
+            self._workflow_mirror = WorkflowMirror(
+                WorkflowMirror.get_db_file_for_server(
+                    self._workflow_mirror_db, self._ip, self._port))
+            logger.info('Workflow mirror: {db}'.format(
+                db=self._workflow_mirror.db_file))
+            self._stop_workflow_mirror_sync.clear()
+            t_workflow_mirror_sync = Thread(
+                target=self.__sync_workflow_mirror_periodically, daemon=True)
+
+        def on_server_start():
+            t_heartbeat.start()
+            if t_workflow_mirror_sync is not None:
+                t_workflow_mirror_sync.start()
+
+        supervisor = CaperServerSupervisor(
+            cmd,
+            get_workflow_ids_from_stdout=
+                Caper.__get_workflow_ids_from_cromwell_stdout,
+            check_server_start_from_stdout=
+                Caper.__check_cromwell_server_start_from_stdout,
+            write_metadata_json=self.__update_metadata_json,
+            on_server_start=on_server_start,
+            on_interrupt=on_interrupt,
+            on_workflow_started=self.__update_workflow_mirror
+            if self._workflow_mirror is not None else None,
+            sec_interval_update_metadata=Caper.SEC_INTERVAL_UPDATE_METADATA,
+            sec_delay_write_metadata=Caper.SEC_INTERVAL_RETRY_UPDATING_METADATA,
+            max_retry_write_metadata=Caper.MAX_RETRY_UPDATING_METADATA)
+        cluster_status_cache = self.__start_cluster_status_cache()
+        slurm_array_broker = self.__start_slurm_array_broker()
+        try:
+            rc = supervisor.run()
+        finally:
+            if cluster_status_cache is not None:
+                cluster_status_cache.stop()
+            if slurm_array_broker is not None:
+                slurm_array_broker.stop()
+            if self._workflow_mirror is not None:
+                self._stop_workflow_mirror_sync.set()
+                if t_workflow_mirror_sync.is_alive():
+                    t_workflow_mirror_sync.join()
+                self._workflow_mirror.close()
+                self._workflow_mirror = None
 
-        except CalledProcessError as e:
-            rc = e.returncode
-        except KeyboardInterrupt:
-            logger.error(Caper.USER_INTERRUPT_WARNING)
-            while p.poll() is None:
-                stdout = p.stdout.readline().strip('\n')
-                print(stdout)
-        time.sleep(1)
         self._stop_heartbeat_thread = True
-        t_heartbeat.join()
+        if t_heartbeat.is_alive():
+            t_heartbeat.join()
         logger.info(
-            'server: {rc}, {s_wf_ids}, {f_wf_ids}'.format(
-                rc=rc, s_wf_ids=started_wf_ids, f_wf_ids=finished_wf_ids))
+            'server: {rc}, {s_wf_ids}'.format(
+                rc=rc, s_wf_ids=supervisor.started_workflow_ids))
         return rc
 
     def submit(self):
@@ -398,7 +485,8 @@ class Caper(object):
                 l=labels_file,
                 on_hold=on_hold))
 
-        self.__validate_with_womtool(wdl, input_file, imports_file)
+        self.__validate_with_womtool(
+            wdl, input_file, imports_file, use_server=True)
 
         if self._dry_run:
             return -1
@@ -437,14 +525,17 @@ class Caper(object):
         return r
 
     def metadata(self, no_print=False):
-        """Retrieve metadata for workflows from a Cromwell server
+        """Retrieve metadata for workflows from a Cromwell server.
+        Metadata of finished workflows are read from their metadata.json
+        if found in a local mirror of workflows (unless --live).
         """
         if self._dry_run:
             return -1
-        m = self._cromwell_rest_api.get_metadata(
-                self._wf_id_or_label,
-                [(Caper.KEY_CAPER_STR_LABEL, v)
-                 for v in self._wf_id_or_label])
+        m = []
+        for metadata in self.__get_metadata_or_uris():
+            if isinstance(metadata, str):
+                metadata = Caper.__read_metadata_json(metadata)
+            m.append(metadata)
         if not no_print:
             if len(m) == 1:
                 m_ = m[0]
@@ -467,42 +558,54 @@ class Caper(object):
             labels = [(Caper.KEY_CAPER_STR_LABEL, v)
                       for v in self._wf_id_or_label]
 
-        workflows = self._cromwell_rest_api.find(
-            workflow_ids, labels)
+        matcher = WorkflowMatcher(workflow_ids, labels)
+        include_subworkflows = False if self._hide_subworkflow else None
+        mirror = self.__open_workflow_mirror()
+        if mirror is None:
+            workflows = self._cromwell_rest_api.iter_find(
+                matcher=matcher,
+                status=self._list_status,
+                include_subworkflows=include_subworkflows)
+        elif matcher.matches_all:
+            # mirror is synced with all workflows on a server
+            try:
+                workflows = list(mirror.iter_find(
+                    matcher, status=self._list_status,
+                    include_subworkflows=include_subworkflows))
+            finally:
+                mirror.close()
+        else:
+            try:
+                workflows, missing = self.__find_in_workflow_mirror(mirror)
+            finally:
+                mirror.close()
+            if missing:
+                # can be submitted after the last sync of a mirror
+                found = set(w['id'] for w in workflows)
+                workflows.extend(
+                    w for w in self._cromwell_rest_api.iter_find(
+                        workflow_ids=missing,
+                        labels=[(Caper.KEY_CAPER_STR_LABEL, v)
+                                for v in missing],
+                        status=self._list_status,
+                        include_subworkflows=include_subworkflows)
+                    if w['id'] not in found)
         formats = self._format.split(',')
-        print('\t'.join(formats))
-
-        if workflows is None:
-            return None
-        for w in workflows:
-            row = []
-            workflow_id = w['id'] if 'id' in w else None
-            parent_workflow_id = w['parentWorkflowId'] if 'parentWorkflowId' in w else None
 
-            if self._hide_subworkflow and parent_workflow_id:
-                continue
-            if self._hide_result_before is not None:
-                if 'submission' in w and w['submission'] <= self._hide_result_before:
-                    continue
-            for f in formats:
-                if f == 'workflow_id':
-                    row.append(str(workflow_id))
-                elif f == 'str_label':
-                    if 'labels' in w and Caper.KEY_CAPER_STR_LABEL in w['labels']:
-                        lbl = w['labels'][Caper.KEY_CAPER_STR_LABEL]
-                    else:
-                        lbl = None
-                    row.append(str(lbl))
-                elif f == 'user':
-                    if 'labels' in w and Caper.KEY_CAPER_USER in w['labels']:
-                        lbl = w['labels'][Caper.KEY_CAPER_USER]
-                    else:
-                        lbl = None
-                    row.append(str(lbl))
-                else:
-                    row.append(str(w[f] if f in w else None))
-            print('\t'.join(row))
-        return workflows
+        table = WorkflowTable(
+            formats + ([self._sort_by] if self._sort_by else []),
+            key_str_label=Caper.KEY_CAPER_STR_LABEL,
+            key_user=Caper.KEY_CAPER_USER).extend(workflows)
+        table = table.filter(
+            statuses=self._list_status,
+            users=self._list_user,
+            submitted_after=self._hide_result_before,
+            submitted_before=self._hide_result_after,
+            hide_subworkflow=self._hide_subworkflow)
+        table = table.sort(
+            self._sort_by, reverse=self._reverse_sort, limit=self._limit)
+        table.write(formats, output_format=self._output_format)
+        return table
 
     def troubleshoot(self):
         """Troubleshoot errors based on information from Cromwell's metadata
@@ -523,45 +626,201 @@ class Caper(object):
 
         if len(wf_id_or_label) > 0:
             self._wf_id_or_label = wf_id_or_label
-            metadatas.extend(self.metadata(no_print=True))
+            # metadata.json of a finished workflow in a local mirror
+            # is parsed incrementally without being loaded on memory
+            metadatas.extend(self.__get_metadata_or_uris())
+
+        stderr_fetcher = StderrFetcher(
+            num_threads=self._num_stderr_fetch_threads,
+            tail_size=self._stderr_tail_kb * 1024
+            if self._stderr_tail_kb else None)
 
         for metadata in metadatas:
-            Caper.__troubleshoot(metadata, self._show_completed_task)
-
-    def __validate_with_womtool(self, wdl, input_file, imports):
-        if not self._ignore_womtool:
-            with TemporaryDirectory() as tmp_d:
-                if imports:
-                    # copy WDL to temp dir and unpack imports.zip (sub WDLs) if exists
-                    wdl_copy = os.path.join(tmp_d, AutoURI(self._wdl).basename)
-                    AutoURI(wdl).cp(wdl_copy)
-                    shutil.unpack_archive(imports, tmp_d)
-                else:
-                    wdl_copy = wdl
-                cmd_womtool = ['java', '-Xmx512M', '-jar', '-DLOG_LEVEL=INFO',
-                               install_womtool_jar(self._womtool),
-                               'validate', wdl_copy,
-                               '-i', input_file]
-                try:
-                    logger.info('Validating WDL/input JSON with womtool...')
-                    check_call(cmd_womtool)
-                except CalledProcessError as e:
-                    logger.error('Womtool: WDL or input JSON is invalid '
-                                 'or input JSON doesn\'t exist.')
-                    rc = e.returncode
-                    sys.exit(rc)
+            if CromwellRestAPI.is_error_response(metadata):
+                logger.error(
+                    'Skipped troubleshooting a workflow due to an error '
+                    'while retrieving metadata: {m}'.format(m=metadata))
+                continue
+            Caper.__troubleshoot(
+                metadata, self._show_completed_task, stderr_fetcher)
+
+    def cache(self):
+        """Inspect or purge Caper's local caches (e.g. imports.zip)
+
+        Returns:
+            List of (namespace, number of files, total size in bytes)
+            for inspected/purged caches.
+        """
+        if self._dry_run:
+            return -1
+        namespaces = self._cache_namespace
+        if not namespaces:
+            namespaces = CaperCache.find_namespaces(self._cache_dir)
+            if self._cache_action == Caper.CACHE_ACTION_PURGE:
+                namespaces = [
+                    ns for ns in namespaces
+                    if ns not in CaperCache.NAMESPACES_KEPT_ON_PURGE_ALL]
+
+        result = []
+        if self._cache_action == Caper.CACHE_ACTION_PURGE:
+            for ns in namespaces:
+                c = CaperCache(self._cache_dir, ns)
+                entries = c.entries()
+                c.purge()
+                logger.info(
+                    'Purged cache: {ns}, {n} files, {s} bytes'.format(
+                        ns=ns, n=len(entries),
+                        s=sum(size for _, size, _ in entries)))
+                result.append(
+                    (ns, len(entries), sum(size for _, size, _ in entries)))
+            return result
+
+        print('\t'.join(['namespace', 'num_files', 'size', 'last_used', 'dir']))
+        for ns in namespaces:
+            c = CaperCache(self._cache_dir, ns)
+            entries = c.entries()
+            total = sum(size for _, size, _ in entries)
+            last_used = datetime.fromtimestamp(entries[0][2]).strftime(
+                '%Y-%m-%dT%H:%M:%S') if entries else None
+            print('\t'.join(
+                [ns, str(len(entries)), str(total), str(last_used), c.dir]))
+            result.append((ns, len(entries), total))
+        return result
+
+    def __validate_with_womtool(self, wdl, input_file, imports,
+                                use_server=False):
+        """Validate WDL and input JSON with womtool.
+        Cromwell server's built-in womtool (on an already running JVM)
+        is used first if use_server and a server is available.
+        Otherwise, or if there are sub-WDLs (imports),
+        a standalone womtool JAR is run on a new JVM.
+        Exits if invalid.
+
+        Successful validation with a standalone womtool is cached on disk
+        with a key from hashes of WDL, imports.zip and input JSON.
+        Cached result is ignored if --force-revalidation.
+        """
+        if self._ignore_womtool:
+            return
+        cache = None
+        if self._cache_dir is not None:
+            cache = CaperCache(
+                self._cache_dir, CaperCache.NAMESPACE_WOMTOOL,
+                ext='.json', max_size=self._max_cache_size * 1024 * 1024)
+            key = self.__get_womtool_cache_key(wdl, input_file, imports)
+            if not self._force_revalidation and cache.get(key) is not None:
+                logger.info(
+                    'Skipped validating WDL/input JSON with womtool. '
+                    'They have been validated before.')
+                logger.debug(
+                    'Womtool cache stats: {s}'.format(s=cache.stats))
+                return
+
+        if imports or not use_server or \
+                not self.__validate_with_womtool_on_server(wdl, input_file):
+            self.__validate_with_standalone_womtool(wdl, input_file, imports)
+        else:
+            # server's womtool can be on a different Cromwell version
+            # so its result is not cached as if --womtool validated it
+            return
+
+        if cache is not None:
+            cache.write(key, json.dumps({
+                'wdl': wdl,
+                'imports': imports,
+                'inputs': input_file,
+                'womtool': self._womtool,
+                'validated_at': datetime.now().isoformat()
+            }))
+            logger.debug(
+                'Womtool cache stats: {s}'.format(s=cache.stats))
+
+    def __get_womtool_cache_key(self, wdl, input_file, imports):
+        """md5 hash of womtool JAR's location and contents of
+        WDL, imports.zip and input JSON.
+        """
+        h = hashlib.md5()
+        h.update('{womtool}\t{wdl}\t{imports}\t{inputs}'.format(
+            womtool=self._womtool,
+            wdl=Caper.__get_file_md5(wdl),
+            imports=Caper.__get_file_md5(imports) if imports else '',
+            inputs=Caper.__get_file_md5(input_file)).encode())
+        return h.hexdigest()
+
+    def __validate_with_standalone_womtool(self, wdl, input_file, imports):
+        """Validate with a standalone womtool JAR on a new JVM.
+        Exits if invalid.
+        """
+        with TemporaryDirectory() as tmp_d:
+            if imports:
+                # copy WDL to temp dir and unpack imports.zip (sub WDLs) if exists
+                wdl_copy = os.path.join(tmp_d, AutoURI(self._wdl).basename)
+                AutoURI(wdl).cp(wdl_copy)
+                shutil.unpack_archive(imports, tmp_d)
+            else:
+                wdl_copy = wdl
+            cmd_womtool = ['java', '-Xmx512M', '-jar', '-DLOG_LEVEL=INFO',
+                           install_womtool_jar(self._womtool),
+                           'validate', wdl_copy,
+                           '-i', input_file]
+            try:
+                logger.info('Validating WDL/input JSON with womtool...')
+                check_call(cmd_womtool)
+            except CalledProcessError as e:
+                logger.error('Womtool: WDL or input JSON is invalid '
+                             'or input JSON doesn\'t exist.')
+                rc = e.returncode
+                sys.exit(rc)
+
+    def __validate_with_womtool_on_server(self, wdl, input_file):
+        """Validate with Cromwell server's built-in womtool.
+        Exits if invalid.
+
+        Returns:
+            True if validated. False if server is not available.
+        """
+        r = self._cromwell_rest_api.describe(wdl, inputs_file=input_file)
+        if r is None or 'valid' not in r:
+            logger.debug(
+                'Cromwell server is not available for validation. '
+                'Using standalone womtool.')
+            return False
+        if not r['valid']:
+            logger.error(
+                'Womtool: WDL or input JSON is invalid '
+                'or input JSON doesn\'t exist. errors={e}'.format(
+                    e=r.get('errors')))
+            sys.exit(1)
+        logger.info(
+            'Validated WDL/input JSON with Cromwell server\'s womtool.')
+        return True
 
     def __init_cromwell_rest_api(self, action, ip, port,
                                  no_server_hearbeat,
                                  server_hearbeat_file,
-                                 server_hearbeat_timeout):
+                                 server_hearbeat_timeout,
+                                 rest_pool_size=None,
+                                 rest_max_retries=None,
+                                 rest_max_workers=None):
         self._no_server_hearbeat = no_server_hearbeat
         self._server_hearbeat_file = server_hearbeat_file
+        self._server_located = False
         self._ip, self._port = \
             self.__read_heartbeat_file(action, ip, port, server_hearbeat_timeout)
+        # a server is explicitly located if ip/port are given and not defaults
+        if self._ip is not None and self._port is not None and \
+                (self._ip, str(self._port)) != \
+                (Caper.DEFAULT_SERVER_IP, str(Caper.DEFAULT_SERVER_PORT)):
+            self._server_located = True
 
         self._cromwell_rest_api = CromwellRestAPI(
-            ip=self._ip, port=self._port)
+            ip=self._ip, port=self._port,
+            pool_size=CromwellRestAPI.DEFAULT_POOL_SIZE
+            if rest_pool_size is None else rest_pool_size,
+            max_retries=CromwellRestAPI.DEFAULT_MAX_RETRIES
+            if rest_max_retries is None else rest_max_retries,
+            max_workers=CromwellRestAPI.DEFAULT_MAX_WORKERS
+            if rest_max_workers is None else rest_max_workers)
 
     def __read_heartbeat_file(self, action, ip, port, server_hearbeat_timeout):
         if not self._no_server_hearbeat and self._server_hearbeat_file is not None:
@@ -574,6 +833,7 @@ class Caper(object):
                         if (time.time() - f_time) * 1000.0 < server_hearbeat_timeout:
                             with open(self._server_hearbeat_file, 'r') as fp:
                                 ip, port = fp.read().strip('\n').split(':')
+                            self._server_located = True
                 except:
                     logger.warning(
                         'Failed to read server_heartbeat_file: {f}'.format(
@@ -602,37 +862,229 @@ class Caper(object):
                 if self._stop_heartbeat_thread:
                     break
 
-    def __write_metadata_jsons(self, workflow_ids):
-        for wf_id in workflow_ids.copy():
-            for trial in range(Caper.MAX_RETRY_UPDATING_METADATA + 1):
-                try:
-                    time.sleep(Caper.SEC_INTERVAL_RETRY_UPDATING_METADATA)
-                    # get metadata for wf_id
-                    m = self._cromwell_rest_api.get_metadata([wf_id])
-                    assert(len(m) == 1)
-                    metadata = m[0]
-                    if 'labels' in metadata and \
-                            'caper-backend' in metadata['labels']:
-                        backend = \
-                            metadata['labels']['caper-backend']
-                    else:
-                        backend = None
+    def __update_metadata_json(self, workflow_id, finished=False):
+        """Retrieve metadata from Cromwell server and write metadata.json.
+        This is called from server's metadata writers on a thread pool.
+        Raises an exception on failure.
 
-                    if backend is not None:
-                        self.__write_metadata_json(
-                            wf_id, metadata,
-                            backend=backend,
-                            wdl=metadata['workflowName'])
-                except Exception as e:
-                    logger.warning(
-                        '[Caper] Exception caught while retrieving '
-                        'metadata from Cromwell server. '
-                        'trial: {t}, wf_id: {wf_id}, e: {e}'.format(
-                            t=trial, wf_id=wf_id, e=str(e)))
-                break
-
-    def __write_metadata_json(self, workflow_id, metadata_json,
-                              backend=None, wdl=None):
+        In incremental mode (--metadata-update-mode incremental),
+        a tiny metadata with status of a workflow and its calls
+        is retrieved first for a running workflow. Full metadata is
+        retrieved only if such signature has changed since the last update.
+        metadata.json is not rewritten if its contents is not changed.
+
+        Args:
+            finished:
+                Workflow is finished. Full metadata is always retrieved and
+                all cached information for a workflow is flushed after that.
+        """
+        incremental = self._metadata_update_mode == \
+            Caper.METADATA_UPDATE_MODE_INCREMENTAL
+        signature = None
+        if incremental and not finished:
+            signature = self.__get_metadata_signature(workflow_id)
+            if signature == self._metadata_signatures.get(workflow_id):
+                logger.debug(
+                    'Skipped updating metadata.json (no status change): '
+                    '{wf_id}'.format(wf_id=workflow_id))
+                return
+
+        # labels and workflow name from a query result
+        # to find metadata.json's location
+        # without loading the whole metadata on memory
+        workflows = self._cromwell_rest_api.find([workflow_id])
+        if len(workflows) != 1:
+            raise Exception('Workflow not found on Cromwell server.')
+        workflow = workflows[0]
+        metadata_uri = None
+        if 'labels' in workflow and \
+                'caper-backend' in workflow['labels']:
+            backend = \
+                workflow['labels']['caper-backend']
+        else:
+            backend = None
+
+        if backend is not None:
+            if 'name' not in workflow:
+                raise Exception('Workflow name is not available yet.')
+            metadata_uri = self.__write_metadata_json(
+                workflow_id,
+                lambda fp: self._cromwell_rest_api.write_metadata(
+                    workflow_id, fp),
+                backend=backend,
+                wdl=workflow['name'],
+                skip_if_unchanged=incremental)
+
+        if self._workflow_mirror is not None:
+            # metadata.json is final only for a finished workflow
+            self._workflow_mirror.update(
+                workflow, metadata_uri=metadata_uri if finished else None)
+
+        if finished:
+            self._metadata_signatures.pop(workflow_id, None)
+            self._metadata_json_md5s.pop(workflow_id, None)
+        elif signature is not None:
+            self._metadata_signatures[workflow_id] = signature
+
+    def __sync_workflow_mirror_periodically(self):
+        """Sync a local mirror of workflows with Cromwell server.
+        All workflows are synced first and then active ones periodically.
+        """
+        full = True
+        while not self._stop_workflow_mirror_sync.is_set():
+            try:
+                n = self._workflow_mirror.sync(
+                    self._cromwell_rest_api, full=full)
+                logger.debug(
+                    'Synced workflow mirror: {n} workflows'.format(n=n))
+                full = False
+            # CromwellRestAPI exits if it fails to connect to a server
+            except (Exception, SystemExit) as e:
+                logger.warning(
+                    'Failed to sync workflow mirror. {e}'.format(e=str(e)))
+            self._stop_workflow_mirror_sync.wait(
+                Caper.SEC_INTERVAL_SYNC_WORKFLOW_MIRROR)
+
+    def __update_workflow_mirror(self, workflow_id):
+        """Add a started workflow to a local mirror of workflows.
+        This is called from server's thread pool.
+        """
+        workflows = self._cromwell_rest_api.find([workflow_id])
+        if len(workflows) != 1:
+            raise Exception('Workflow not found on Cromwell server.')
+        self._workflow_mirror.update(workflows[0])
+
+    def __open_workflow_mirror(self):
+        """Open a local mirror of workflows for a client.
+
+        Returns:
+            WorkflowMirror object. None if --live or a mirror is not
+            available (not written by a server yet).
+        """
+        if self._live or not self._workflow_mirror_db:
+            return None
+        db_file = WorkflowMirror.get_db_file_for_server(
+            self._workflow_mirror_db, self._ip, self._port)
+        if not os.path.exists(db_file):
+            return None
+        mirror = WorkflowMirror(db_file)
+        if len(mirror) == 0:
+            mirror.close()
+            return None
+        logger.info(
+            'Reading from a local mirror of workflows: {db}. '
+            'Use --live to query a Cromwell server.'.format(db=db_file))
+        return mirror
+
+    def __find_in_workflow_mirror(self, mirror):
+        """Find workflows matching each of self._wf_id_or_label
+        (workflow ID or string label) in a local mirror of workflows.
+
+        Returns:
+            Tuple of (list of workflow JSONs found in a mirror,
+            list of values in self._wf_id_or_label not found in a mirror).
+        """
+        workflows = {}
+        missing = []
+        for v in self._wf_id_or_label:
+            found = mirror.find([v], [(Caper.KEY_CAPER_STR_LABEL, v)])
+            if not found:
+                missing.append(v)
+            for w in found:
+                workflows.setdefault(w['id'], w)
+        return list(workflows.values()), missing
+
+    def __get_metadata_or_uris(self):
+        """Find metadata for workflows matching self._wf_id_or_label.
+        A Cromwell server is queried for any workflow ID or label
+        not found in a local mirror of workflows.
+
+        Returns:
+            List of metadata (dict) retrieved from a Cromwell server or
+            URI of metadata.json for a finished workflow found in
+            a local mirror of workflows.
+        """
+        labels = [(Caper.KEY_CAPER_STR_LABEL, v)
+                  for v in self._wf_id_or_label]
+        mirror = self.__open_workflow_mirror()
+        if mirror is None:
+            return self._cromwell_rest_api.get_metadata(
+                self._wf_id_or_label, labels)
+        try:
+            workflows, missing = self.__find_in_workflow_mirror(mirror)
+            workflow_ids = [w['id'] for w in workflows]
+            metadata_uris = mirror.get_metadata_uris(workflow_ids)
+        finally:
+            mirror.close()
+
+        result = []
+        for wf_id in workflow_ids:
+            metadata_uri = metadata_uris.get(wf_id)
+            if metadata_uri is not None and AutoURI(metadata_uri).exists:
+                result.append(metadata_uri)
+            else:
+                result.extend(self._cromwell_rest_api.get_metadata([wf_id]))
+        if missing:
+            # can be submitted after the last sync of a mirror
+            found = set(workflow_ids)
+            result.extend(
+                m for m in self._cromwell_rest_api.get_metadata(
+                    missing,
+                    [(Caper.KEY_CAPER_STR_LABEL, v) for v in missing])
+                if m.get('id') not in found)
+        return result
+
+    def __get_metadata_from_server(self, workflow_id, include_keys=None):
+        """Retrieve metadata JSON for a workflow.
+        Raises an exception on failure.
+        """
+        m = self._cromwell_rest_api.get_metadata(
+            [workflow_id], include_keys=include_keys)
+        if len(m) != 1:
+            raise Exception('Workflow not found on Cromwell server.')
+        metadata = m[0]
+        if CromwellRestAPI.is_error_response(metadata):
+            raise Exception(metadata['message'])
+        return metadata
+
+    def __get_metadata_signature(self, workflow_id):
+        """Signature of a workflow's progress from a tiny metadata
+        with status of a workflow and its calls.
+
+        Returns:
+            Tuple of (workflow's status, number of calls,
+                      sorted tuple of (call's status, count))
+        """
+        metadata = self.__get_metadata_from_server(
+            workflow_id, include_keys=Caper.METADATA_SIGNATURE_KEYS)
+        calls = metadata.get('calls') or {}
+        cnt = Counter(
+            str(shard.get('executionStatus'))
+            for shards in calls.values() for shard in shards)
+        return (metadata.get('status'),
+                sum(cnt.values()),
+                tuple(sorted(cnt.items())))
+
+    def __write_metadata_json(self, workflow_id, write_to,
+                              backend=None, wdl=None,
+                              skip_if_unchanged=False):
+        """Write metadata.json without loading the whole metadata on memory.
+        Metadata JSON is written to a local temporary file chunk by chunk.
+        Then it's atomically moved to a local destination or uploaded to
+        a GCS/S3 destination. GCS/S3 clients upload a large file
+        in multiple chunks/parts.
+
+        Args:
+            write_to:
+                Function that takes a binary file object and writes
+                metadata JSON to it chunk by chunk.
+            skip_if_unchanged:
+                Skip writing if md5 hash of metadata.json is the same as
+                that of the last one written for a workflow.
+
+        Returns:
+            URI of metadata.json. It's metadata.json.gz if --gzip-metadata.
+        """
         if backend is None:
             backend = self._backend
         if backend is None:
@@ -658,8 +1110,48 @@ class Caper(object):
             metadata_uri = os.path.join(
                 path, Caper.TMP_FILE_BASENAME_METADATA_JSON)
 
-        return AutoURI(metadata_uri).write(
-            json.dumps(metadata_json, indent=4))
+        if self._gzip_metadata and not metadata_uri.endswith('.gz'):
+            metadata_uri += '.gz'
+
+        # can be called from multiple threads (server's metadata writers)
+        u = AutoURI(metadata_uri, thread_id=get_ident())
+        with TemporaryDirectory() as tmp_d:
+            if isinstance(u, AbsPath):
+                u.mkdir_dirname()
+                # on the same filesystem for an atomic move
+                tmp_file = '{uri}.{pid}.{tid}.tmp'.format(
+                    uri=metadata_uri, pid=os.getpid(), tid=get_ident())
+            else:
+                tmp_file = os.path.join(tmp_d, u.basename)
+            try:
+                with open(tmp_file, 'wb') as fp:
+                    if self._gzip_metadata:
+                        # mtime=0 for the same md5 hash for the same contents
+                        with gzip.GzipFile(
+                                fileobj=fp, mode='wb', mtime=0) as fp_gz:
+                            write_to(fp_gz)
+                    else:
+                        write_to(fp)
+
+                if skip_if_unchanged:
+                    md5 = AbsPath(tmp_file).md5
+                    if self._metadata_json_md5s.get(workflow_id) == md5:
+                        logger.debug(
+                            'Skipped writing metadata.json (unchanged): '
+                            '{uri}'.format(uri=metadata_uri))
+                        return metadata_uri
+
+                if isinstance(u, AbsPath):
+                    os.replace(tmp_file, metadata_uri)
+                else:
+                    AbsPath(tmp_file).cp(u, no_checksum=True)
+            finally:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+
+        if skip_if_unchanged:
+            self._metadata_json_md5s[workflow_id] = md5
+        return metadata_uri
 
     def __create_input_json_file(
             self, directory, fname='inputs.json'):
@@ -677,10 +1169,26 @@ class Caper(object):
                 else:
                     uri_cls = AbsPath
 
-                new_uri = uri_cls.localize(
-                    self._inputs,
-                    recursive=True,
-                    make_md5_file=True)
+                if self._cache_dir is not None:
+                    manifest_dir = os.path.join(
+                        self._cache_dir, CaperCache.NAMESPACE_DEEPCOPY)
+                    checksum_index = CaperChecksumIndex(os.path.join(
+                        self._cache_dir, CaperCache.NAMESPACE_CHECKSUM))
+                else:
+                    manifest_dir = None
+                    checksum_index = None
+                try:
+                    new_uri = CaperDeepcopy(
+                        uri_cls,
+                        make_md5_file=True,
+                        num_threads=self._deepcopy_num_threads,
+                        manifest_dir=manifest_dir,
+                        checksum_index=checksum_index).deepcopy(self._inputs)
+                finally:
+                    if checksum_index is not None:
+                        logger.debug('Checksum index stats: {s}'.format(
+                            s=checksum_index.stats))
+                        checksum_index.close()
             else:
                 new_uri = self._inputs
             # localize again on local
@@ -844,164 +1352,168 @@ class Caper(object):
     def __create_imports_zip_file_from_wdl(
             self, directory, fname=TMP_FILE_BASENAME_IMPORTS_ZIP):
         zip_file = os.path.join(directory, fname)
-        if CaperWDLParser(self._wdl).zip_subworkflows(zip_file):
+        if self._cache_dir is not None:
+            cache = CaperCache(
+                self._cache_dir, CaperCache.NAMESPACE_IMPORTS_ZIP,
+                ext='.zip', max_size=self._max_cache_size * 1024 * 1024)
+        else:
+            cache = None
+        if CaperWDLParser(self._wdl).zip_subworkflows(zip_file, cache=cache):
             return zip_file
         return None
 
     def __create_backend_conf_file(
             self, directory, fname=TMP_FILE_BASENAME_BACKEND_CONF):
-        """Creates Cromwell's backend conf file
+        """Creates Cromwell's backend conf file.
+
+        Backend conf is a pure function of settings (including contents of
+        a user's backend conf file) so that it's generated only once for
+        the same settings. It's memoized in memory and also cached on
+        a local cache directory (--cache-dir) with a hash of settings as key.
+        A file is not rewritten if it's not changed.
         """
-        backend_str = self.__get_backend_conf_str()
+        settings = self.__get_backend_conf_settings()
         backend_file = os.path.join(directory, fname)
+
+        if self._cache_dir is not None:
+            cache = CaperCache(
+                self._cache_dir, CaperCache.NAMESPACE_BACKEND_CONF,
+                ext='.conf', max_size=self._max_cache_size * 1024 * 1024)
+            key = get_settings_hash(settings)
+            cached_file = cache.get(key)
+            if cached_file is not None:
+                with open(cached_file, 'r') as fp:
+                    backend_str = fp.read()
+            else:
+                backend_str = get_backend_conf_str(settings)
+                cache.write(key, backend_str)
+        else:
+            backend_str = get_backend_conf_str(settings)
+
+        if os.path.exists(backend_file):
+            with open(backend_file, 'r') as fp:
+                if fp.read() == backend_str:
+                    return backend_file
         with open(backend_file, 'w') as fp:
             fp.write(backend_str)
         return backend_file
 
-    def __get_backend_conf_str(self):
-        """
-        Initializes the following backend stanzas,
-        which are defined in "backend" {} in a Cromwell's backend
-        configuration file:
-            1) local: local backend
-            2) gc: Google Cloud backend (optional)
-            3) aws: AWS backend (optional)
-            4) slurm: SLURM (optional)
-            5) sge: SGE (optional)
-            6) pbs: PBS (optional)
-
-        Also, initializes the following common non-"backend" stanzas:
-            a) common: base stanzas
-            b) mysql: connect to MySQL (optional)
-
-        Then converts it to a HOCON string
+    def __get_backend_conf_settings(self):
+        """Effective settings for Cromwell's backend conf.
+
+        Returns:
+            dict of settings for caper_backend_conf.make_backend_conf_str().
         """
-        # init backend dict
-        backend_dict = {}
-
-        # common stanza for backend conf file
-        merge_dict(
-            backend_dict,
-            CaperBackendCommon(
-                port=self._port,
-                disable_call_caching=self._disable_call_caching,
-                max_concurrent_workflows=self._max_concurrent_workflows))
-
-        # common settings for all backends
-        if self._max_concurrent_tasks is not None:
-            CaperBackendBase.CONCURRENT_JOB_LIMIT = self._max_concurrent_tasks
-
-        # common settings for local-based backends
-        if self._soft_glob_output is not None:
-            CaperBackendBaseLocal.USE_SOFT_GLOB_OUTPUT = self._soft_glob_output
-        if self._out_dir is not None:
-            CaperBackendBaseLocal.OUT_DIR = self._out_dir
-
-        # local backend
-        merge_dict(
-            backend_dict,
-            CaperBackendLocal())
-
-        # GC
-        if self._gcp_prj is not None and self._out_gcs_bucket is not None:
-            merge_dict(
-                backend_dict,
-                CaperBackendGCP(
-                    gcp_prj=self._gcp_prj,
-                    out_gcs_bucket=self._out_gcs_bucket,
-                    call_caching_dup_strat=self._gcp_call_caching_dup_strat))
-
-        # AWS
-        if self._aws_batch_arn is not None and self._aws_region is not None \
-                and self._out_s3_bucket is not None:
-            merge_dict(
-                backend_dict,
-                CaperBackendAWS(
-                    aws_batch_arn=self._aws_batch_arn,
-                    aws_region=self._aws_region,
-                    out_s3_bucket=self._out_s3_bucket))
-
-        # SLURM
-        merge_dict(
-            backend_dict,
-            CaperBackendSLURM(
-                partition=self._slurm_partition,
-                account=self._slurm_account,
-                extra_param=self._slurm_extra_param))
-
-        # SGE
-        merge_dict(
-            backend_dict,
-            CaperBackendSGE(
-                pe=self._sge_pe,
-                queue=self._sge_queue,
-                extra_param=self._sge_extra_param))
-
-        # PBS
-        merge_dict(
-            backend_dict,
-            CaperBackendPBS(
-                queue=self._pbs_queue,
-                extra_param=self._pbs_extra_param))
-
-        # Database
-        merge_dict(
-            backend_dict,
-            CaperBackendDatabase(
-                db_type=self._db,
-                db_timeout=self._db_timeout,
-                file_db=self._file_db,
-                mysql_ip=self._mysql_db_ip,
-                mysql_port=self._mysql_db_port,
-                mysql_user=self._mysql_db_user,
-                mysql_password=self._mysql_db_password,
-                mysql_name=self._mysql_db_name,
-                postgresql_ip=self._postgresql_db_ip,
-                postgresql_port=self._postgresql_db_port,
-                postgresql_user=self._postgresql_db_user,
-                postgresql_password=self._postgresql_db_password,
-                postgresql_name=self._postgresql_db_name))
-
-        # set header for conf ("include ...")
-        assert(Caper.BACKEND_CONF_HEADER.endswith('\n'))
-        lines_header = [Caper.BACKEND_CONF_HEADER]
-
-        # override with user-specified backend.conf if exists
         if self._backend_file is not None:
-            lines_wo_header = []
-
-            with open(AbsPath.localize(self._backend_file),
-                      'r') as fp:
-                for line in fp.readlines():
-                    # find header and exclude
-                    if re.findall(Caper.RE_PATTERN_BACKEND_CONF_HEADER,
-                                  line):
-                        if line not in lines_header:
-                            lines_header.append(line)
-                    else:
-                        lines_wo_header.append(line)
-
-            # parse HOCON to JSON to dict
-            c = ConfigFactory.parse_string(''.join(lines_wo_header))
-            j = HOCONConverter.to_json(c)
-            d = json.loads(j)
-            # apply to backend conf
-            merge_dict(backend_dict, d)
-
-        # use default backend (local) if not specified
-        if self._backend is not None:
-            backend_dict['backend']['default'] = self._backend
+            with open(AbsPath.localize(self._backend_file), 'r') as fp:
+                backend_file_contents = fp.read()
         else:
-            backend_dict['backend']['default'] = Caper.DEFAULT_BACKEND
+            backend_file_contents = None
+
+        return {
+            # use default backend (local) if not specified
+            'default_backend': self._backend
+            if self._backend is not None else Caper.DEFAULT_BACKEND,
+            'port': self._port,
+            'disable_call_caching': self._disable_call_caching,
+            'max_concurrent_workflows': self._max_concurrent_workflows,
+            'max_concurrent_tasks': self._max_concurrent_tasks,
+            'job_rate': self._job_rate,
+            'job_burst': self._job_burst,
+            'submit_max_retries': self._submit_max_retries,
+            'check_alive_max_retries': self._check_alive_max_retries,
+            'retry_backoff_sec': self._retry_backoff_sec,
+            'retry_max_backoff_sec': self._retry_max_backoff_sec,
+            'retry_jitter': self._retry_jitter,
+            'soft_glob_output': bool(self._soft_glob_output),
+            'out_dir': self._out_dir,
+            'script_epilogue_mode': self._script_epilogue_mode,
+            'script_epilogue_wait_sec': self._script_epilogue_wait_sec or 0,
+            'gcp_prj': self._gcp_prj,
+            'out_gcs_bucket': self._out_gcs_bucket,
+            'gcp_call_caching_dup_strat': self._gcp_call_caching_dup_strat,
+            'aws_batch_arn': self._aws_batch_arn,
+            'aws_region': self._aws_region,
+            'out_s3_bucket': self._out_s3_bucket,
+            'local_slot_dir': self._local_slot_dir
+            if self._local_slot else None,
+            'local_max_cpu': self._local_max_cpu,
+            'local_max_memory_mb': self._local_max_memory_mb,
+            'slurm_partition': self._slurm_partition,
+            'slurm_account': self._slurm_account,
+            'slurm_extra_param': self._slurm_extra_param,
+            'slurm_array_dir': self._slurm_array_dir
+            if self.__use_slurm_array_broker() else None,
+            'sge_pe': self._sge_pe,
+            'sge_queue': self._sge_queue,
+            'sge_extra_param': self._sge_extra_param,
+            'pbs_queue': self._pbs_queue,
+            'pbs_extra_param': self._pbs_extra_param,
+            'cluster_status_dir': self._cluster_status_dir
+            if self.__use_cluster_status_cache() else None,
+            'db': self._db,
+            'db_timeout': self._db_timeout,
+            'file_db': self._file_db,
+            'mysql_db_ip': self._mysql_db_ip,
+            'mysql_db_port': self._mysql_db_port,
+            'mysql_db_user': self._mysql_db_user,
+            'mysql_db_password': self._mysql_db_password,
+            'mysql_db_name': self._mysql_db_name,
+            'postgresql_db_ip': self._postgresql_db_ip,
+            'postgresql_db_port': self._postgresql_db_port,
+            'postgresql_db_user': self._postgresql_db_user,
+            'postgresql_db_password': self._postgresql_db_password,
+            'postgresql_db_name': self._postgresql_db_name,
+            'backend_file_contents': backend_file_contents,
+        }
 
-        # dict to HOCON (excluding header)
-        backend_hocon = ConfigFactory.from_dict(backend_dict)
-        # write header to HOCON string
-        backend_str = ''.join(lines_header)
-        # convert HOCON to string
-        backend_str += HOCONConverter.to_hocon(backend_hocon)
+    def __use_cluster_status_cache(self):
+        return not self._no_cluster_status_cache and \
+            self._cluster_status_dir is not None
 
-        return backend_str
+    def __start_cluster_status_cache(self):
+        """Start a daemon thread for a cluster status cache
+        if backend is SLURM, SGE or PBS.
+
+        Returns:
+            ClusterStatusCache object. None if not started.
+        """
+        if not self.__use_cluster_status_cache() or \
+                self._backend not in ClusterStatusCache.BACKENDS:
+            return None
+        cache = ClusterStatusCache(
+            self._backend,
+            cluster_status_dir=self._cluster_status_dir,
+            sec_interval=self._cluster_status_interval
+            if self._cluster_status_interval else
+            ClusterStatusCache.SEC_DEFAULT_INTERVAL)
+        cache.start()
+        return cache
+
+    def __use_slurm_array_broker(self):
+        return self._slurm_array_broker and \
+            self._slurm_array_dir is not None
+
+    def __start_slurm_array_broker(self):
+        """Start a daemon thread for a SLURM array broker
+        if backend is SLURM.
+
+        Returns:
+            SlurmArrayBroker object. None if not started.
+        """
+        if not self.__use_slurm_array_broker() or \
+                self._backend != BACKEND_SLURM:
+            return None
+        broker = SlurmArrayBroker(
+            slurm_array_dir=self._slurm_array_dir,
+            sec_window=self._slurm_array_window
+            if self._slurm_array_window else
+            SlurmArrayBroker.SEC_DEFAULT_WINDOW,
+            max_array_size=self._slurm_array_max_size
+            if self._slurm_array_max_size else
+            SlurmArrayBroker.DEFAULT_MAX_ARRAY_SIZE)
+        broker.start()
+        return broker
 
     def __get_wdl_basename_wo_ext(self):
         if self._wdl is not None:
@@ -1041,6 +1553,9 @@ class Caper(object):
     @staticmethod
     def __get_workflow_ids_from_cromwell_stdout(stdout):
         result = []
+        # skip regex matching for most lines without a workflow actor
+        if 'WorkflowActor-' not in stdout:
+            return result
         for line in stdout.split('\n'):
             r1 = re.findall(Caper.RE_PATTERN_STARTED_WORKFLOW_ID, line)
             if len(r1) > 0:
@@ -1058,152 +1573,117 @@ class Caper(object):
                 return True
         return False
 
+    @staticmethod
+    def __read_metadata_json(metadata_uri):
+        """Read metadata.json (or metadata.json.gz) on any URI.
+        """
+        b = AutoURI(metadata_uri).read(byte=True)
+        if metadata_uri.endswith('.gz'):
+            b = gzip.decompress(b)
+        return json.loads(b.decode())
+
+    @staticmethod
+    def __get_file_md5(f):
+        h = hashlib.md5()
+        with open(f, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @staticmethod
+    def __split_comma_list(s):
+        if not s:
+            return None
+        return [v.strip() for v in s.split(',') if v.strip()]
+
     @staticmethod
     def __get_time_str():
         return datetime.now().strftime('%Y%m%d_%H%M%S_%f')
 
     @staticmethod
-    def __troubleshoot(metadata_json, show_completed_task=False):
+    def __troubleshoot(metadata_json, show_completed_task=False,
+                       stderr_fetcher=None):
         """Troubleshoot from metadata JSON obj/file
+
+        Args:
+            stderr_fetcher:
+                StderrFetcher object to fetch tasks' stderr files.
         """
-        if isinstance(metadata_json, dict):
-            metadata = metadata_json
+        if stderr_fetcher is None:
+            stderr_fetcher = StderrFetcher()
+        if isinstance(metadata_json, (dict, list)):
+            index = MetadataIndex.from_dict(metadata_json)
         else:
-            f = AbsPath.localize(metadata_json)
-            with open(f, 'r') as fp:
-                metadata = json.loads(fp.read())
-        if isinstance(metadata, list):
-            metadata = metadata[0]
-
-        workflow_id = metadata['id']
-        workflow_status = metadata['status']
-        logger.info('Troubleshooting {wf_id} ...'.format(wf_id=workflow_id))
-        if not show_completed_task and workflow_status == 'Succeeded':
+            # metadata JSON file is parsed incrementally
+            index = MetadataIndex.from_file(AbsPath.localize(metadata_json))
+
+        logger.info('Troubleshooting {wf_id} ...'.format(
+            wf_id=index.workflow_id))
+        if not show_completed_task and index.status == 'Succeeded':
             logger.info(
                 'This workflow ran successfully. There is nothing to troubleshoot')
             return
-
-        def recurse_calls(calls, failures=None, show_completed_task=False):
-            if failures is not None:
-                s = json.dumps(failures, indent=4)
-                logger.info('Found failures:\n{s}'.format(s=s))
-            for task_name, call_ in calls.items():
-                for call in call_:
-                    # if it is a subworkflow, then recursively dive into it
-                    if 'subWorkflowMetadata' in call:
-                        subworkflow = call['subWorkflowMetadata']
-                        recurse_calls(
-                            subworkflow['calls'],
-                            subworkflow['failures']
-                            if 'failures' in subworkflow else None,
-                            show_completed_task)
-                        continue
-                    task_status = call['executionStatus']
-                    shard_index = call['shardIndex']
-                    rc = call['returnCode'] if 'returnCode' in call else None
-                    job_id = call['jobId'] if 'jobId' in call else None
-                    stdout = call['stdout'] if 'stdout' in call else None
-                    stderr = call['stderr'] if 'stderr' in call else None
-                    run_start = None
-                    run_end = None
-                    if 'executionEvents' in call:
-                        for ev in call['executionEvents']:
-                            if ev['description'].startswith('Running'):
-                                run_start = ev['startTime']
-                                run_end = ev['endTime']
-                                break
-
-                    if not show_completed_task and \
-                            task_status in ('Done', 'Succeeded'):
-                        continue
-                    print(
-                        '\n{tn} {ts}. SHARD_IDX={shard_id}, RC={rc}, JOB_ID={job_id}, '
-                        'RUN_START={start}, RUN_END={end}, '
-                        'STDOUT={stdout}, STDERR={stderr}'.format(
-                            tn=task_name, ts=task_status,
-                            shard_id=shard_index, rc=rc, job_id=job_id,
-                            start=run_start, end=run_end,
-                            stdout=stdout, stderr=stderr))
-
-                    if stderr is not None:
-                        u = AutoURI(stderr)
-                        if u.is_valid and u.exists:
-                            local_stderr_f = AbsPath.localize(u)
-                            with open(local_stderr_f, 'r') as fp:
-                                stderr_contents = fp.read()
-                            print('STDERR_CONTENTS=\n{}'.format(
-                                stderr_contents))
-
-        calls = metadata['calls']
-        failures = metadata['failures'] if 'failures' in metadata else None
-        recurse_calls(calls, failures, show_completed_task)
+        logger.info('Number of calls for each status: {s}'.format(
+            s=dict(index.summary()['*'])))
+
+        # list of (message to be printed, stderr URI or None)
+        # failures of a (sub)workflow come before its calls
+        records = []
+        failures = index.failures
+        j = 0
+
+        def add_failures(f):
+            s = json.dumps(f, indent=4)
+            records.append(('Found failures:\n{s}'.format(s=s), None))
+
+        for i, call in enumerate(index.calls):
+            while j < len(failures) and failures[j][0] <= i:
+                add_failures(failures[j][2])
+                j += 1
+            if not show_completed_task and \
+                    call.status in MetadataIndex.COMPLETED_STATUSES:
+                continue
+            records.append((
+                '\n{tn} {ts}. SHARD_IDX={shard_id}, RC={rc}, JOB_ID={job_id}, '
+                'RUN_START={start}, RUN_END={end}, '
+                'STDOUT={stdout}, STDERR={stderr}'.format(
+                    tn=call.task, ts=call.status,
+                    shard_id=call.shard_index, rc=call.rc, job_id=call.job_id,
+                    start=call.run_start, end=call.run_end,
+                    stdout=call.stdout, stderr=call.stderr),
+                call.stderr))
+        for _, _, f in failures[j:]:
+            add_failures(f)
+
+        # stderr files are fetched concurrently ahead of printing
+        # and printed in order as soon as they are ready
+        fetched = stderr_fetcher.fetch(stderr for _, stderr in records)
+        for (msg, stderr), (_, result) in zip(records, fetched):
+            if stderr is None:
+                logger.info(msg)
+                continue
+            print(msg, flush=True)
+            if result is None:
+                continue
+            if stderr_fetcher.tail_size is None:
+                print('STDERR_CONTENTS=')
+                StderrFetcher.print_file(result)
+                print()
+            else:
+                print('STDERR_CONTENTS (last {n} bytes)=\n{s}'.format(
+                    n=stderr_fetcher.tail_size,
+                    s=result.decode(errors='replace')), flush=True)
 
     @staticmethod
     def __find_singularity_bindpath(input_json_file):
         """Find paths to be bound for singularity
         by finding common roots for all files in input JSON file.
-        This function will recursively visit all values in input JSON and
-        also JSON, TSV, CSV files in the input JSON itself.
-
-        This function visit all files in input JSON.
-        Files with some extensions (defined by Autouri's URIBase.LOC_RECURSE_EXT_AND_FNC)
-        are recursively visited.
+        See singularity_bindpath.find_bindpath() for details.
 
         Args:
             input_json_file:
                 localized input JSON file so that all files in it are already
                 recursively localized
         """
-        with open(input_json_file, 'r') as fp:
-            input_json_contents = fp.read()
-
-        all_dirnames = []
-        def find_dirname(s):
-            u = AbsPath(s)
-            if u.is_valid:
-                for ext, recurse_fnc_for_ext in URIBase.LOC_RECURSE_EXT_AND_FNC.items():
-                    if u.ext == ext:
-                        _, _ = recurse_fnc_for_ext(u.read(), find_dirname)
-                # file can be a soft-link
-                # singularity will want to have access to both soft-link and real one
-                # so add dirnames of both soft-link and realpath
-                all_dirnames.append(u.dirname)
-                all_dirnames.append(os.path.dirname(os.path.realpath(u.uri)))
-            return None, False
-        _, _ = recurse_json(input_json_contents, find_dirname)
-
-        # add all (but not too high level<4) parent directories
-        # to all_dirnames. start from original
-        # e.g. /a/b/c/d/e/f/g/h with COMMON_ROOT_SEARCH_LEVEL = 5
-        # add all the followings:
-        # /a/b/c/d/e/f/g/h (org)
-        # /a/b/c/d/e/f/g
-        # /a/b/c/d/e/f
-        # /a/b/c/d/e
-        # /a/b/c/d (minimum level = COMMON_ROOT_SEARCH_LEVEL-1)
-        all_dnames_incl_parents = set(all_dirnames)
-        for d in all_dirnames:
-            dir_arr = d.split(os.sep)
-            for i, _ in enumerate(
-                    dir_arr[Caper.COMMON_ROOT_SEARCH_LEVEL:]):
-                d_child = os.sep.join(
-                    dir_arr[:i + Caper.COMMON_ROOT_SEARCH_LEVEL])
-                all_dnames_incl_parents.add(d_child)
-
-        bindpaths = set()
-        # remove overlapping directories
-        for i, d1 in enumerate(sorted(all_dnames_incl_parents,
-                                      reverse=True)):
-            overlap_found = False
-            for j, d2 in enumerate(sorted(all_dnames_incl_parents,
-                                          reverse=True)):
-                if i >= j:
-                    continue
-                if d1.startswith(d2):
-                    overlap_found = True
-                    break
-            if not overlap_found:
-                bindpaths.add(d1)
-
-        return ','.join(bindpaths)
+        return find_bindpath(input_json_file, Caper.COMMON_ROOT_SEARCH_LEVEL)
 
@@ -1,20 +1,29 @@
 import argparse
 import os
 import sys
-from configparser import ConfigParser
 from distutils.util import strtobool
 from .caper_backend import CaperBackendDatabase
 from .caper_backend import CaperBackendGCP
+from .caper_backend import CaperBackendBaseLocal
+from .caper_backend import CaperBackendCommon
 from .caper_backend import BACKENDS, BACKEND_LOCAL
 from .caper_backend import BACKEND_ALIAS_LOCAL
 from .caper_backend import BACKEND_ALIAS_SHERLOCK, BACKEND_ALIAS_SCG
+from .caper_cache import CaperCache
+from .caper_hook_args import add_hook_parsers, get_conf_parser
+from .caper_hook_args import get_parent_cluster_status, get_parent_local_slot
+from .caper_hook_args import get_parent_retry, get_parent_slurm_array
+from .caper_hook_args import read_caper_conf
+from .caper_hook_args import DEFAULT_CAPER_CONF
 from .caper_init import DEFAULT_CROMWELL_JAR, DEFAULT_WOMTOOL_JAR
+from .cromwell_rest_api import CromwellRestAPI
+from .slurm_array import SlurmArrayBroker
+from .workflow_table import WorkflowTable
 from . import __version__ as version
 
 
 DEFAULT_JAVA_HEAP_SERVER = '10G'
 DEFAULT_JAVA_HEAP_RUN = '3G'
-DEFAULT_CAPER_CONF = '~/.caper/default.conf'
 DEFAULT_SINGULARITY_CACHEDIR = '~/.caper/singularity_cachedir'
 DEFAULT_DB = CaperBackendDatabase.DB_TYPE_IN_MEMORY
 DEFAULT_MYSQL_DB_IP = 'localhost'
@@ -33,11 +42,23 @@ DEFAULT_MAX_CONCURRENT_TASKS = 1000
 DEFAULT_MAX_RETRIES = 1
 DEFAULT_PORT = 8000
 DEFAULT_IP = 'localhost'
+DEFAULT_REST_POOL_SIZE = CromwellRestAPI.DEFAULT_POOL_SIZE
+DEFAULT_REST_MAX_RETRIES = CromwellRestAPI.DEFAULT_MAX_RETRIES
+DEFAULT_REST_MAX_WORKERS = CromwellRestAPI.DEFAULT_MAX_WORKERS
 DEFAULT_FORMAT = 'id,status,name,str_label,user,submission'
 DEFAULT_DEEPCOPY_EXT = 'json,tsv'
+DEFAULT_DEEPCOPY_NUM_THREADS = 8
+DEFAULT_NUM_STDERR_FETCH_THREADS = 16
 DEFAULT_SERVER_HEARTBEAT_FILE = '~/.caper/default_server_heartbeat'
 DEFAULT_SERVER_HEARTBEAT_TIMEOUT_MS = 120000
+DEFAULT_WORKFLOW_MIRROR_DB = '~/.caper/default_workflow_mirror.db'
+DEFAULT_SLURM_ARRAY_WINDOW = 5
+DEFAULT_SLURM_ARRAY_MAX_SIZE = SlurmArrayBroker.DEFAULT_MAX_ARRAY_SIZE
+DEFAULT_SCRIPT_EPILOGUE_MODE = CaperBackendBaseLocal.SCRIPT_EPILOGUE_MODE_SLEEP_SYNC
+DEFAULT_SCRIPT_EPILOGUE_WAIT_SEC = 0
 DEFAULT_CONF_CONTENTS = '\n\n'
+DEFAULT_METADATA_UPDATE_MODE = 'incremental'
+DEFAULT_MAX_CACHE_SIZE_MB = 512
 DEFAULT_GCP_CALL_CACHING_DUP_STRAT = CaperBackendGCP.CALL_CACHING_DUP_STRAT_REFERENCE
 
 DYN_FLAGS = ['--singularity', '--docker']
@@ -82,15 +103,7 @@ def parse_caper_arguments():
         with open(default_caper_conf, 'w') as fp:
             fp.write(DEFAULT_CONF_CONTENTS)
 
-    conf_parser = argparse.ArgumentParser(
-        description=__doc__,
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-        add_help=False)
-    conf_parser.add_argument('-c', '--conf', help='Specify config file',
-                             metavar='FILE',
-                             default=DEFAULT_CAPER_CONF)
-    conf_parser.add_argument('-v', '--version', action='store_true',
-                             help='Show version')
+    conf_parser = get_conf_parser()
     known_args, remaining_argv = conf_parser.parse_known_args()
     if known_args.version is not None and known_args.version:
         print(version)
@@ -103,18 +116,7 @@ def parse_caper_arguments():
     if known_args.conf is not None:
         # resolve tilde (~) in conf path
         known_args.conf = os.path.expanduser(known_args.conf)
-        if os.path.exists(known_args.conf):
-            config = ConfigParser()
-            with open(known_args.conf, 'r') as fp:
-                conf_contents = fp.read()
-            if '[defaults]' not in conf_contents.split('\n'):
-                conf_contents = '[defaults]\n' + conf_contents
-            config.read_string(conf_contents)
-            d = dict(config.items('defaults'))
-            # remove keys with empty string
-            d = {k: v.strip('"\'') for k, v in d.items() if v != ''}
-            # replace - with _
-            defaults.update({k.replace('-', '_'): v for k, v in d.items()})
+        defaults.update(read_caper_conf(known_args.conf))
 
     parser = argparse.ArgumentParser(parents=[conf_parser])
     subparser = parser.add_subparsers(dest='action')
@@ -134,6 +136,14 @@ def parse_caper_arguments():
         help='Caper does not take any action.')
     parent_all.add_argument('-D', '--debug', action='store_true',
                    help='Prints all logs >= DEBUG level')
+    parent_all.add_argument(
+        '--cache-dir',
+        help='Local directory for Caper\'s caches (e.g. parsed WDLs and '
+             'imports.zip). Default: caper_cache/ under --tmp-dir.')
+    parent_all.add_argument(
+        '--max-cache-size', type=int, default=DEFAULT_MAX_CACHE_SIZE_MB,
+        help='Maximum size of each cache in MB. Least recently used files '
+             'are evicted when it\'s exceeded.')
 
     # run, server, submit
     parent_backend = argparse.ArgumentParser(add_help=False)
@@ -221,6 +231,18 @@ def parse_caper_arguments():
         type=int,
         help='Number of retries for failing tasks. '
              'equivalent to "maxRetries" in workflow options JSON file.')
+    group_cromwell.add_argument(
+        '--job-rate', type=float,
+        help='Number of tasks submitted per second on average for '
+             'all backends. "system.job-rate-control" in Cromwell '
+             'backend configuration. {v} if not defined.'.format(
+                 v=CaperBackendCommon.DEFAULT_JOB_RATE))
+    group_cromwell.add_argument(
+        '--job-burst', type=int,
+        help='Number of tasks submitted at once. Cromwell submits '
+             'this number of tasks every (job-burst / job-rate) seconds. '
+             '{v} if not defined.'.format(
+                 v=CaperBackendCommon.DEFAULT_JOB_BURST))
     group_cromwell.add_argument(
         '--disable-call-caching', action='store_true',
         help='Disable Cromwell\'s call caching, which re-uses outputs from '
@@ -236,6 +258,24 @@ def parse_caper_arguments():
              'i.e. gcp and aws. Also, '
              'it does not work with local backends (local/slurm/sge/pbs) '
              'with --docker. However, it works fine with --singularity.')
+    group_cromwell.add_argument(
+        '--script-epilogue-mode',
+        choices=CaperBackendBaseLocal.SCRIPT_EPILOGUE_MODES,
+        default=DEFAULT_SCRIPT_EPILOGUE_MODE,
+        help='Epilogue of each task\'s script for local backends '
+             '(local/slurm/sge/pbs). '
+             'sleep-sync: sleep for 10 seconds (30 for pbs) and sync all '
+             'filesystems of a node. '
+             'fsync: fsync only files written by a task. '
+             'Use --script-epilogue-wait-sec for a shared filesystem.')
+    group_cromwell.add_argument(
+        '--script-epilogue-wait-sec',
+        default=DEFAULT_SCRIPT_EPILOGUE_WAIT_SEC, type=int,
+        help='For --script-epilogue-mode fsync. Wait until the newest file '
+             'written by a task gets this number of seconds old so that '
+             'it becomes visible to other nodes on a shared filesystem '
+             '(e.g. NFS). It does not wait for a task which did not write '
+             'any file within this period.')
 
     group_local = parent_host.add_argument_group(
         title='local backend arguments')
@@ -243,6 +283,12 @@ def parse_caper_arguments():
         '--out-dir', default='.', help='Output directory for local backend')
     group_local.add_argument(
         '--tmp-dir', help='Temporary directory for local backend')
+    group_local.add_argument(
+        '--local-slot', action='store_true',
+        help='Pack tasks by runtime attributes cpu and memory_mb against '
+             'a machine\'s capacity for local backend. '
+             'A task waits for enough cpus/memory before it runs. '
+             'See "caper local-slot".')
 
     group_gc = parent_host.add_argument_group(
         title='GCP backend arguments')
@@ -271,6 +317,34 @@ def parse_caper_arguments():
     group_aws.add_argument(
         '--tmp-s3-bucket', help='Temporary S3 bucket for AWS backend')
 
+    group_slurm_array = parent_host.add_argument_group(
+        title='SLURM array broker arguments',
+        description='Caper (run/server) coalesces tasks with identical '
+                    'resources submitted within a window into '
+                    'an array job (sbatch --array) for SLURM backend.')
+    group_slurm_array.add_argument(
+        '--slurm-array-broker', action='store_true',
+        help='Coalesce tasks into array jobs for SLURM backend.')
+    group_slurm_array.add_argument(
+        '--slurm-array-window', default=DEFAULT_SLURM_ARRAY_WINDOW, type=int,
+        help='Tasks submitted within this window in seconds are coalesced. '
+             'A task waits for this window at most before it\'s submitted.')
+    group_slurm_array.add_argument(
+        '--slurm-array-max-size', default=DEFAULT_SLURM_ARRAY_MAX_SIZE,
+        type=int,
+        help='Maximum number of tasks in an array job. '
+             'Must be smaller than SLURM\'s MaxArraySize.')
+
+    parent_host.add_argument(
+        '--gzip-metadata', action='store_true',
+        help='Write gzip-compressed metadata.json.gz instead of '
+             'metadata.json in a workflow\'s output directory.')
+
+    parent_cluster_status = get_parent_cluster_status()
+    parent_local_slot = get_parent_local_slot()
+    parent_slurm_array = get_parent_slurm_array()
+    parent_retry = get_parent_retry()
+
     # run, submit
     parent_submit = argparse.ArgumentParser(add_help=False)
 
@@ -319,6 +393,15 @@ def parse_caper_arguments():
     parent_server.add_argument(
         '--java-heap-server', default=DEFAULT_JAVA_HEAP_SERVER,
         help='Cromwell Java heap size for "server" mode (java -Xmx)')
+    parent_server.add_argument(
+        '--metadata-update-mode',
+        choices=['incremental', 'full'],
+        default=DEFAULT_METADATA_UPDATE_MODE,
+        help='How to periodically update metadata.json for running '
+             'workflows on a server. incremental: retrieve full metadata '
+             'only when status of a workflow or its calls has changed and '
+             'write metadata.json only when its contents has changed. '
+             'full: always retrieve full metadata and rewrite metadata.json.')
 
     # run
     parent_run = argparse.ArgumentParser(add_help=False)
@@ -340,9 +423,20 @@ def parse_caper_arguments():
              'and make copies of files on a local/remote storage '
              'for a target backend. Make sure that you have installed '
              'gsutil for GCS and aws for S3.')
+    parent_submit.add_argument(
+        '--deepcopy-num-threads', type=int,
+        default=DEFAULT_DEEPCOPY_NUM_THREADS,
+        help='Number of threads to copy files concurrently for deepcopy. '
+             'An interrupted deepcopy is resumed on the next submission '
+             'of the same input JSON file.')
     parent_submit.add_argument(
         '--ignore-womtool', action='store_true',
         help='Ignore warnings from womtool.jar.')
+    parent_submit.add_argument(
+        '--force-revalidation', action='store_true',
+        help='Validate WDL/input JSON with womtool even if they have been '
+             'validated before. Caper caches successful validation '
+             'results for identical WDL, imports.zip and input JSON.')
     parent_submit.add_argument(
         '--womtool', default=DEFAULT_WOMTOOL_JAR,
         help='Path or URL for Cromwell\'s womtool JAR file')
@@ -428,6 +522,37 @@ def parse_caper_arguments():
         help='Timeout for a heartbeat file in Milliseconds. '
              'A heartbeat file older than '
              'this interval will be ignored.')
+    parent_server_client.add_argument(
+        '--rest-pool-size', default=DEFAULT_REST_POOL_SIZE, type=int,
+        help='Maximum number of keep-alive connections to a Cromwell server '
+             'kept in a connection pool.')
+    parent_server_client.add_argument(
+        '--rest-max-retries', default=DEFAULT_REST_MAX_RETRIES, type=int,
+        help='Number of retries for a failed connection or for a gateway '
+             'error (502, 503, 504) on idempotent requests to '
+             'a Cromwell server. Retried with exponential backoff.')
+    parent_server_client.add_argument(
+        '--rest-max-workers', default=DEFAULT_REST_MAX_WORKERS, type=int,
+        help='Maximum number of concurrent requests to a Cromwell server '
+             'for multiple workflows (abort, unhold and metadata). '
+             '1 means serial requests.')
+    parent_server_client.add_argument(
+        '--workflow-mirror-db',
+        default=DEFAULT_WORKFLOW_MIRROR_DB,
+        help='Local SQLite DB file for a mirror of workflows. '
+             'Caper server keeps workflows\' status, labels and locations '
+             'of metadata.json in it. Caper clients (list, metadata, '
+             'troubleshoot) read from it instead of querying a server. '
+             'Server\'s hostname and port are added to its basename '
+             'so that each server has its own mirror.')
+
+    # list, metadata, troubleshoot
+    parent_live = argparse.ArgumentParser(add_help=False)
+    parent_live.add_argument(
+        '--live', action='store_true',
+        help='Always query a Cromwell server '
+             'instead of reading from a local mirror of workflows '
+             '(--workflow-mirror-db).')
 
     parent_list = argparse.ArgumentParser(add_help=False)
     parent_list.add_argument(
@@ -449,12 +574,67 @@ def parse_caper_arguments():
     parent_list.add_argument(
         '--hide-subworkflow', action='store_true',
         help='Hide subworkflows from "caper list".')
+    parent_list.add_argument(
+        '--hide-result-after',
+        help='Hide workflows submitted after this date/time. '
+             'Use with --hide-result-before to define a time window. '
+             'e.g. 2019-06-14, 2019-06-13T18:00')
+    parent_list.add_argument(
+        '--list-status',
+        help='Comma-separated list of workflow statuses to be shown. '
+             'e.g. Running,Failed')
+    parent_list.add_argument(
+        '--list-user',
+        help='Comma-separated list of users (Caper\'s user label) '
+             'to be shown.')
+    parent_list.add_argument(
+        '--sort-by',
+        help='Sort workflows by an item (any item allowed in --format). '
+             'e.g. submission')
+    parent_list.add_argument(
+        '--reverse-sort', action='store_true',
+        help='Sort workflows in a descending order.')
+    parent_list.add_argument(
+        '--limit', type=int,
+        help='Show the first N workflows only (after sorting).')
+    parent_list.add_argument(
+        '--output-format', choices=WorkflowTable.OUTPUT_FORMATS,
+        default=WorkflowTable.OUTPUT_FORMAT_TSV,
+        help='Output format for "caper list". '
+             'tsv/csv have a header line. '
+             'jsonl has a JSON object per workflow.')
+
+    # cache
+    parent_cache = argparse.ArgumentParser(add_help=False)
+    parent_cache.add_argument(
+        'cache_action', nargs='?', choices=['inspect', 'purge'],
+        default='inspect',
+        help='inspect: show number of files and total size of each cache. '
+             'purge: remove all files in caches.')
+    parent_cache.add_argument(
+        'cache_namespace', nargs='*',
+        help='Caches to be inspected/purged (e.g. imports_zip). '
+             'All caches if not specified. '
+             'Caches for deepcopy ({deepcopy}) and {checksum} are purged '
+             'only if specified.'.format(
+                 deepcopy=CaperCache.NAMESPACE_DEEPCOPY,
+                 checksum=CaperCache.NAMESPACE_CHECKSUM))
 
     # troubleshoot
     parent_troubleshoot = argparse.ArgumentParser(add_help=False)
     parent_troubleshoot.add_argument(
         '--show-completed-task', action='store_true',
         help='Show information about completed tasks.')
+    parent_troubleshoot.add_argument(
+        '--stderr-tail-kb', type=int,
+        help='Show the last N KB of each task\'s STDERR only. '
+             'It\'s read with a range request without localizing '
+             'a whole file. Show whole STDERR if not defined.')
+    parent_troubleshoot.add_argument(
+        '--num-stderr-fetch-threads', type=int,
+        default=DEFAULT_NUM_STDERR_FETCH_THREADS,
+        help='Number of threads to fetch tasks\' STDERR files '
+             'concurrently.')
 
     p_init = subparser.add_parser(
         'init',
@@ -463,11 +643,14 @@ def parse_caper_arguments():
         parents=[parent_init])
     p_run = subparser.add_parser(
         'run', help='Run a single workflow without server',
-        parents=[parent_all, parent_submit, parent_run, parent_host, parent_backend])
+        parents=[parent_all, parent_submit, parent_run, parent_host,
+                 parent_cluster_status, parent_retry, parent_local_slot,
+                 parent_slurm_array, parent_backend])
     p_server = subparser.add_parser(
         'server', help='Run a Cromwell server',
         parents=[parent_all, parent_server_client, parent_server, parent_host,
-                 parent_backend])
+                 parent_cluster_status, parent_retry, parent_local_slot,
+                 parent_slurm_array, parent_backend])
     p_submit = subparser.add_parser(
         'submit', help='Submit a workflow to a Cromwell server',
         parents=[parent_all, parent_server_client, parent_submit,
@@ -481,23 +664,35 @@ def parse_caper_arguments():
     p_list = subparser.add_parser(
         'list', help='List running/pending workflows on a Cromwell server',
         parents=[parent_all, parent_server_client, parent_search_wf,
-                 parent_list])
+                 parent_live, parent_list])
     p_metadata = subparser.add_parser(
         'metadata',
         help='Retrieve metadata JSON for workflows from a Cromwell server',
-        parents=[parent_all, parent_server_client, parent_search_wf])
+        parents=[parent_all, parent_server_client, parent_search_wf,
+                 parent_live])
     p_troubleshoot = subparser.add_parser(
         'troubleshoot',
         help='Troubleshoot workflow problems from metadata JSON file or '
              'workflow IDs',
-        parents=[parent_all, parent_troubleshoot, parent_server_client, parent_search_wf])
+        parents=[parent_all, parent_troubleshoot, parent_server_client, parent_search_wf,
+                 parent_live])
     p_debug = subparser.add_parser(
         'debug',
         help='Identical to "troubleshoot"',
-        parents=[parent_all, parent_troubleshoot, parent_server_client, parent_search_wf])
+        parents=[parent_all, parent_troubleshoot, parent_server_client, parent_search_wf,
+                 parent_live])
+
+    p_cache = subparser.add_parser(
+        'cache',
+        help='Inspect or purge Caper\'s local caches',
+        parents=[parent_all, parent_cache])
+
+    p_hooks = add_hook_parsers(
+        subparser, parent_backend, parent_cluster_status, parent_retry,
+        parent_local_slot, parent_slurm_array)
 
     for p in [p_init, p_run, p_server, p_submit, p_abort, p_unhold, p_list,
-              p_metadata, p_troubleshoot, p_debug]:
+              p_metadata, p_troubleshoot, p_debug, p_cache] + p_hooks:
         p.set_defaults(**defaults)
 
     if len(sys.argv[1:]) == 0:
@@ -518,11 +713,18 @@ def parse_caper_arguments():
         'hold',
         'no_deepcopy',
         'ignore_womtool',
+        'force_revalidation',
         'no_build_singularity',
         'use_gsutil_for_s3',
         'hide_subworkflow',
+        'reverse_sort',
+        'live',
         'debug',
-        'show_completed_task']:
+        'show_completed_task',
+        'no_cluster_status_cache',
+        'local_slot',
+        'slurm_array_broker',
+        'gzip_metadata']:
         v = args_d.get(k)
         if v is not None and isinstance(v, str):
             args_d[k] = bool(strtobool(v))
@@ -536,9 +738,36 @@ def parse_caper_arguments():
         'mysql_db_port',
         'postgresql_db_port',
         'server_heartbeat_timeout',
+        'max_cache_size',
+        'deepcopy_num_threads',
+        'stderr_tail_kb',
+        'num_stderr_fetch_threads',
+        'limit',
+        'cluster_status_interval',
+        'script_epilogue_wait_sec',
+        'local_max_cpu',
+        'local_max_memory_mb',
+        'slurm_array_window',
+        'slurm_array_max_size',
+        'job_burst',
+        'submit_max_retries',
+        'check_alive_max_retries',
+        'retry_backoff_sec',
+        'retry_max_backoff_sec',
+        'rest_pool_size',
+        'rest_max_retries',
+        'rest_max_workers',
         'port']:
         v = args_d.get(k)
         if v is not None and isinstance(v, str):
             args_d[k] = int(v)
 
+    # string to float
+    for k in [
+        'job_rate',
+        'retry_jitter']:
+        v = args_d.get(k)
+        if v is not None and isinstance(v, str):
+            args_d[k] = float(v)
+
     return args_d
@@ -1,5 +1,6 @@
 """Caper backend
 """
+import shlex
 from collections import UserDict
 from copy import deepcopy
 from .dict_tool import merge_dict
@@ -75,9 +76,26 @@ class CaperBackendCommon(UserDict):
         }
     }
 
+    DEFAULT_JOB_RATE = 0.5
+    DEFAULT_JOB_BURST = 1
+
     def __init__(self, port=None, disable_call_caching=None,
-                 max_concurrent_workflows=None):
-        super().__init__(CaperBackendCommon.TEMPLATE)
+                 max_concurrent_workflows=None, job_rate=None, job_burst=None):
+        """
+        Args:
+            job_rate:
+                Number of jobs (tasks) submitted per second on average.
+                "system.job-rate-control" in Cromwell is global for
+                all backends.
+            job_burst:
+                Number of jobs submitted at once.
+                Cromwell submits job_burst jobs every
+                job_burst / job_rate seconds.
+        """
+        super().__init__(deepcopy(CaperBackendCommon.TEMPLATE))
+        if job_rate is not None or job_burst is not None:
+            self['system']['job-rate-control'] = \
+                CaperBackendCommon.get_job_rate_control(job_rate, job_burst)
         if port is not None:
             self['webservice']['port'] = port
         if disable_call_caching is not None:
@@ -87,6 +105,23 @@ class CaperBackendCommon(UserDict):
                 max_concurrent_workflows
 
 
+    @staticmethod
+    def get_job_rate_control(job_rate=None, job_burst=None):
+        if job_rate is None:
+            job_rate = CaperBackendCommon.DEFAULT_JOB_RATE
+        if job_burst is None:
+            job_burst = CaperBackendCommon.DEFAULT_JOB_BURST
+        if job_rate <= 0 or job_burst < 1:
+            raise ValueError(
+                'Wrong job rate/burst: {r}/{b}'.format(r=job_rate, b=job_burst))
+        ms_per = int(round(1000.0 * job_burst / job_rate))
+        if ms_per % 1000:
+            per = '{ms} milliseconds'.format(ms=max(ms_per, 1))
+        else:
+            per = '{s} seconds'.format(s=ms_per // 1000)
+        return {'jobs': int(job_burst), 'per': per}
+
+
 class CaperBackendDatabase(UserDict):
     """Common stanzas for database
     """
@@ -142,19 +177,20 @@ class CaperBackendDatabase(UserDict):
                  postgresql_ip=None, postgresql_port=None,
                  postgresql_user=None, postgresql_password=None,
                  postgresql_name=None):
-        super().__init__(CaperBackendDatabase.TEMPLATE)
+        super().__init__(deepcopy(CaperBackendDatabase.TEMPLATE))
 
         if db_type == CaperBackendDatabase.DB_TYPE_IN_MEMORY:
-            self['database'] = CaperBackendDatabase.TEMPLATE_DB_IN_MEMORY
+            self['database'] = deepcopy(
+                CaperBackendDatabase.TEMPLATE_DB_IN_MEMORY)
 
         elif db_type == CaperBackendDatabase.DB_TYPE_FILE:
-            self['database'] = CaperBackendDatabase.TEMPLATE_DB_FILE
+            self['database'] = deepcopy(CaperBackendDatabase.TEMPLATE_DB_FILE)
             db = self['database']['db']
             db['url'] = db['url'].format(
                 file=file_db)
 
         elif db_type == CaperBackendDatabase.DB_TYPE_MYSQL:
-            self['database'] = CaperBackendDatabase.TEMPLATE_DB_MYSQL            
+            self['database'] = deepcopy(CaperBackendDatabase.TEMPLATE_DB_MYSQL)
             db = self['database']['db']
             db['url'] = db['url'].format(
                 ip=mysql_ip, port=mysql_port, name=mysql_name)
@@ -162,7 +198,8 @@ class CaperBackendDatabase(UserDict):
             db['password'] = mysql_password
 
         elif db_type == CaperBackendDatabase.DB_TYPE_POSTGRESQL:
-            self['database'] = CaperBackendDatabase.TEMPLATE_DB_POSTGRESQL
+            self['database'] = deepcopy(
+                CaperBackendDatabase.TEMPLATE_DB_POSTGRESQL)
             db = self['database']['db']
             db['url'] = db['url'].format(
                 ip=postgresql_ip, port=postgresql_port, name=postgresql_name)
@@ -180,7 +217,6 @@ class CaperBackendDatabase(UserDict):
 class CaperBackendBase(UserDict):
     """Base skeleton backend for all backends
     """
-    CONCURRENT_JOB_LIMIT = None
     TEMPLATE = {
         "backend": {
             "providers": {
@@ -196,11 +232,13 @@ class CaperBackendBase(UserDict):
         }
     }
 
-    def __init__(self, dict_to_override_self=None, backend_name=None):
+    def __init__(self, dict_to_override_self=None, backend_name=None,
+                 concurrent_job_limit=None):
         """
         Args:
             dict_to_override_self: dict to override self
             backend_name: backend name
+            concurrent_job_limit: maximum number of concurrent tasks
         """
         if backend_name is None:
             raise ValueError('backend_name must be provided.')
@@ -210,9 +248,9 @@ class CaperBackendBase(UserDict):
 
         config = self.get_backend_config()
 
-        if CaperBackendBase.CONCURRENT_JOB_LIMIT is None:
-            raise ValueError('You must define CaperBackendBase.CONCURRENT_JOB_LIMIT.')
-        config['concurrent-job-limit'] = CaperBackendBase.CONCURRENT_JOB_LIMIT
+        if concurrent_job_limit is None:
+            raise ValueError('concurrent_job_limit must be provided.')
+        config['concurrent-job-limit'] = concurrent_job_limit
 
         if dict_to_override_self is not None:
             merge_dict(self, deepcopy(dict_to_override_self))
@@ -234,11 +272,58 @@ class CaperBackendBase(UserDict):
 class CaperBackendBaseLocal(CaperBackendBase):
     """Base backend for all local backends (including HPCs with cluster engine)
     """
-    USE_SOFT_GLOB_OUTPUT = None
-    OUT_DIR = None
-
     SOFT_GLOB_OUTPUT_CMD = 'ln -sL GLOB_PATTERN GLOB_DIRECTORY 2> /dev/null'
 
+    SCRIPT_EPILOGUE_MODE_SLEEP_SYNC = 'sleep-sync'
+    SCRIPT_EPILOGUE_MODE_FSYNC = 'fsync'
+    SCRIPT_EPILOGUE_MODES = (
+        SCRIPT_EPILOGUE_MODE_SLEEP_SYNC, SCRIPT_EPILOGUE_MODE_FSYNC)
+    # script-epilogue runs in a task's execution directory
+    # right before rc.tmp is renamed to rc.
+    # fsync files written by a task (newer than Cromwell's script) and
+    # all directories instead of a global sync.
+    # falls back to a global sync if it fails
+    # (e.g. old coreutils' sync doesn't take files)
+    SCRIPT_EPILOGUE_FSYNC = (
+        'find . \\( -type f -newer script -o -type d \\) '
+        '-exec sync -- {} + 2> /dev/null || sync')
+    # wait until the newest file written by a task gets {wait_sec} seconds
+    # old so that caches of other nodes on a shared filesystem expire.
+    # it waits only for a task which wrote files within the last {wait_sec}
+    # (rc.tmp is excluded since it's always written right before)
+    SCRIPT_EPILOGUE_WAIT = (
+        'NEWEST=$(find . -type f -newer script ! -name rc.tmp '
+        '-exec stat -c %Y {{}} + '
+        '2> /dev/null | sort -n | tail -n 1); '
+        'if [ -z "$NEWEST" ]; then NEWEST=0; fi; '
+        'W=$((NEWEST + {wait_sec} - $(date +%s))); '
+        'if [ "$W" -gt {wait_sec} ]; then W={wait_sec}; fi; '
+        'if [ "$W" -gt 0 ]; then sleep "$W"; fi')
+
+    CHECK_ALIVE_WITH_CACHE = (
+        'if command -v caper > /dev/null 2>&1; then '
+        'caper check-alive ${{job_id}} --backend {backend} '
+        '--cluster-status-dir {cluster_status_dir}{retry_args}; '
+        'else {check_alive}; fi')
+
+    # number of retries for failed submit/check-alive. 0 means no retry
+    SUBMIT_MAX_RETRIES = 0
+    CHECK_ALIVE_MAX_RETRIES = 0
+    SEC_RETRY_BACKOFF = 30
+    # retry a command with exponential backoff.
+    # delay starts from {backoff_sec} and doubles up to {max_backoff_sec}.
+    # each delay is randomly reduced by up to {jitter_pct} percent
+    # so that tasks failed together don't retry together.
+    # returns 1 if all retries fail.
+    RETRY_PREFIX = 'ITER=0; DELAY={backoff_sec}; until '
+    RETRY_SUFFIX = (
+        '; do ITER=$((ITER + 1)); '
+        'if [ $ITER -gt {max_retries} ]; then break; fi; '
+        'sleep $((DELAY - DELAY * {jitter_pct} * RANDOM / 3276800)); '
+        'DELAY=$((DELAY * 2 > {max_backoff_sec} ? '
+        '{max_backoff_sec} : DELAY * 2)); '
+        'done; [ $ITER -le {max_retries} ]')
+
     TEMPLATE_BACKEND = {
         "actor-factory": "cromwell.backend.impl.sfs.config.ConfigBackendLifecycleActorFactory",
         "config": {
@@ -246,26 +331,134 @@ class CaperBackendBaseLocal(CaperBackendBase):
             "root": None
         }
     }
-    def __init__(self, dict_to_override_self=None, backend_name=None):
-        super().__init__(backend_name=backend_name)
+    def __init__(self, dict_to_override_self=None, backend_name=None,
+                 out_dir=None, concurrent_job_limit=None,
+                 soft_glob_output=False, script_epilogue_mode=None,
+                 script_epilogue_wait_sec=0, submit_max_retries=None,
+                 check_alive_max_retries=None, retry_backoff_sec=None,
+                 retry_max_backoff_sec=None, retry_jitter=None):
+        """
+        Args:
+            out_dir: local output directory (root of workflow outputs)
+            soft_glob_output: soft-link (instead of hard-link) globbed outputs
+            script_epilogue_mode:
+                sleep-sync: sleep and then sync everything (default).
+                fsync: fsync a task's files only and
+                    wait for script_epilogue_wait_sec at most.
+            script_epilogue_wait_sec:
+                Maximum wait for fsync mode.
+            submit_max_retries, check_alive_max_retries:
+                Number of retries for failed submit/check-alive.
+                SUBMIT_MAX_RETRIES/CHECK_ALIVE_MAX_RETRIES if not defined.
+            retry_backoff_sec:
+                Delay before the first retry.
+                SEC_RETRY_BACKOFF if not defined.
+            retry_max_backoff_sec:
+                Delay doubles for each retry up to this.
+                Same as retry_backoff_sec (fixed delay) if not defined.
+            retry_jitter:
+                Each delay is randomly reduced by up to
+                this fraction (0.0 to 1.0).
+        """
+        super().__init__(
+            backend_name=backend_name,
+            concurrent_job_limit=concurrent_job_limit)
 
         merge_dict(
             self.get_backend(),
             deepcopy(CaperBackendBaseLocal.TEMPLATE_BACKEND))
         config = self.get_backend_config()
 
-        if CaperBackendBaseLocal.USE_SOFT_GLOB_OUTPUT is None:
-            raise ValueError('You must define CaperBackendBase.USE_SOFT_GLOB_OUTPUT.')
-        if CaperBackendBaseLocal.USE_SOFT_GLOB_OUTPUT:
+        if soft_glob_output:
             config['glob-link-command'] = CaperBackendBaseLocal.SOFT_GLOB_OUTPUT_CMD
 
-        if CaperBackendBaseLocal.OUT_DIR is None:
-            raise ValueError('You must define CaperBackendBase.OUT_DIR.')
-        config['root'] = CaperBackendBaseLocal.OUT_DIR
+        if out_dir is None:
+            raise ValueError('out_dir must be provided.')
+        config['root'] = out_dir
 
         if dict_to_override_self is not None:
             merge_dict(self, deepcopy(dict_to_override_self))
 
+        if script_epilogue_mode == CaperBackendBaseLocal.SCRIPT_EPILOGUE_MODE_FSYNC:
+            config['script-epilogue'] = \
+                CaperBackendBaseLocal.get_fsync_script_epilogue(
+                    script_epilogue_wait_sec)
+        elif script_epilogue_mode not in (
+                None, CaperBackendBaseLocal.SCRIPT_EPILOGUE_MODE_SLEEP_SYNC):
+            raise ValueError('Wrong script_epilogue_mode: {v}'.format(
+                v=script_epilogue_mode))
+
+        # arguments for "caper check-alive" if retry policy is specified
+        self._check_alive_retry_args = ''
+        if check_alive_max_retries is not None:
+            self._check_alive_retry_args += \
+                ' --check-alive-max-retries {v}'.format(
+                    v=int(check_alive_max_retries))
+        if retry_backoff_sec is not None:
+            self._check_alive_retry_args += \
+                ' --retry-backoff-sec {v}'.format(v=int(retry_backoff_sec))
+        if retry_max_backoff_sec is not None:
+            self._check_alive_retry_args += \
+                ' --retry-max-backoff-sec {v}'.format(
+                    v=int(retry_max_backoff_sec))
+        if retry_jitter is not None:
+            self._check_alive_retry_args += \
+                ' --retry-jitter {v}'.format(v=float(retry_jitter))
+
+        if submit_max_retries is None:
+            submit_max_retries = self.SUBMIT_MAX_RETRIES
+        if check_alive_max_retries is None:
+            check_alive_max_retries = self.CHECK_ALIVE_MAX_RETRIES
+        for key, max_retries in (('submit', submit_max_retries),
+                                 ('check-alive', check_alive_max_retries)):
+            if key in config and max_retries:
+                config[key] = CaperBackendBaseLocal.get_retry_command(
+                    config[key], max_retries, retry_backoff_sec,
+                    retry_max_backoff_sec, retry_jitter)
+
+    @staticmethod
+    def get_fsync_script_epilogue(wait_sec=0):
+        epilogue = CaperBackendBaseLocal.SCRIPT_EPILOGUE_FSYNC
+        if wait_sec:
+            epilogue += '; ' + CaperBackendBaseLocal.SCRIPT_EPILOGUE_WAIT.format(
+                wait_sec=int(wait_sec))
+        return epilogue
+
+    @staticmethod
+    def get_retry_command(cmd, max_retries, backoff_sec=None,
+                          max_backoff_sec=None, jitter=None):
+        """Wrap a command with a retry loop (exponential backoff with jitter).
+        """
+        if backoff_sec is None:
+            backoff_sec = CaperBackendBaseLocal.SEC_RETRY_BACKOFF
+        if max_backoff_sec is None:
+            max_backoff_sec = backoff_sec
+        if jitter is None:
+            jitter = 0.0
+        if not 0.0 <= jitter <= 1.0:
+            raise ValueError('Wrong retry jitter: {v}'.format(v=jitter))
+        policy = {
+            'max_retries': int(max_retries),
+            'backoff_sec': int(backoff_sec),
+            'max_backoff_sec': int(max(max_backoff_sec, backoff_sec)),
+            'jitter_pct': int(round(jitter * 100)),
+        }
+        return CaperBackendBaseLocal.RETRY_PREFIX.format(**policy) + \
+            cmd.strip() + CaperBackendBaseLocal.RETRY_SUFFIX.format(**policy)
+
+    def use_cluster_status_cache(self, cluster_status_dir):
+        """Replace check-alive with "caper check-alive", which reads
+        job status from a cluster status cache (see ClusterStatusCache)
+        instead of querying a cluster engine for each job.
+        Original check-alive is used if caper is not found on PATH.
+        """
+        config = self.get_backend_config()
+        config['check-alive'] = CaperBackendBaseLocal.CHECK_ALIVE_WITH_CACHE.format(
+            backend=self._backend_name,
+            cluster_status_dir=shlex.quote(cluster_status_dir),
+            retry_args=self._check_alive_retry_args,
+            check_alive=config['check-alive'])
+
 
 class CaperBackendGCP(CaperBackendBase):
     """Google Cloud backend
@@ -315,10 +508,11 @@ class CaperBackendGCP(CaperBackendBase):
     }
 
     def __init__(self, gcp_prj, out_gcs_bucket,
-                 call_caching_dup_strat=None):
+                 call_caching_dup_strat=None, concurrent_job_limit=None):
         super().__init__(
             CaperBackendGCP.TEMPLATE,
-            backend_name=BACKEND_GCP)
+            backend_name=BACKEND_GCP,
+            concurrent_job_limit=concurrent_job_limit)
         config = self.get_backend_config()
 
         config['project'] = gcp_prj
@@ -384,10 +578,12 @@ class CaperBackendAWS(CaperBackendBase):
         }
     }
 
-    def __init__(self, aws_batch_arn, aws_region, out_s3_bucket):
+    def __init__(self, aws_batch_arn, aws_region, out_s3_bucket,
+                 concurrent_job_limit=None):
         super().__init__(
             CaperBackendAWS.TEMPLATE,
-            backend_name=BACKEND_AWS)
+            backend_name=BACKEND_AWS,
+            concurrent_job_limit=concurrent_job_limit)
         self[BACKEND_AWS]['region'] = aws_region
         config = self.get_backend_config()
         config['default-runtime-attributes']['queueArn'] = aws_batch_arn
@@ -430,6 +626,18 @@ class CaperBackendLocal(CaperBackendBaseLocal):
           -v ${cwd}:${docker_cwd} \
           ${docker} ${docker_script}
     """
+    RUNTIME_ATTRIBUTES_LOCAL_SLOT = """
+        Int? cpu
+        Int? memory_mb
+    """
+    # block until a task fits in the remaining cpus/memory of a machine
+    # (see LocalSlotAllocator). a shell running submit command holds a slot
+    # until it's done. a task runs without a slot if caper is not found on PATH
+    ACQUIRE_LOCAL_SLOT = (
+        'if command -v caper > /dev/null 2>&1; then '
+        'caper local-slot acquire ${{"--cpu " + cpu}} '
+        '${{"--memory-mb " + memory_mb}} '
+        '--local-slot-dir {local_slot_dir}{max_resources}; fi')
     TEMPLATE = {
         "backend": {
             "providers": {
@@ -445,10 +653,50 @@ class CaperBackendLocal(CaperBackendBaseLocal):
         }
     }
 
-    def __init__(self):
+    def __init__(self, out_dir=None, concurrent_job_limit=None,
+                 soft_glob_output=False, script_epilogue_mode=None,
+                 script_epilogue_wait_sec=0, local_slot_dir=None,
+                 local_max_cpu=None, local_max_memory_mb=None):
+        """
+        Args:
+            local_slot_dir:
+                Pack tasks by runtime attributes cpu and memory_mb against
+                a machine's capacity with a local slot allocator
+                on this directory.
+            local_max_cpu, local_max_memory_mb:
+                Capacity of a machine for a local slot allocator.
+                Detected on a machine if not defined.
+        """
         super().__init__(
             CaperBackendLocal.TEMPLATE,
-            backend_name=BACKEND_LOCAL)
+            backend_name=BACKEND_LOCAL,
+            out_dir=out_dir,
+            concurrent_job_limit=concurrent_job_limit,
+            soft_glob_output=soft_glob_output,
+            script_epilogue_mode=script_epilogue_mode,
+            script_epilogue_wait_sec=script_epilogue_wait_sec)
+        if local_slot_dir is not None:
+            self.use_local_slot(
+                local_slot_dir, local_max_cpu, local_max_memory_mb)
+
+    def use_local_slot(self, local_slot_dir, max_cpu=None, max_memory_mb=None):
+        """Acquire a local slot ("caper local-slot acquire")
+        before running a task in submit and submit-docker.
+        """
+        config = self.get_backend_config()
+        config['runtime-attributes'] += \
+            CaperBackendLocal.RUNTIME_ATTRIBUTES_LOCAL_SLOT
+        max_resources = ''
+        if max_cpu:
+            max_resources += ' --local-max-cpu {v}'.format(v=int(max_cpu))
+        if max_memory_mb:
+            max_resources += ' --local-max-memory-mb {v}'.format(
+                v=int(max_memory_mb))
+        acquire = CaperBackendLocal.ACQUIRE_LOCAL_SLOT.format(
+            local_slot_dir=shlex.quote(local_slot_dir),
+            max_resources=max_resources)
+        for key in ('submit', 'submit-docker'):
+            config[key] = acquire + '\n' + config[key]
 
 
 class CaperBackendSLURM(CaperBackendBaseLocal):
@@ -468,9 +716,9 @@ class CaperBackendSLURM(CaperBackendBaseLocal):
         String? singularity_bindpath
         String? singularity_cachedir
     """
-    # try sbatching up to 3 times every 30 second
+    # retry sbatching (SUBMIT_MAX_RETRIES times by default)
     # some busy SLURM clusters spit out error, which results in a failure of the whole workflow
-    SUBMIT = """ITER=0; until [ $ITER -ge 3 ]; do
+    SUBMIT = """
         sbatch \
         --export=ALL \
         -J ${job_name} \
@@ -494,15 +742,25 @@ class CaperBackendSLURM(CaperBackendBaseLocal):
             export SINGULARITY_CACHEDIR=${singularity_cachedir}; fi; \
             singularity exec --cleanenv --home ${cwd} \
             ${if defined(gpu) then '--nv' else ''} \
-            ${singularity} /bin/bash ${script}" && break
-    ITER=$[$ITER+1]; sleep 30; done
+            ${singularity} /bin/bash ${script}"
     """
-    # squeue every 30 second (up to 3 times)
     # unlike qstat -j JOB_ID, squeue -j JOB_ID doesn't return 1 when there is no such job
     # so we need to use squeue -j JOB_ID --noheader and check if output is empty
-    # try polling up to 3 times since squeue fails on some busy SLURM clusters
+    # retry polling (CHECK_ALIVE_MAX_RETRIES times by default)
+    # since squeue fails on some busy SLURM clusters
     # e.g. on Stanford Sherlock, squeue didn't work when server is busy
-    CHECK_ALIVE = """for ITER in 1 2 3; do CHK_ALIVE=$(squeue --noheader -j ${job_id} --format=%i | grep ${job_id}); if [ -z "$CHK_ALIVE" ]; then if [ "$ITER" == 3 ]; then /bin/bash -c 'exit 1'; else sleep 30; fi; else echo $CHK_ALIVE; break; fi; done"""
+    CHECK_ALIVE = "squeue --noheader -j ${job_id} --format=%i | grep ${job_id}"
+    SUBMIT_MAX_RETRIES = 2
+    CHECK_ALIVE_MAX_RETRIES = 2
+    # hand submissions to a SLURM array broker (see SlurmArrayBroker)
+    # by overriding sbatch with "caper sbatch",
+    # which falls back to sbatch if there is no broker.
+    # array task's job ID is JOBID_TASKID
+    SBATCH_WITH_ARRAY_BROKER = (
+        'if command -v caper > /dev/null 2>&1; then '
+        'sbatch() {{ caper sbatch --slurm-array-dir {slurm_array_dir} '
+        '-- "$@"; }}; fi; ')
+    JOB_ID_REGEX_WITH_ARRAY_BROKER = "Submitted batch job (\\d+(?:_\\d+)?).*"
     TEMPLATE = {
         "backend": {
             "providers": {
@@ -523,10 +781,33 @@ class CaperBackendSLURM(CaperBackendBaseLocal):
         }
     }
 
-    def __init__(self, partition=None, account=None, extra_param=None):
+    def __init__(self, partition=None, account=None, extra_param=None,
+                 out_dir=None, concurrent_job_limit=None,
+                 soft_glob_output=False, script_epilogue_mode=None,
+                 script_epilogue_wait_sec=0, cluster_status_dir=None,
+                 submit_max_retries=None, check_alive_max_retries=None,
+                 retry_backoff_sec=None, retry_max_backoff_sec=None,
+                 retry_jitter=None,
+                 slurm_array_dir=None):
+        """
+        Args:
+            slurm_array_dir:
+                Coalesce tasks into array jobs with a SLURM array broker
+                on this directory.
+        """
         super().__init__(
             CaperBackendSLURM.TEMPLATE,
-            backend_name=BACKEND_SLURM)
+            backend_name=BACKEND_SLURM,
+            out_dir=out_dir,
+            concurrent_job_limit=concurrent_job_limit,
+            soft_glob_output=soft_glob_output,
+            script_epilogue_mode=script_epilogue_mode,
+            script_epilogue_wait_sec=script_epilogue_wait_sec,
+            submit_max_retries=submit_max_retries,
+            check_alive_max_retries=check_alive_max_retries,
+            retry_backoff_sec=retry_backoff_sec,
+            retry_max_backoff_sec=retry_max_backoff_sec,
+            retry_jitter=retry_jitter)
         config = self.get_backend_config()
 
         if partition is not None and partition != '':
@@ -535,6 +816,24 @@ class CaperBackendSLURM(CaperBackendBaseLocal):
             config['default-runtime-attributes']['slurm_account'] = account
         if extra_param is not None and extra_param != '':
             config['default-runtime-attributes']['slurm_extra_param'] = extra_param
+        if slurm_array_dir is not None:
+            self.use_slurm_array_broker(slurm_array_dir)
+        if cluster_status_dir is not None:
+            self.use_cluster_status_cache(cluster_status_dir)
+
+    def use_slurm_array_broker(self, slurm_array_dir):
+        """Submit with "caper sbatch" instead of sbatch and
+        accept an array task's job ID (JOBID_TASKID)
+        in job-id-regex and check-alive.
+        """
+        config = self.get_backend_config()
+        config['submit'] = CaperBackendSLURM.SBATCH_WITH_ARRAY_BROKER.format(
+            slurm_array_dir=shlex.quote(slurm_array_dir)) + config['submit']
+        config['job-id-regex'] = CaperBackendSLURM.JOB_ID_REGEX_WITH_ARRAY_BROKER
+        # squeue shows pending tasks of an array job
+        # in a compressed form (JOBID_[TASKID_RANGE]) without --array
+        config['check-alive'] = config['check-alive'].replace(
+            'squeue --noheader', 'squeue --noheader --array')
 
 
 class CaperBackendSGE(CaperBackendBaseLocal):
@@ -609,10 +908,26 @@ ${true=")m" false="" defined(memory_mb)} \
         }
     }
 
-    def __init__(self, pe=None, queue=None, extra_param=None):
+    def __init__(self, pe=None, queue=None, extra_param=None,
+                 out_dir=None, concurrent_job_limit=None,
+                 soft_glob_output=False, script_epilogue_mode=None,
+                 script_epilogue_wait_sec=0, cluster_status_dir=None,
+                 submit_max_retries=None, check_alive_max_retries=None,
+                 retry_backoff_sec=None, retry_max_backoff_sec=None,
+                 retry_jitter=None):
         super().__init__(
             CaperBackendSGE.TEMPLATE,
-            backend_name=BACKEND_SGE)
+            backend_name=BACKEND_SGE,
+            out_dir=out_dir,
+            concurrent_job_limit=concurrent_job_limit,
+            soft_glob_output=soft_glob_output,
+            script_epilogue_mode=script_epilogue_mode,
+            script_epilogue_wait_sec=script_epilogue_wait_sec,
+            submit_max_retries=submit_max_retries,
+            check_alive_max_retries=check_alive_max_retries,
+            retry_backoff_sec=retry_backoff_sec,
+            retry_max_backoff_sec=retry_max_backoff_sec,
+            retry_jitter=retry_jitter)
         config = self.get_backend_config()
 
         if pe is not None and pe != '':
@@ -621,6 +936,8 @@ ${true=")m" false="" defined(memory_mb)} \
             config['default-runtime-attributes']['sge_queue'] = queue
         if extra_param is not None and extra_param != '':
             config['default-runtime-attributes']['sge_extra_param'] = extra_param
+        if cluster_status_dir is not None:
+            self.use_cluster_status_cache(cluster_status_dir)
 
 
 class CaperBackendPBS(CaperBackendBaseLocal):
@@ -682,20 +999,101 @@ ${true=":0:0" false="" defined(time)} \
         }
     }
 
-    def __init__(self, queue=None, extra_param=None):
+    def __init__(self, queue=None, extra_param=None,
+                 out_dir=None, concurrent_job_limit=None,
+                 soft_glob_output=False, script_epilogue_mode=None,
+                 script_epilogue_wait_sec=0, cluster_status_dir=None,
+                 submit_max_retries=None, check_alive_max_retries=None,
+                 retry_backoff_sec=None, retry_max_backoff_sec=None,
+                 retry_jitter=None):
         super().__init__(
             CaperBackendPBS.TEMPLATE,
-            backend_name=BACKEND_PBS)
+            backend_name=BACKEND_PBS,
+            out_dir=out_dir,
+            concurrent_job_limit=concurrent_job_limit,
+            soft_glob_output=soft_glob_output,
+            script_epilogue_mode=script_epilogue_mode,
+            script_epilogue_wait_sec=script_epilogue_wait_sec,
+            submit_max_retries=submit_max_retries,
+            check_alive_max_retries=check_alive_max_retries,
+            retry_backoff_sec=retry_backoff_sec,
+            retry_max_backoff_sec=retry_max_backoff_sec,
+            retry_jitter=retry_jitter)
         config = self.get_backend_config()
 
         if queue is not None and queue != '':
             config['default-runtime-attributes']['pbs_queue'] = queue
         if extra_param is not None and extra_param != '':
             config['default-runtime-attributes']['pbs_extra_param'] = extra_param
+        if cluster_status_dir is not None:
+            self.use_cluster_status_cache(cluster_status_dir)
 
 
 def main():
-    pass
+    """Benchmark per-task overhead of script epilogues.
+    A task is emulated in a temporary execution directory as in Cromwell:
+    script is written first, then a task writes output files and rc.tmp.
+    Epilogue runs there before rc.tmp is renamed to rc.
+
+    Usage:
+        python -m caper.caper_backend [NUM_TASKS] [WAIT_SEC]
+    """
+    import os
+    import subprocess
+    import sys
+    import time
+    from tempfile import TemporaryDirectory
+
+    num_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    wait_sec = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    num_outputs = 5
+    output_size = 1024 * 1024
+
+    def run_task(epilogue, outputs_age=0):
+        with TemporaryDirectory() as d:
+            with open(os.path.join(d, 'script'), 'w') as fp:
+                fp.write('#!/bin/bash\n')
+            # make sure that outputs are newer than script
+            t_script = time.time() - outputs_age - 10
+            os.utime(os.path.join(d, 'script'), (t_script, t_script))
+            for i in range(num_outputs):
+                f = os.path.join(d, 'out{i}.bin'.format(i=i))
+                with open(f, 'wb') as fp:
+                    fp.write(os.urandom(output_size))
+                if outputs_age:
+                    t = time.time() - outputs_age
+                    os.utime(f, (t, t))
+            with open(os.path.join(d, 'rc.tmp'), 'w') as fp:
+                fp.write('0\n')
+            t0 = time.perf_counter()
+            subprocess.check_call(['bash', '-c', epilogue], cwd=d)
+            os.rename(os.path.join(d, 'rc.tmp'), os.path.join(d, 'rc'))
+            return time.perf_counter() - t0
+
+    sleep_sync = CaperBackendBaseLocal.TEMPLATE_BACKEND['config'][
+        'script-epilogue']
+    fsync = CaperBackendBaseLocal.get_fsync_script_epilogue()
+    fsync_wait = CaperBackendBaseLocal.get_fsync_script_epilogue(wait_sec)
+
+    results = [
+        # blind sleep is constant. run it once
+        ('sleep-sync: ' + sleep_sync, [run_task(sleep_sync)]),
+        ('sync only (global)', [run_task('sync') for _ in range(num_tasks)]),
+        ('fsync', [run_task(fsync) for _ in range(num_tasks)]),
+        ('fsync, wait {w}s, outputs just written'.format(w=wait_sec),
+         [run_task(fsync_wait)]),
+        ('fsync, wait {w}s, outputs {a}s old'.format(
+            w=wait_sec, a=2 * wait_sec),
+         [run_task(fsync_wait, outputs_age=2 * wait_sec)
+          for _ in range(num_tasks)]),
+    ]
+    print('tasks={n}, outputs per task={m} x {s} bytes'.format(
+        n=num_tasks, m=num_outputs, s=output_size))
+    print('\t'.join(['epilogue', 'mean_sec_per_task', 'hours_per_10k_tasks']))
+    for name, secs in results:
+        mean = sum(secs) / len(secs)
+        print('{name}\t{mean:.3f}\t{h:.2f}'.format(
+            name=name, mean=mean, h=mean * 10000 / 3600))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,294 @@
+"""Cromwell's backend conf file as a pure function of Caper's settings
+"""
+
+import hashlib
+import json
+import os
+import re
+from functools import lru_cache
+from pyhocon import ConfigFactory, HOCONConverter
+from .dict_tool import merge_dict
+from .caper_backend import BACKEND_LOCAL
+from .caper_backend import CaperBackendCommon, CaperBackendDatabase
+from .caper_backend import CaperBackendGCP, CaperBackendAWS
+from .caper_backend import CaperBackendLocal, CaperBackendSLURM
+from .caper_backend import CaperBackendSGE, CaperBackendPBS
+
+
+BACKEND_CONF_HEADER = 'include required(classpath("application"))\n'
+RE_PATTERN_BACKEND_CONF_HEADER = r'^\s*include\s'
+
+# all settings for make_backend_conf_str()
+SETTINGS_KEYS = (
+    'default_backend', 'port', 'disable_call_caching',
+    'max_concurrent_workflows', 'max_concurrent_tasks',
+    'job_rate', 'job_burst',
+    'submit_max_retries', 'check_alive_max_retries',
+    'retry_backoff_sec', 'retry_max_backoff_sec', 'retry_jitter',
+    'soft_glob_output', 'out_dir',
+    'script_epilogue_mode', 'script_epilogue_wait_sec',
+    'local_slot_dir', 'local_max_cpu', 'local_max_memory_mb',
+    'gcp_prj', 'out_gcs_bucket', 'gcp_call_caching_dup_strat',
+    'aws_batch_arn', 'aws_region', 'out_s3_bucket',
+    'slurm_partition', 'slurm_account', 'slurm_extra_param',
+    'slurm_array_dir',
+    'sge_pe', 'sge_queue', 'sge_extra_param',
+    'pbs_queue', 'pbs_extra_param', 'cluster_status_dir',
+    'db', 'db_timeout', 'file_db',
+    'mysql_db_ip', 'mysql_db_port', 'mysql_db_user',
+    'mysql_db_password', 'mysql_db_name',
+    'postgresql_db_ip', 'postgresql_db_port', 'postgresql_db_user',
+    'postgresql_db_password', 'postgresql_db_name',
+    'backend_file_contents')
+
+
+def make_backend_conf_str(
+        default_backend=BACKEND_LOCAL, port=None, disable_call_caching=None,
+        max_concurrent_workflows=None, max_concurrent_tasks=None,
+        job_rate=None, job_burst=None,
+        submit_max_retries=None, check_alive_max_retries=None,
+        retry_backoff_sec=None, retry_max_backoff_sec=None, retry_jitter=None,
+        soft_glob_output=False, out_dir=None,
+        script_epilogue_mode=None, script_epilogue_wait_sec=0,
+        local_slot_dir=None, local_max_cpu=None, local_max_memory_mb=None,
+        gcp_prj=None, out_gcs_bucket=None, gcp_call_caching_dup_strat=None,
+        aws_batch_arn=None, aws_region=None, out_s3_bucket=None,
+        slurm_partition=None, slurm_account=None, slurm_extra_param=None,
+        slurm_array_dir=None,
+        sge_pe=None, sge_queue=None, sge_extra_param=None,
+        pbs_queue=None, pbs_extra_param=None, cluster_status_dir=None,
+        db=None, db_timeout=None, file_db=None,
+        mysql_db_ip=None, mysql_db_port=None, mysql_db_user=None,
+        mysql_db_password=None, mysql_db_name=None,
+        postgresql_db_ip=None, postgresql_db_port=None,
+        postgresql_db_user=None, postgresql_db_password=None,
+        postgresql_db_name=None,
+        backend_file_contents=None):
+    """Make a HOCON string for Cromwell's backend conf file.
+    Result depends only on args.
+
+    Initializes the following backend stanzas,
+    which are defined in "backend" {} in a Cromwell's backend
+    configuration file:
+        1) local: local backend
+        2) gc: Google Cloud backend (optional)
+        3) aws: AWS backend (optional)
+        4) slurm: SLURM (optional)
+        5) sge: SGE (optional)
+        6) pbs: PBS (optional)
+
+    Also, initializes the following common non-"backend" stanzas:
+        a) common: base stanzas
+        b) mysql: connect to MySQL (optional)
+
+    Then overrides it with a user's backend conf and
+    converts it to a HOCON string.
+
+    Args:
+        job_rate, job_burst:
+            Job rate control for all backends.
+            See CaperBackendCommon for details.
+        submit_max_retries, check_alive_max_retries, retry_backoff_sec,
+        retry_max_backoff_sec, retry_jitter:
+            Retry policy for submit/check-alive of SLURM/SGE/PBS backends.
+            See CaperBackendBaseLocal for details.
+        script_epilogue_mode, script_epilogue_wait_sec:
+            Script epilogue for local-based backends.
+            See CaperBackendBaseLocal for details.
+        local_slot_dir, local_max_cpu, local_max_memory_mb:
+            Local slot allocator for local backend.
+            See CaperBackendLocal for details.
+        slurm_array_dir:
+            Coalesce tasks of SLURM backend into array jobs with
+            a SLURM array broker on this directory.
+        cluster_status_dir:
+            Use a cluster status cache on this directory for check-alive
+            of SLURM/SGE/PBS backends.
+        backend_file_contents:
+            Contents of a user's backend conf file (--backend-file).
+    """
+    # init backend dict
+    backend_dict = {}
+
+    # common stanza for backend conf file
+    merge_dict(
+        backend_dict,
+        CaperBackendCommon(
+            port=port,
+            disable_call_caching=disable_call_caching,
+            max_concurrent_workflows=max_concurrent_workflows,
+            job_rate=job_rate,
+            job_burst=job_burst))
+
+    # common settings for local-based backends
+    local_settings = {
+        'out_dir': out_dir,
+        'concurrent_job_limit': max_concurrent_tasks,
+        'soft_glob_output': soft_glob_output,
+        'script_epilogue_mode': script_epilogue_mode,
+        'script_epilogue_wait_sec': script_epilogue_wait_sec,
+    }
+
+    # retry policy for backends with a cluster engine
+    cluster_settings = {
+        'cluster_status_dir': cluster_status_dir,
+        'submit_max_retries': submit_max_retries,
+        'check_alive_max_retries': check_alive_max_retries,
+        'retry_backoff_sec': retry_backoff_sec,
+        'retry_max_backoff_sec': retry_max_backoff_sec,
+        'retry_jitter': retry_jitter,
+    }
+
+    # local backend
+    merge_dict(
+        backend_dict,
+        CaperBackendLocal(
+            local_slot_dir=local_slot_dir,
+            local_max_cpu=local_max_cpu,
+            local_max_memory_mb=local_max_memory_mb,
+            **local_settings))
+
+    # GC
+    if gcp_prj is not None and out_gcs_bucket is not None:
+        merge_dict(
+            backend_dict,
+            CaperBackendGCP(
+                gcp_prj=gcp_prj,
+                out_gcs_bucket=out_gcs_bucket,
+                call_caching_dup_strat=gcp_call_caching_dup_strat,
+                concurrent_job_limit=max_concurrent_tasks))
+
+    # AWS
+    if aws_batch_arn is not None and aws_region is not None \
+            and out_s3_bucket is not None:
+        merge_dict(
+            backend_dict,
+            CaperBackendAWS(
+                aws_batch_arn=aws_batch_arn,
+                aws_region=aws_region,
+                out_s3_bucket=out_s3_bucket,
+                concurrent_job_limit=max_concurrent_tasks))
+
+    # SLURM
+    merge_dict(
+        backend_dict,
+        CaperBackendSLURM(
+            partition=slurm_partition,
+            account=slurm_account,
+            extra_param=slurm_extra_param,
+            slurm_array_dir=slurm_array_dir,
+            **cluster_settings,
+            **local_settings))
+
+    # SGE
+    merge_dict(
+        backend_dict,
+        CaperBackendSGE(
+            pe=sge_pe,
+            queue=sge_queue,
+            extra_param=sge_extra_param,
+            **cluster_settings,
+            **local_settings))
+
+    # PBS
+    merge_dict(
+        backend_dict,
+        CaperBackendPBS(
+            queue=pbs_queue,
+            extra_param=pbs_extra_param,
+            **cluster_settings,
+            **local_settings))
+
+    # Database
+    merge_dict(
+        backend_dict,
+        CaperBackendDatabase(
+            db_type=db,
+            db_timeout=db_timeout,
+            file_db=file_db,
+            mysql_ip=mysql_db_ip,
+            mysql_port=mysql_db_port,
+            mysql_user=mysql_db_user,
+            mysql_password=mysql_db_password,
+            mysql_name=mysql_db_name,
+            postgresql_ip=postgresql_db_ip,
+            postgresql_port=postgresql_db_port,
+            postgresql_user=postgresql_db_user,
+            postgresql_password=postgresql_db_password,
+            postgresql_name=postgresql_db_name))
+
+    # set header for conf ("include ...")
+    assert(BACKEND_CONF_HEADER.endswith('\n'))
+    lines_header = [BACKEND_CONF_HEADER]
+
+    # override with user-specified backend.conf if exists
+    if backend_file_contents is not None:
+        lines_wo_header = []
+
+        for line in backend_file_contents.splitlines(keepends=True):
+            # find header and exclude
+            if re.findall(RE_PATTERN_BACKEND_CONF_HEADER, line):
+                if line not in lines_header:
+                    lines_header.append(line)
+            else:
+                lines_wo_header.append(line)
+
+        # parse HOCON to JSON to dict
+        c = ConfigFactory.parse_string(''.join(lines_wo_header))
+        j = HOCONConverter.to_json(c)
+        d = json.loads(j)
+        # apply to backend conf
+        merge_dict(backend_dict, d)
+
+    backend_dict['backend']['default'] = default_backend
+
+    # dict to HOCON (excluding header)
+    backend_hocon = ConfigFactory.from_dict(backend_dict)
+    # write header to HOCON string
+    backend_str = ''.join(lines_header)
+    # convert HOCON to string
+    backend_str += HOCONConverter.to_hocon(backend_hocon)
+
+    return backend_str
+
+
+def get_backend_conf_str(settings):
+    """Memoized make_backend_conf_str().
+
+    Args:
+        settings:
+            dict of settings (keys in SETTINGS_KEYS).
+    """
+    return _get_backend_conf_str(_dump_settings(settings))
+
+
+def get_settings_hash(settings):
+    """Hash of settings to identify a backend conf file.
+    It also depends on source code of backend templates so that
+    a conf file cached by a different version of Caper is not used.
+    """
+    return hashlib.md5(
+        (_get_source_md5() + _dump_settings(settings)).encode()
+    ).hexdigest()
+
+
+@lru_cache(maxsize=32)
+def _get_backend_conf_str(settings_json):
+    return make_backend_conf_str(**json.loads(settings_json))
+
+
+@lru_cache(maxsize=None)
+def _get_source_md5():
+    md5 = hashlib.md5()
+    for module_file in (__file__, os.path.join(
+            os.path.dirname(__file__), 'caper_backend.py')):
+        with open(module_file, 'rb') as fp:
+            md5.update(fp.read())
+    return md5.hexdigest()
+
+
+def _dump_settings(settings):
+    for k in settings:
+        if k not in SETTINGS_KEYS:
+            raise ValueError('Unsupported backend setting: {k}'.format(k=k))
+    return json.dumps(settings, sort_keys=True)
@@ -0,0 +1,214 @@
+"""CaperCache: size-bounded file cache on a local directory
+"""
+
+import logging
+import os
+import shutil
+
+
+logger = logging.getLogger(__name__)
+
+
+class CaperCache(object):
+    """Size-bounded cache of files on a local directory.
+    Files are stored as {cache_dir}/{namespace}/{key}{ext}.
+    Key is usually a content hash (content-addressed).
+
+    Least recently used files are evicted when total size of files in
+    a namespace exceeds max_size. mtime of a file is updated on every hit
+    to keep track of its usage.
+    A file is written atomically so that a cache directory can be shared
+    by multiple Caper processes.
+    """
+    DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+    NAMESPACE_WDL_SUMMARY = 'wdl'
+    NAMESPACE_IMPORTS_ZIP = 'imports_zip'
+    NAMESPACE_WOMTOOL = 'womtool'
+    NAMESPACE_BACKEND_CONF = 'backend_conf'
+    # manifests of interrupted deepcopies (managed by CaperDeepcopy)
+    NAMESPACE_DEEPCOPY = 'deepcopy'
+    # index of md5 hashes of files (managed by CaperChecksumIndex)
+    NAMESPACE_CHECKSUM = 'checksum'
+    # purged only if explicitly specified. these are not just for speed:
+    # deepcopy's manifests resume interrupted transfers and
+    # checksum index saves re-hashing of huge files
+    NAMESPACES_KEPT_ON_PURGE_ALL = (NAMESPACE_DEEPCOPY, NAMESPACE_CHECKSUM)
+
+    def __init__(self, cache_dir, namespace, ext='',
+                 max_size=DEFAULT_MAX_SIZE):
+        """
+        Args:
+            cache_dir:
+                Root directory for all caches.
+            namespace:
+                Sub-directory for this cache.
+            ext:
+                Extension for cached files (e.g. .zip).
+            max_size:
+                Maximum total size of cached files in bytes.
+        """
+        self._dir = os.path.join(cache_dir, namespace)
+        self._namespace = namespace
+        self._ext = ext
+        self._max_size = max_size
+        self._num_hits = 0
+        self._num_misses = 0
+
+    @property
+    def dir(self):
+        return self._dir
+
+    @property
+    def namespace(self):
+        return self._namespace
+
+    @property
+    def stats(self):
+        """Statistics of cache for logging.
+        Hits/misses are counted for this object only.
+        """
+        entries = self.entries()
+        return {
+            'namespace': self._namespace,
+            'hits': self._num_hits,
+            'misses': self._num_misses,
+            'num_files': len(entries),
+            'size': sum(size for _, size, _ in entries),
+            'max_size': self._max_size
+        }
+
+    def get_path(self, key):
+        return os.path.join(self._dir, key + self._ext)
+
+    def get(self, key, dest=None):
+        """Find a cached file for a key.
+
+        Args:
+            dest:
+                Copy a cached file to this local path if found.
+        Returns:
+            Path of a cached file (or dest if defined). None if not found.
+        """
+        path = self.get_path(key)
+        try:
+            # mark it as recently used
+            os.utime(path)
+            if dest is not None:
+                shutil.copyfile(path, dest)
+                path = dest
+        except OSError:
+            self._num_misses += 1
+            logger.debug(
+                'Cache miss: {ns}, {key}'.format(ns=self._namespace, key=key))
+            return None
+        self._num_hits += 1
+        logger.debug(
+            'Cache hit: {ns}, {key}'.format(ns=self._namespace, key=key))
+        return path
+
+    def put(self, key, src):
+        """Make a copy of a local file on cache.
+        Then evict old files if cache is full.
+
+        Returns:
+            Path of a cached file.
+        """
+        return self.__put(key, lambda tmp_path: shutil.copyfile(src, tmp_path))
+
+    def write(self, key, contents):
+        """Write a string on cache.
+        Then evict old files if cache is full.
+
+        Returns:
+            Path of a cached file.
+        """
+        def write_to(tmp_path):
+            with open(tmp_path, 'w') as fp:
+                fp.write(contents)
+        return self.__put(key, write_to)
+
+    def evict(self):
+        """Remove least recently used files until total size is
+        within max_size.
+
+        Returns:
+            Number of removed files.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        num_removed = 0
+        # entries are sorted by mtime (most recent first)
+        while entries and total > self._max_size:
+            key, size, _ = entries.pop()
+            try:
+                os.remove(self.get_path(key))
+            except OSError:
+                # already removed by another process
+                pass
+            total -= size
+            num_removed += 1
+        if num_removed:
+            logger.debug('Evicted {n} files from cache: {ns}'.format(
+                n=num_removed, ns=self._namespace))
+        return num_removed
+
+    def entries(self):
+        """List of cached files.
+
+        Returns:
+            List of (key, size, mtime) sorted by mtime
+            (most recently used first).
+        """
+        result = []
+        if not os.path.isdir(self._dir):
+            return result
+        for f in os.listdir(self._dir):
+            if not f.endswith(self._ext) or f.endswith('.tmp'):
+                continue
+            try:
+                st = os.stat(os.path.join(self._dir, f))
+            except OSError:
+                continue
+            key = f[:len(f) - len(self._ext)] if self._ext else f
+            result.append((key, st.st_size, st.st_mtime))
+        return sorted(result, key=lambda x: x[2], reverse=True)
+
+    def purge(self):
+        """Remove all cached files.
+
+        Returns:
+            Number of removed files.
+        """
+        num_removed = len(self.entries())
+        if os.path.isdir(self._dir):
+            shutil.rmtree(self._dir, ignore_errors=True)
+        return num_removed
+
+    def __put(self, key, write_to):
+        """Atomically write a cached file.
+
+        Args:
+            write_to:
+                Function that writes a file on a given temporary path.
+        """
+        os.makedirs(self._dir, exist_ok=True)
+        path = self.get_path(key)
+        tmp_path = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+        try:
+            write_to(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+        return path
+
+    @staticmethod
+    def find_namespaces(cache_dir):
+        """Find all namespaces (sub-directories) in a cache directory.
+        """
+        if not os.path.isdir(cache_dir):
+            return []
+        return sorted(
+            d for d in os.listdir(cache_dir)
+            if os.path.isdir(os.path.join(cache_dir, d)))
@@ -9,6 +9,7 @@ from .caper_backend import BACKENDS, BACKEND_SLURM, get_backend
 
 DEFAULT_FILE_DB_PREFIX = 'caper_file_db'
 DEFAULT_CAPER_TMP_DIR_SUFFIX = '.caper_tmp'
+DEFAULT_CAPER_CACHE_DIR_SUFFIX = 'caper_cache'
 
 
 def check_caper_conf(args_d):
@@ -66,6 +67,13 @@ def check_caper_conf(args_d):
         args_d['tmp_dir'] = os.path.abspath(
             os.path.expanduser(args_d['tmp_dir']))
 
+    if args_d.get('cache_dir') is None:
+        args_d['cache_dir'] = os.path.join(
+            args_d['tmp_dir'], DEFAULT_CAPER_CACHE_DIR_SUFFIX)
+    else:
+        args_d['cache_dir'] = os.path.abspath(
+            os.path.expanduser(args_d['cache_dir']))
+
     if args_d.get('tmp_s3_bucket') is None:
         if args_d.get('out_s3_bucket'):
             args_d['tmp_s3_bucket'] = os.path.join(args_d['out_s3_bucket'],
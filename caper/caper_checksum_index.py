@@ -0,0 +1,87 @@
+"""CaperChecksumIndex: persistent index of file checksums
+"""
+
+import logging
+import os
+import sqlite3
+from threading import Lock
+
+
+logger = logging.getLogger(__name__)
+
+
+class CaperChecksumIndex(object):
+    """Persistent index of URI -> (size, mtime, md5) on a local SQLite DB.
+
+    md5 of a file is valid only while its size and mtime are not changed
+    so that a file's md5 is calculated only once and then looked up with
+    a cheap stat/HEAD call.
+    This is useful for files without a native md5 hash
+    (e.g. local files and some S3/HTTP objects).
+
+    DB file can be shared by multiple Caper processes.
+    """
+    DB_FILENAME = 'checksum.db'
+    SEC_DB_TIMEOUT = 30.0
+
+    def __init__(self, index_dir):
+        """
+        Args:
+            index_dir:
+                Local directory to store a DB file on.
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        self._db_file = os.path.join(index_dir, CaperChecksumIndex.DB_FILENAME)
+        self._lock = Lock()
+        self._num_hits = 0
+        self._num_misses = 0
+        self._conn = sqlite3.connect(
+            self._db_file,
+            timeout=CaperChecksumIndex.SEC_DB_TIMEOUT,
+            check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS checksum ('
+                'uri TEXT PRIMARY KEY, size INTEGER, mtime TEXT, md5 TEXT)')
+
+    @property
+    def stats(self):
+        return {
+            'hits': self._num_hits,
+            'misses': self._num_misses
+        }
+
+    def get(self, uri, size, mtime):
+        """Look up md5 of a file.
+
+        Returns:
+            md5 hexadecimal digest if size and mtime match. Otherwise None.
+        """
+        if size is None or mtime is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT md5 FROM checksum WHERE uri=? AND size=? AND mtime=?',
+                (uri, size, str(mtime))).fetchone()
+            if row is None:
+                self._num_misses += 1
+                return None
+            self._num_hits += 1
+        return row[0]
+
+    def put(self, uri, size, mtime, md5):
+        if size is None or mtime is None or md5 is None:
+            return
+        with self._lock, self._conn:
+            # explicit columns for a DB created with an old schema
+            self._conn.execute(
+                'INSERT OR REPLACE INTO checksum (uri, size, mtime, md5) '
+                'VALUES (?, ?, ?, ?)',
+                (uri, size, str(mtime), md5))
+
+    def remove(self, uri):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM checksum WHERE uri=?', (uri,))
+
+    def close(self):
+        self._conn.close()
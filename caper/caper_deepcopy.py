@@ -0,0 +1,385 @@
+"""CaperDeepcopy: parallel and resumable recursive localization of input files
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from autouri import AutoURI, AbsPath
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import get_ident
+
+
+logger = logging.getLogger(__name__)
+
+
+class CaperDeepcopy(object):
+    """Recursively localizes all files in an input JSON file on
+    a target storage (URI class). Result is the same as
+    uri_cls.localize(src, recursive=True) but it's done in three stages:
+        1) Plan:
+            Read all text files (JSON/TSV/CSV) recursively to collect
+            a full transitive set of files to be localized.
+            Files are deduped by source URI.
+        2) Copy:
+            Copy all non-text files concurrently on a bounded thread pool.
+            Finished copies are recorded in a manifest file so that
+            an interrupted deepcopy can be resumed.
+        3) Rewrite:
+            Write modified text files (with localized URIs in them) on
+            a target storage. Text files are already read in 1).
+
+    Manifest is removed after deepcopy is successfully done.
+
+    If a checksum index is given, a file is skipped if its copy on
+    a target storage has the same md5 hash. md5 hashes are taken from
+    cloud storages' object metadata (HEAD) or from the index so that
+    a local file is hashed only once until it's modified.
+    """
+    DEFAULT_NUM_THREADS = 8
+    MANIFEST_EXT = '.json'
+    # min interval to write a manifest file
+    SEC_INTERVAL_WRITE_MANIFEST = 5.0
+
+    def __init__(self, uri_cls, make_md5_file=False,
+                 num_threads=DEFAULT_NUM_THREADS, manifest_dir=None,
+                 checksum_index=None):
+        """
+        Args:
+            uri_cls:
+                Target URI class (e.g. GCSURI, S3URI and AbsPath).
+            make_md5_file:
+                Make an md5 file on a target storage while copying.
+                See autouri's URIBase.cp() for details.
+            num_threads:
+                Maximum number of concurrent copies.
+            manifest_dir:
+                Local directory to write a manifest file on.
+                Deepcopy cannot be resumed if not defined.
+            checksum_index:
+                CaperChecksumIndex object.
+                make_md5_file is ignored if defined since md5 hashes of
+                local files are stored in the index instead.
+        """
+        self._uri_cls = uri_cls
+        self._make_md5_file = make_md5_file
+        self._num_threads = num_threads
+        self._manifest_dir = manifest_dir
+        self._checksum_index = checksum_index
+        self._loc_prefix = uri_cls.get_loc_prefix().rstrip(
+            uri_cls.get_path_sep())
+
+        # text files to be recursed: {src: contents}
+        self._texts = {}
+        # non-text files to be copied: [src, ...] (in order of appearance)
+        self._files = []
+        # localized: {src: (loc_uri, modified_or_copied)}
+        self._localized = {}
+        # copied files recorded in a manifest: {src: loc_uri}
+        self._manifest = {}
+        self._manifest_file = None
+        self._t_manifest_written = 0.0
+
+    def deepcopy(self, src_uri):
+        """Deepcopy a (JSON/TSV/CSV) file and all files in it recursively.
+
+        Returns:
+            Localized URI string of src_uri.
+        """
+        src_uri = AutoURI(src_uri).uri
+        if not self._loc_prefix:
+            raise ValueError('LOC_PREFIX is not defined.')
+
+        t0 = time.perf_counter()
+        self.__plan(src_uri)
+        t1 = time.perf_counter()
+        logger.info(
+            'Deepcopy: found {n} text files and {m} files to be localized. '
+            'took {t:.3f} sec'.format(
+                n=len(self._texts), m=len(self._files), t=t1 - t0))
+
+        self.__open_manifest(src_uri)
+        self.__copy_files()
+        t2 = time.perf_counter()
+        result = self.__rewrite(src_uri, set())[0]
+        self.__remove_manifest()
+        logger.info(
+            'Deepcopy: done. copy took {t:.3f} sec, total {t2:.3f} sec'.format(
+                t=t2 - t1, t2=time.perf_counter() - t0))
+        return result
+
+    def __plan(self, src_uri):
+        """Find all files recursively, level by level.
+        Text files on the same level are read concurrently.
+        """
+        seen = {src_uri}
+        level = [src_uri]
+        with ThreadPoolExecutor(max_workers=self._num_threads) as executor:
+            while level:
+                texts = []
+                for u in level:
+                    if CaperDeepcopy.__get_recurse_fnc(u) is None:
+                        self._files.append(u)
+                    else:
+                        texts.append(u)
+
+                next_level = []
+                for u, contents in zip(
+                        texts, executor.map(CaperDeepcopy.__read, texts)):
+                    self._texts[u] = contents
+                    for child in CaperDeepcopy.__find_uris(u, contents):
+                        if child not in seen:
+                            seen.add(child)
+                            next_level.append(child)
+                level = next_level
+
+    def __copy_files(self):
+        """Copy non-text files on a different storage concurrently.
+        """
+        todo = []
+        for u in self._files:
+            if self.__is_on_same_storage(u):
+                self._localized[u] = (u, False)
+            else:
+                todo.append(u)
+        if not todo:
+            return
+
+        num_done = 0
+        errors = []
+        with ThreadPoolExecutor(max_workers=self._num_threads) as executor:
+            futures = {
+                executor.submit(self.__copy_file, u): u for u in todo}
+            try:
+                for future in as_completed(futures):
+                    u = futures[future]
+                    num_done += 1
+                    try:
+                        loc_uri, status = future.result()
+                    except Exception as e:
+                        # keep copying other files to record them in manifest
+                        logger.error(
+                            'Deepcopy: [{i}/{n}] failed, {src}, {e}'.format(
+                                i=num_done, n=len(todo), src=u, e=str(e)))
+                        errors.append(e)
+                        continue
+                    self._localized[u] = (loc_uri, True)
+                    logger.info('Deepcopy: [{i}/{n}] {status}, {src}'.format(
+                        i=num_done, n=len(todo), status=status, src=u))
+                    self.__update_manifest(u, loc_uri)
+            finally:
+                # flush manifest even on KeyboardInterrupt
+                self.__update_manifest(force=True)
+        if errors:
+            raise errors[0]
+
+    def __copy_file(self, src_uri):
+        """Make a copy of a file on the target storage.
+        It's called on a thread pool.
+
+        Returns:
+            Tuple of (localized URI string, status string)
+        """
+        thread_id = get_ident()
+        src = AutoURI(src_uri, thread_id=thread_id)
+        loc_uri = self.__get_loc_uri(src, src.basename)
+
+        if self._manifest.get(src_uri) == loc_uri and \
+                AutoURI(loc_uri, thread_id=thread_id).exists:
+            return loc_uri, 'resumed'
+
+        if self._checksum_index is not None:
+            dest = AutoURI(loc_uri, thread_id=thread_id)
+            if self.__is_unchanged(src, dest):
+                return loc_uri, 'unchanged'
+            src.cp(dest_uri=dest, no_checksum=True)
+            self.__index_copy(src, dest)
+            return loc_uri, 'copied'
+
+        _, rc = src.cp(
+            dest_uri=AutoURI(loc_uri, thread_id=thread_id),
+            make_md5_file=self._make_md5_file,
+            return_flag=True)
+        return loc_uri, 'copied' if rc == 0 else 'skipped'
+
+    def __is_unchanged(self, src, dest):
+        """Check if dest is an identical copy of src.
+        md5 is calculated only when it's not found in object metadata
+        or in a checksum index. Then it's stored in the index.
+        """
+        m_dest = self.__get_metadata(dest)
+        if not m_dest[0]:
+            return False
+        m_src = self.__get_metadata(src)
+        if m_src[1] != m_dest[1]:
+            # size mismatch
+            return False
+        md5_src = m_src[3] or self.__calc_md5(src, m_src)
+        if md5_src is not None:
+            md5_dest = m_dest[3] or self.__calc_md5(dest, m_dest)
+        else:
+            md5_dest = None
+        if md5_src is not None and md5_dest is not None:
+            return md5_src == md5_dest
+        # no md5 (e.g. HTTP URL without md5 in header)
+        # use the same rule as in autouri's URIBase.cp()
+        return src.basename == dest.basename and \
+            m_src[2] is not None and m_dest[2] is not None and \
+            m_src[2] <= m_dest[2]
+
+    def __index_copy(self, src, dest):
+        """Store md5 of a local copy in a checksum index
+        if md5 of its source is known without calculation.
+        """
+        if not isinstance(dest, AbsPath):
+            return
+        md5 = self.__get_metadata(src)[3]
+        if md5 is not None:
+            m_dest = dest.get_metadata(skip_md5=True)
+            self._checksum_index.put(dest.uri, m_dest.size, m_dest.mtime, md5)
+
+    def __get_metadata(self, u):
+        """Get metadata of a URI with a single stat/HEAD call.
+        md5 is looked up in a checksum index for a local file.
+
+        Returns:
+            Tuple of (exists, size, mtime, md5). md5 can be None.
+        """
+        if isinstance(u, AbsPath):
+            m = u.get_metadata(skip_md5=True)
+            md5 = self._checksum_index.get(u.uri, m.size, m.mtime) \
+                if m.exists else None
+        else:
+            # cloud storages have md5 in object metadata
+            m = u.get_metadata()
+            md5 = m.md5
+        return m.exists, m.size, m.mtime, md5
+
+    def __calc_md5(self, u, m):
+        """Calculate md5 of a local file and store it in a checksum index.
+        md5 of a remote file is not calculated.
+        """
+        if not isinstance(u, AbsPath):
+            return None
+        md5 = u.get_metadata().md5
+        self._checksum_index.put(u.uri, m[1], m[2], md5)
+        return md5
+
+    def __rewrite(self, src_uri, visiting):
+        """Recursively write modified text files on the target storage.
+        Same logic as in autouri's URIBase.localize().
+
+        Returns:
+            Tuple of (localized URI string, modified_or_copied)
+        """
+        src = AutoURI(src_uri)
+        if not src.is_valid:
+            return src_uri, False
+        src_uri = src.uri
+        if src_uri in self._localized:
+            return self._localized[src_uri]
+        if src_uri in visiting:
+            raise ValueError(
+                'Self-reference found while recursive localization. '
+                'related file: {f}'.format(f=src_uri))
+        visiting.add(src_uri)
+
+        new_contents, modified = CaperDeepcopy.__get_recurse_fnc(src_uri)(
+            self._texts[src_uri], lambda x: self.__rewrite(x, visiting))
+
+        if modified:
+            basename = src.basename_wo_ext + \
+                self._uri_cls.get_loc_suffix() + src.ext
+            loc_uri = self.__get_loc_uri(src, basename)
+            AutoURI(loc_uri).write(new_contents)
+            result = (loc_uri, True)
+        elif not self.__is_on_same_storage(src_uri):
+            loc_uri = self.__get_loc_uri(src, src.basename)
+            src.cp(dest_uri=loc_uri, make_md5_file=self._make_md5_file)
+            result = (loc_uri, True)
+        else:
+            result = (src_uri, False)
+
+        visiting.discard(src_uri)
+        self._localized[src_uri] = result
+        return result
+
+    def __get_loc_uri(self, src, basename):
+        return self._uri_cls.get_path_sep().join(
+            [self._loc_prefix, src.loc_dirname, basename])
+
+    def __is_on_same_storage(self, uri):
+        return AutoURI(uri).__class__ is self._uri_cls
+
+    def __open_manifest(self, src_uri):
+        """Read a manifest file left by an interrupted deepcopy.
+        Manifest file is keyed by source URI and target location.
+        """
+        if self._manifest_dir is None:
+            return
+        key = hashlib.md5(
+            '\n'.join([src_uri, self._loc_prefix]).encode()).hexdigest()
+        self._manifest_file = os.path.join(
+            self._manifest_dir, key + CaperDeepcopy.MANIFEST_EXT)
+        try:
+            with open(self._manifest_file) as fp:
+                copied = json.loads(fp.read())['copied']
+        except (OSError, ValueError, KeyError):
+            return
+        self._manifest.update(copied)
+        logger.info(
+            'Deepcopy: resuming from a manifest with {n} copied files. '
+            '{f}'.format(n=len(copied), f=self._manifest_file))
+
+    def __update_manifest(self, src_uri=None, loc_uri=None, force=False):
+        """Record a finished copy and write a manifest file
+        at most every SEC_INTERVAL_WRITE_MANIFEST.
+        """
+        if self._manifest_file is None:
+            return
+        if src_uri is not None:
+            self._manifest[src_uri] = loc_uri
+        t = time.monotonic()
+        if not force and t - self._t_manifest_written < \
+                CaperDeepcopy.SEC_INTERVAL_WRITE_MANIFEST:
+            return
+        self._t_manifest_written = t
+        os.makedirs(self._manifest_dir, exist_ok=True)
+        tmp_file = '{f}.{pid}.tmp'.format(
+            f=self._manifest_file, pid=os.getpid())
+        with open(tmp_file, 'w') as fp:
+            fp.write(json.dumps({'copied': self._manifest}, indent=4))
+        os.replace(tmp_file, self._manifest_file)
+
+    def __remove_manifest(self):
+        if self._manifest_file is not None and \
+                os.path.exists(self._manifest_file):
+            os.remove(self._manifest_file)
+
+    @staticmethod
+    def __get_recurse_fnc(uri):
+        ext = AutoURI(uri).ext
+        for ext_, fnc_recurse in AutoURI.LOC_RECURSE_EXT_AND_FNC.items():
+            if ext == ext_:
+                return fnc_recurse
+        return None
+
+    @staticmethod
+    def __read(uri):
+        return AutoURI(uri, thread_id=get_ident()).read()
+
+    @staticmethod
+    def __find_uris(uri, contents):
+        """Find all valid URIs in a text file's contents.
+        """
+        found = []
+
+        def collect(x):
+            u = AutoURI(x)
+            if u.is_valid:
+                found.append(u.uri)
+            return x, False
+
+        CaperDeepcopy.__get_recurse_fnc(uri)(contents, collect)
+        return found
@@ -0,0 +1,241 @@
+"""Argument parsers for hook subcommands (check-alive, local-slot and sbatch)
+
+Hook subcommands are called by Cromwell for each task/job so they are
+parsed without importing heavy modules (e.g. autouri) to start quickly.
+caper_args shares parent parsers defined here with run/server.
+"""
+
+import argparse
+import os
+from configparser import ConfigParser
+from .caper_backend import CaperBackendBaseLocal, CaperBackendSLURM
+from .cluster_status import ClusterStatusCache
+from .local_slot import LocalSlotAllocator
+from .slurm_array import SlurmArrayBroker
+
+
+DEFAULT_CAPER_CONF = '~/.caper/default.conf'
+DEFAULT_CLUSTER_STATUS_DIR = ClusterStatusCache.DEFAULT_CLUSTER_STATUS_DIR
+DEFAULT_CLUSTER_STATUS_INTERVAL = 30
+DEFAULT_LOCAL_SLOT_DIR = LocalSlotAllocator.DEFAULT_LOCAL_SLOT_DIR
+DEFAULT_SLURM_ARRAY_DIR = SlurmArrayBroker.DEFAULT_SLURM_ARRAY_DIR
+
+HOOK_ACTIONS = ('check-alive', 'local-slot', 'sbatch')
+
+
+def get_conf_parser():
+    conf_parser = argparse.ArgumentParser(add_help=False)
+    conf_parser.add_argument('-c', '--conf', help='Specify config file',
+                             metavar='FILE',
+                             default=DEFAULT_CAPER_CONF)
+    conf_parser.add_argument('-v', '--version', action='store_true',
+                             help='Show version')
+    return conf_parser
+
+
+def read_caper_conf(conf):
+    """Read a Caper conf file.
+
+    Returns:
+        dict of defaults with "-" in keys replaced with "_".
+        Empty if a conf file doesn't exist.
+    """
+    defaults = {}
+    if conf is not None and os.path.exists(conf):
+        config = ConfigParser()
+        with open(conf, 'r') as fp:
+            conf_contents = fp.read()
+        if '[defaults]' not in conf_contents.split('\n'):
+            conf_contents = '[defaults]\n' + conf_contents
+        config.read_string(conf_contents)
+        d = dict(config.items('defaults'))
+        # remove keys with empty string
+        d = {k: v.strip('"\'') for k, v in d.items() if v != ''}
+        # replace - with _
+        defaults.update({k.replace('-', '_'): v for k, v in d.items()})
+    return defaults
+
+
+def get_parent_cluster_status():
+    # run, server, check-alive
+    parent_cluster_status = argparse.ArgumentParser(add_help=False)
+    group_cluster_status = parent_cluster_status.add_argument_group(
+        title='Cluster status cache for SLURM/SGE/PBS backends',
+        description='Caper (run/server) queries status of all jobs of a '
+                    'user with a single squeue/qstat periodically. '
+                    'Cromwell\'s check-alive for each job reads from it '
+                    'instead of querying a cluster engine for each job.')
+    group_cluster_status.add_argument(
+        '--cluster-status-dir', default=DEFAULT_CLUSTER_STATUS_DIR,
+        help='Directory for cluster status files.')
+    group_cluster_status.add_argument(
+        '--cluster-status-interval', default=DEFAULT_CLUSTER_STATUS_INTERVAL,
+        type=int,
+        help='Interval in seconds for querying status of all jobs.')
+    group_cluster_status.add_argument(
+        '--no-cluster-status-cache', action='store_true',
+        help='Disable cluster status cache. '
+             'Cromwell queries a cluster engine for each job.')
+    return parent_cluster_status
+
+
+def get_parent_local_slot():
+    # run, server, local-slot
+    parent_local_slot = argparse.ArgumentParser(add_help=False)
+    group_local_slot = parent_local_slot.add_argument_group(
+        title='Local slot allocator for local backend',
+        description='Shared by all Caper run/server processes '
+                    'on a machine.')
+    group_local_slot.add_argument(
+        '--local-slot-dir', default=DEFAULT_LOCAL_SLOT_DIR,
+        help='Directory for a local slot allocator\'s state file.')
+    group_local_slot.add_argument(
+        '--local-max-cpu', type=int,
+        help='Number of cpus available for tasks. '
+             'Number of cpus of a machine if not defined.')
+    group_local_slot.add_argument(
+        '--local-max-memory-mb', type=int,
+        help='Memory in MB available for tasks. '
+             'Total memory of a machine if not defined.')
+    return parent_local_slot
+
+
+def get_parent_slurm_array():
+    # run, server, sbatch
+    parent_slurm_array = argparse.ArgumentParser(add_help=False)
+    parent_slurm_array.add_argument(
+        '--slurm-array-dir', default=DEFAULT_SLURM_ARRAY_DIR,
+        help='Directory for SLURM array broker\'s spool directories.')
+    return parent_slurm_array
+
+
+def get_parent_retry():
+    # run, server, check-alive
+    parent_retry = argparse.ArgumentParser(add_help=False)
+    group_retry = parent_retry.add_argument_group(
+        title='Retry policy for SLURM/SGE/PBS backends',
+        description='Failed submit/check-alive commands are retried '
+                    'with exponential backoff.')
+    group_retry.add_argument(
+        '--submit-max-retries', type=int,
+        help='Number of retries for failed submission of a task. '
+             '{slurm} for slurm and {sge} for sge/pbs if not defined.'.format(
+                 slurm=CaperBackendSLURM.SUBMIT_MAX_RETRIES,
+                 sge=CaperBackendBaseLocal.SUBMIT_MAX_RETRIES))
+    group_retry.add_argument(
+        '--check-alive-max-retries', type=int,
+        help='Number of retries for check-alive of a task which is '
+             'not found. '
+             '{slurm} for slurm and {sge} for sge/pbs if not defined.'.format(
+                 slurm=CaperBackendSLURM.CHECK_ALIVE_MAX_RETRIES,
+                 sge=CaperBackendBaseLocal.CHECK_ALIVE_MAX_RETRIES))
+    group_retry.add_argument(
+        '--retry-backoff-sec', type=int,
+        help='Delay in seconds before the first retry. '
+             '{v} if not defined.'.format(
+                 v=CaperBackendBaseLocal.SEC_RETRY_BACKOFF))
+    group_retry.add_argument(
+        '--retry-max-backoff-sec', type=int,
+        help='Delay doubles for each retry up to this. '
+             'Same as --retry-backoff-sec (fixed delay) if not defined.')
+    group_retry.add_argument(
+        '--retry-jitter', type=float,
+        help='Each delay is randomly reduced by up to this fraction '
+             '(0.0 to 1.0) so that tasks failed together do not '
+             'retry together. 0.0 if not defined.')
+    return parent_retry
+
+
+def add_hook_parsers(subparser, parent_backend, parent_cluster_status,
+                     parent_retry, parent_local_slot, parent_slurm_array):
+    """Add parsers for hook subcommands to subparsers.
+
+    Returns:
+        List of added parsers.
+    """
+    # check-alive
+    parent_check_alive = argparse.ArgumentParser(add_help=False)
+    parent_check_alive.add_argument(
+        'job_id',
+        help='Job ID on a cluster engine.')
+
+    # local-slot
+    parent_local_slot_action = argparse.ArgumentParser(add_help=False)
+    parent_local_slot_action.add_argument(
+        'local_slot_action', nargs='?', choices=['status', 'acquire'],
+        default='status',
+        help='status: show utilization of a machine. '
+             'acquire: wait for enough cpus/memory and hold them '
+             'until a parent process (e.g. Cromwell\'s submit script) '
+             'is done. This is called by Cromwell for each task.')
+    parent_local_slot_action.add_argument(
+        '--cpu', type=int,
+        help='Number of cpus for a task. '
+             '{v} if not defined.'.format(v=LocalSlotAllocator.DEFAULT_CPU))
+    parent_local_slot_action.add_argument(
+        '--memory-mb', type=int,
+        help='Memory in MB for a task. '
+             '{v} if not defined.'.format(
+                 v=LocalSlotAllocator.DEFAULT_MEMORY_MB))
+
+    # sbatch
+    parent_sbatch = argparse.ArgumentParser(add_help=False)
+    parent_sbatch.add_argument(
+        'sbatch_args', nargs='*',
+        help='sbatch\'s arguments after "--". e.g. -- -J JOB --wrap CMD')
+
+    p_check_alive = subparser.add_parser(
+        'check-alive',
+        help='Check if a job is alive on a cluster engine (SLURM/SGE/PBS). '
+             'This is called by Cromwell\'s check-alive',
+        parents=[parent_check_alive, parent_cluster_status, parent_retry,
+                 parent_backend])
+
+    p_local_slot = subparser.add_parser(
+        'local-slot',
+        help='Show utilization of cpus/memory of a machine for local backend '
+             'or acquire them for a task',
+        parents=[parent_local_slot_action, parent_local_slot])
+
+    p_sbatch = subparser.add_parser(
+        'sbatch',
+        help='Submit a job to SLURM via a SLURM array broker. '
+             'Same as sbatch if there is no broker. '
+             'This is called by Cromwell\'s submit',
+        parents=[parent_sbatch, parent_slurm_array])
+
+    return [p_check_alive, p_local_slot, p_sbatch]
+
+
+def parse_hook_arguments(argv=None):
+    """Argument parser for hook subcommands only.
+    Values in a conf file are used as defaults as in parse_caper_arguments().
+
+    Args:
+        argv:
+            List of arguments. sys.argv[1:] if not defined.
+    Returns:
+        dict of arguments. None if not a hook subcommand.
+    """
+    known_args, remaining_argv = get_conf_parser().parse_known_args(argv)
+    if known_args.version or not remaining_argv or \
+            remaining_argv[0] not in HOOK_ACTIONS:
+        return None
+
+    parser = argparse.ArgumentParser(parents=[get_conf_parser()])
+    subparser = parser.add_subparsers(dest='action')
+
+    # backend name only. aliases are resolved by caper_backend.get_backend()
+    parent_backend = argparse.ArgumentParser(add_help=False)
+    parent_backend.add_argument(
+        '-b', '--backend', help='Backend to run a workflow')
+
+    defaults = read_caper_conf(os.path.expanduser(known_args.conf))
+    for p in add_hook_parsers(
+            subparser, parent_backend, get_parent_cluster_status(),
+            get_parent_retry(), get_parent_local_slot(),
+            get_parent_slurm_array()):
+        p.set_defaults(**defaults)
+
+    # values from a conf file (string) are converted with each arg's type
+    return vars(parser.parse_args(remaining_argv))
@@ -0,0 +1,362 @@
+"""CaperServerSupervisor: event-driven supervisor for a Cromwell server process
+"""
+
+import asyncio
+import logging
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+class CaperServerSupervisor(object):
+    """Runs a Cromwell server process and supervises it with asyncio.
+
+    There are three concurrent stages so that they never block each other:
+        1) STDOUT reader:
+            Reads Cromwell's STDOUT without blocking, forwards it to
+            STDOUT and finds started/finished workflow IDs.
+        2) Workflow event queue:
+            Bounded queue of workflows whose metadata.json should be written.
+            Running workflows are also queued every
+            sec_interval_update_metadata.
+        3) Metadata writers:
+            Pool of workers to retrieve metadata from a Cromwell server and
+            write metadata.json. Blocking I/O is done on a thread pool.
+
+    Lifecycle metrics are available as a dict (self.metrics) and
+    are logged every SEC_INTERVAL_LOG_METRICS and on exit.
+    """
+    DEFAULT_NUM_METADATA_WRITERS = 4
+    DEFAULT_MAX_QUEUE_SIZE = 10000
+    SEC_INTERVAL_LOG_METRICS = 600.0
+    # a long stack trace can be printed as a single line.
+    # a longer line is truncated
+    STDOUT_LINE_LIMIT = 16 * 1024 * 1024
+    # wait for a Cromwell server to terminate before killing it
+    SEC_TERMINATE_TIMEOUT = 30.0
+
+    EVENT_UPDATE = 'update'
+    EVENT_FINISHED = 'finished'
+
+    def __init__(self, cmd,
+                 get_workflow_ids_from_stdout,
+                 check_server_start_from_stdout,
+                 write_metadata_json,
+                 on_server_start=None,
+                 on_interrupt=None,
+                 on_workflow_started=None,
+                 num_metadata_writers=DEFAULT_NUM_METADATA_WRITERS,
+                 max_queue_size=DEFAULT_MAX_QUEUE_SIZE,
+                 sec_interval_update_metadata=1200.0,
+                 sec_delay_write_metadata=10.0,
+                 max_retry_write_metadata=3):
+        """
+        Args:
+            cmd:
+                Command line (list) to run a Cromwell server.
+            get_workflow_ids_from_stdout:
+                Function that takes a line of STDOUT and returns
+                a list of (workflow_id, 'started' or 'finished').
+            check_server_start_from_stdout:
+                Function that takes a line of STDOUT and returns
+                True if a server is ready.
+            write_metadata_json:
+                Blocking function that takes a workflow ID and a flag for
+                a finished workflow, and writes metadata.json for it.
+                It should raise an exception on failure.
+                It's called on a thread pool.
+            on_server_start:
+                Callback function called once when a server is ready.
+            on_interrupt:
+                Callback function called on SIGINT.
+                Cromwell server is still supervised until it terminates.
+            on_workflow_started:
+                Blocking callback function that takes a workflow ID
+                when a workflow is started. It's called on a thread pool
+                without being waited for. Exceptions are logged only.
+            num_metadata_writers:
+                Number of concurrent metadata writers.
+            max_queue_size:
+                Maximum size of workflow event queue.
+            sec_interval_update_metadata:
+                Interval to write metadata.json for running workflows.
+            sec_delay_write_metadata:
+                Delay after a workflow event to write metadata.json.
+                This is also used as an interval between retrials.
+            max_retry_write_metadata:
+                Maximum number of retrials to write metadata.json.
+        """
+        self._cmd = cmd
+        self._get_workflow_ids_from_stdout = get_workflow_ids_from_stdout
+        self._check_server_start_from_stdout = check_server_start_from_stdout
+        self._write_metadata_json = write_metadata_json
+        self._on_server_start = on_server_start
+        self._on_interrupt = on_interrupt
+        self._on_workflow_started = on_workflow_started
+        self._num_metadata_writers = num_metadata_writers
+        self._max_queue_size = max_queue_size
+        self._sec_interval_update_metadata = sec_interval_update_metadata
+        self._sec_delay_write_metadata = sec_delay_write_metadata
+        self._max_retry_write_metadata = max_retry_write_metadata
+
+        # pending/running workflows
+        self._started_wf_ids = set()
+        # workflows with a queued update event (to prevent duplicates)
+        self._queued_update_wf_ids = set()
+        self._queue = None
+        self._executor = None
+        self._metrics = {
+            'num_stdout_lines': 0,
+            'num_truncated_stdout_lines': 0,
+            'num_started_workflows': 0,
+            'num_finished_workflows': 0,
+            'queue_depth': 0,
+            'max_queue_depth': 0,
+            'num_metadata_written': 0,
+            'num_metadata_failed': 0,
+            'last_sec_finish_to_metadata': None,
+            'mean_sec_finish_to_metadata': None,
+            'max_sec_finish_to_metadata': None,
+        }
+        self._sum_sec_finish_to_metadata = 0.0
+        self._num_finish_to_metadata = 0
+
+    @property
+    def started_workflow_ids(self):
+        return set(self._started_wf_ids)
+
+    @property
+    def metrics(self):
+        """Snapshot of lifecycle metrics:
+            num_stdout_lines:
+                Number of lines read from Cromwell's STDOUT.
+            num_truncated_stdout_lines:
+                Number of lines truncated to STDOUT_LINE_LIMIT.
+            num_started_workflows, num_finished_workflows:
+                Number of workflow events found in STDOUT.
+            queue_depth, max_queue_depth:
+                Current/maximum number of events in workflow event queue.
+            num_metadata_written, num_metadata_failed:
+                Number of metadata.json written/failed (after all retrials).
+            last/mean/max_sec_finish_to_metadata:
+                Seconds from a workflow's finish (found in STDOUT)
+                to its metadata.json written.
+        """
+        m = dict(self._metrics)
+        if self._queue is not None:
+            m['queue_depth'] = self._queue.qsize()
+        return m
+
+    def run(self):
+        """Runs a Cromwell server and supervises it until it terminates.
+
+        Returns:
+            Return code of a Cromwell server process.
+        """
+        loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._num_metadata_writers)
+        try:
+            asyncio.set_event_loop(loop)
+            loop.add_signal_handler(signal.SIGINT, self.__handle_interrupt)
+            return loop.run_until_complete(self.__supervise())
+        finally:
+            loop.remove_signal_handler(signal.SIGINT)
+            self._executor.shutdown(wait=False)
+            loop.close()
+            logger.info('Server supervisor metrics: {m}'.format(
+                m=self.metrics))
+
+    def __handle_interrupt(self):
+        # Cromwell server in the same process group also gets SIGINT
+        # keep reading its STDOUT until it terminates
+        if self._on_interrupt is not None:
+            self._on_interrupt()
+
+    async def __supervise(self):
+        self._queue = asyncio.Queue(maxsize=self._max_queue_size)
+        proc = await asyncio.create_subprocess_exec(
+            *self._cmd,
+            stdout=asyncio.subprocess.PIPE,
+            limit=CaperServerSupervisor.STDOUT_LINE_LIMIT)
+
+        tasks = [
+            asyncio.ensure_future(self.__write_metadata_worker())
+            for _ in range(self._num_metadata_writers)]
+        tasks.append(asyncio.ensure_future(self.__update_metadata_periodically()))
+        tasks.append(asyncio.ensure_future(self.__log_metrics_periodically()))
+        try:
+            await self.__read_stdout(proc.stdout)
+            return await proc.wait()
+        finally:
+            # server is dead. pending events cannot be processed any longer
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # don't leave a server running if supervision failed
+            await CaperServerSupervisor.__terminate(proc)
+
+    @staticmethod
+    async def __terminate(proc):
+        if proc.returncode is not None:
+            return
+        logger.warning('[Caper] Terminating Cromwell server...')
+        try:
+            proc.terminate()
+            await asyncio.wait_for(
+                proc.wait(), CaperServerSupervisor.SEC_TERMINATE_TIMEOUT)
+        except ProcessLookupError:
+            return
+        except asyncio.TimeoutError:
+            logger.error('[Caper] Killing Cromwell server...')
+            proc.kill()
+            await proc.wait()
+
+    async def __read_stdout(self, stdout):
+        server_is_ready = False
+        while True:
+            line = await self.__readline(stdout)
+            if not line:
+                break
+            line = line.decode(errors='replace').rstrip('\n')
+            self._metrics['num_stdout_lines'] += 1
+            if line == '':
+                continue
+            print(line, flush=True)
+
+            if not server_is_ready:
+                server_is_ready = self._check_server_start_from_stdout(line)
+                if server_is_ready and self._on_server_start is not None:
+                    self._on_server_start()
+
+            for wf_id, status in self._get_workflow_ids_from_stdout(line):
+                if status == 'started':
+                    self._metrics['num_started_workflows'] += 1
+                    self._started_wf_ids.add(wf_id)
+                    if self._on_workflow_started is not None:
+                        asyncio.get_event_loop().run_in_executor(
+                            self._executor, self.__call_on_workflow_started,
+                            wf_id)
+                elif status == 'finished':
+                    self._metrics['num_finished_workflows'] += 1
+                    # flush finished workflow IDs
+                    #   so that their metadata don't get updated any longer
+                    self._started_wf_ids.discard(wf_id)
+                    await self.__put_event(
+                        wf_id, CaperServerSupervisor.EVENT_FINISHED)
+
+    async def __readline(self, stdout):
+        """Read a line from STDOUT. A line longer than STDOUT_LINE_LIMIT
+        is truncated (the rest of it is skipped) instead of raising
+        an exception as in StreamReader.readline().
+
+        Returns:
+            Line (bytes). Empty at EOF.
+        """
+        line = None
+        while True:
+            try:
+                chunk = await stdout.readuntil(b'\n')
+            except asyncio.IncompleteReadError as e:
+                # EOF
+                chunk = e.partial
+            except asyncio.LimitOverrunError as e:
+                # consume a buffer without a separator
+                chunk = await stdout.read(e.consumed)
+                if line is None:
+                    line = chunk[:CaperServerSupervisor.STDOUT_LINE_LIMIT]
+                    self._metrics['num_truncated_stdout_lines'] += 1
+                continue
+            if line is None:
+                return chunk
+            return line
+
+    def __call_on_workflow_started(self, wf_id):
+        try:
+            self._on_workflow_started(wf_id)
+        except Exception as e:
+            logger.warning(
+                '[Caper] Exception caught in a callback for a started '
+                'workflow. wf_id: {wf_id}, e: {e}'.format(
+                    wf_id=wf_id, e=str(e)))
+
+    async def __put_event(self, wf_id, event):
+        if event == CaperServerSupervisor.EVENT_UPDATE:
+            if wf_id in self._queued_update_wf_ids:
+                return
+            self._queued_update_wf_ids.add(wf_id)
+        t = time.monotonic()
+        await self._queue.put((wf_id, event, t))
+        qsize = self._queue.qsize()
+        if qsize > self._metrics['max_queue_depth']:
+            self._metrics['max_queue_depth'] = qsize
+
+    async def __update_metadata_periodically(self):
+        """Write metadata.json for running workflows
+        every sec_interval_update_metadata
+        """
+        while True:
+            await asyncio.sleep(self._sec_interval_update_metadata)
+            for wf_id in list(self._started_wf_ids):
+                await self.__put_event(wf_id, CaperServerSupervisor.EVENT_UPDATE)
+
+    async def __log_metrics_periodically(self):
+        while True:
+            await asyncio.sleep(CaperServerSupervisor.SEC_INTERVAL_LOG_METRICS)
+            logger.info('Server supervisor metrics: {m}'.format(
+                m=self.metrics))
+
+    async def __write_metadata_worker(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            wf_id, event, t_event = await self._queue.get()
+            try:
+                if event == CaperServerSupervisor.EVENT_UPDATE:
+                    self._queued_update_wf_ids.discard(wf_id)
+                    # workflow can be finished while waiting in queue
+                    if wf_id not in self._started_wf_ids:
+                        continue
+                # give Cromwell some time to update metadata
+                # events in a burst are all delayed from their own event time
+                # (not serially)
+                delay = t_event + self._sec_delay_write_metadata - \
+                    time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                for trial in range(self._max_retry_write_metadata + 1):
+                    try:
+                        await loop.run_in_executor(
+                            self._executor, self._write_metadata_json, wf_id,
+                            event == CaperServerSupervisor.EVENT_FINISHED)
+                        self.__update_written_metrics(event, t_event)
+                        break
+                    except Exception as e:
+                        logger.warning(
+                            '[Caper] Exception caught while retrieving '
+                            'metadata from Cromwell server. '
+                            'trial: {t}, wf_id: {wf_id}, e: {e}'.format(
+                                t=trial, wf_id=wf_id, e=str(e)))
+                        if trial == self._max_retry_write_metadata:
+                            self._metrics['num_metadata_failed'] += 1
+                        else:
+                            await asyncio.sleep(self._sec_delay_write_metadata)
+            finally:
+                self._queue.task_done()
+
+    def __update_written_metrics(self, event, t_event):
+        self._metrics['num_metadata_written'] += 1
+        if event != CaperServerSupervisor.EVENT_FINISHED:
+            return
+        sec = time.monotonic() - t_event
+        self._sum_sec_finish_to_metadata += sec
+        self._num_finish_to_metadata += 1
+        self._metrics['last_sec_finish_to_metadata'] = sec
+        self._metrics['mean_sec_finish_to_metadata'] = \
+            self._sum_sec_finish_to_metadata / self._num_finish_to_metadata
+        max_sec = self._metrics['max_sec_finish_to_metadata']
+        if max_sec is None or sec > max_sec:
+            self._metrics['max_sec_finish_to_metadata'] = sec
@@ -1,9 +1,18 @@
+import hashlib
+import json
+import logging
 import os
 import re
-import shutil
+import zipfile
 from autouri import AutoURI, AbsPath, HTTPURL
-from tempfile import TemporaryDirectory
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from WDL import parse_document
+from .caper_cache import CaperCache
+
+
+logger = logging.getLogger(__name__)
 
 
 class CaperWDLParser(object):
@@ -17,154 +26,251 @@ class CaperWDLParser(object):
     2) Find subworkflows and zip it.
         miniwdl (0.3.7) has a bug for URL imports
         Keep using regex to find imports until it's fixed.
+
+    Each WDL is read and parsed only once and then summarized
+    (imports and Caper's parameters). Summaries are cached:
+        1) On memory (LRU, shared by all parser objects):
+            Key is URI + (mtime, size) for a local WDL.
+            Key is URI for a remote WDL (read only once in a process).
+        2) On disk (JSON, if init_wdl_parser() is called with cache_dir,
+           least recently used ones are evicted by size):
+            Key is md5 hash of WDL's contents. So that repeated
+            submissions of the same WDL skip miniwdl parsing entirely.
     """
     RE_PATTERN_WDL_IMPORT = r'^\s*import\s+[\"\'](.+)[\"\']\s*'
     RE_PATTERN_WDL_COMMENT_DOCKER = r'^\s*\#\s*CAPER\s+docker\s(.+)'
     RE_PATTERN_WDL_COMMENT_SINGULARITY = r'^\s*\#\s*CAPER\s+singularity\s(.+)'
-    RECURSION_DEPTH_LIMIT = 20
+    MAX_NUM_IMPORT_FETCHERS = 8
+    # fixed date_time for zipped files so that
+    # the same subworkflows make the same imports.zip
+    ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
     WDL_WORKFLOW_META_DOCKER = 'caper_docker'
     WDL_WORKFLOW_META_SINGULARITY = 'caper_singularity'
+    # increase it if format of a summary changes
+    SUMMARY_VERSION = 1
+    MAX_MEM_CACHE_SIZE = 256
+
+    SUMMARY_CACHE = None
+    _mem_cache = OrderedDict()
+    _mem_cache_lock = Lock()
 
     def __init__(self, wdl):
         self._wdl = AbsPath.get_abspath_if_exists(wdl)
 
+    @staticmethod
+    def init_wdl_parser(cache_dir=None, max_mem_cache_size=None,
+                        max_cache_size=CaperCache.DEFAULT_MAX_SIZE):
+        """
+        Args:
+            cache_dir:
+                Root directory for Caper's local caches. WDL summaries are
+                cached on its namespace CaperCache.NAMESPACE_WDL_SUMMARY.
+                On-disk cache is disabled if not defined.
+            max_mem_cache_size:
+                Maximum number of WDLs cached on memory.
+            max_cache_size:
+                Maximum total size of on-disk cache of WDL summaries
+                in bytes. Least recently used ones are evicted.
+        """
+        if cache_dir is not None:
+            CaperWDLParser.SUMMARY_CACHE = CaperCache(
+                cache_dir, CaperCache.NAMESPACE_WDL_SUMMARY,
+                ext='.json', max_size=max_cache_size)
+        if max_mem_cache_size is not None:
+            CaperWDLParser.MAX_MEM_CACHE_SIZE = max_mem_cache_size
+
+    @property
+    def contents(self):
+        """Contents of WDL (cached).
+        """
+        return self.__get_cached()['contents']
+
+    @property
+    def md5(self):
+        """md5 hash of WDL's contents (cached).
+        """
+        return self.__get_cached()['md5']
+
     def find_imports(self):
-        try:
-            wdl = parse_document(AutoURI(self._wdl).read())
-            return [i.uri for i in wdl.imports]
-        except:
-            pass
+        summary = self.__get_cached()['summary']
+        if summary['imports'] is not None:
+            return list(summary['imports'])
         # backward compatibililty: keep using old regex method
-        r = self.__find_val(
-            CaperWDLParser.RE_PATTERN_WDL_IMPORT)
-        return r
+        return list(summary['comment_imports'])
 
     def find_docker(self):
-        r = self.__find_workflow_meta(
+        summary = self.__get_cached()['summary']
+        r = summary['workflow_meta'].get(
             CaperWDLParser.WDL_WORKFLOW_META_DOCKER)
         if r is not None:
             return r
 
         # backward compatibililty: keep using old regex method
-        r = self.__find_val(
-            CaperWDLParser.RE_PATTERN_WDL_COMMENT_DOCKER)
+        r = summary['comment_docker']
         return r[0] if len(r) > 0 else None
 
     def find_singularity(self):
-        r = self.__find_workflow_meta(
+        summary = self.__get_cached()['summary']
+        r = summary['workflow_meta'].get(
             CaperWDLParser.WDL_WORKFLOW_META_SINGULARITY)
         if r is not None:
             return r
 
         # backward compatibililty: keep using old regex method
-        r = self.__find_val(
-            CaperWDLParser.RE_PATTERN_WDL_COMMENT_SINGULARITY)
+        r = summary['comment_singularity']
         return r[0] if len(r) > 0 else None
 
-    def zip_subworkflows(self, zip_file):
+    def zip_subworkflows(self, zip_file, cache=None):
         """Zip imported subworkflow WDLs (with relative paths only).
         For this (main) workflow, any URI is allowed.
         However, only subworkflows with relative path will be zipped.
+
+        Import graph is resolved first (see __resolve_import_graph())
+        and each unique sub-WDL is zipped only once.
+        Zipped files are sorted and have a fixed date_time so that
+        the same set of sub-WDLs make the same imports.zip.
+
+        Args:
+            cache:
+                CaperCache object for imports.zip.
+                Key is a hash of main WDL and all sub-WDLs (recursively).
+                A cached imports.zip is copied to zip_file if found.
+
+        Returns:
+            Total number of unique subworkflows zipped.
+            imports.zip is not created if it's zero.
         """
-        with TemporaryDirectory() as tmp_d:
-            main_wdl = AbsPath.localize(self._wdl)
-            u = AutoURI(main_wdl)
-            # with a directory structure as they imported
-            num_sub_wf_packed = self.__recurse_subworkflow(
-                root_wdl_dir=u.dirname,
-                root_zip_dir=tmp_d)
-            if num_sub_wf_packed:
-                shutil.make_archive(AutoURI(zip_file).uri_wo_ext, 'zip', tmp_d)
-            return num_sub_wf_packed
-
-    def __find_val(self, regex_val):
-        u = AutoURI(self._wdl)
-        if not u.exists:
-            raise ValueError('WDL does not exist: wdl={wdl}'.format(wdl=self._wdl))
-        result = []
-        for line in u.read().split('\n'):
-            r = re.findall(regex_val, line)
-            if len(r) > 0:
-                ret = r[0].strip()
-                if len(ret) > 0:
-                    result.append(ret)
-        return result
+        main_wdl = AbsPath.localize(self._wdl)
+        root_wdl_dir = AutoURI(main_wdl).dirname
+        graph = self.__resolve_import_graph(root_wdl_dir)
 
-    def __find_workflow_meta(self, key):
-        """Find value for a key in workflow's meta section
+        cycle = CaperWDLParser.__find_cyclic_import(self._wdl, graph)
+        if cycle is not None:
+            raise ValueError(
+                'Found cyclic import or self-referencing in WDLs: '
+                '{cycle}'.format(cycle=' -> '.join(cycle)))
+
+        # local sub-WDLs with a directory structure as they imported
+        sub_wdls = sorted(
+            (os.path.relpath(wdl, root_wdl_dir), wdl)
+            for wdl in graph
+            if wdl != self._wdl and not isinstance(AutoURI(wdl), HTTPURL))
+        if sub_wdls and cache is not None:
+            key = self.__get_import_graph_hash(graph, root_wdl_dir)
+            if cache.get(key, dest=zip_file) is not None:
+                return len(sub_wdls)
+
+        if sub_wdls:
+            with zipfile.ZipFile(
+                    zip_file, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+                for rel_path, wdl in sub_wdls:
+                    info = zipfile.ZipInfo(
+                        rel_path, date_time=CaperWDLParser.ZIP_DATE_TIME)
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    info.external_attr = 0o644 << 16
+                    zf.writestr(info, CaperWDLParser(wdl).contents)
+            if cache is not None:
+                cache.put(key, zip_file)
+        return len(sub_wdls)
 
+    def __get_import_graph_hash(self, graph, root_wdl_dir):
+        """md5 hash of contents of main WDL and all sub-WDLs
+        with their locations (relative path or URL).
+        """
+        h = hashlib.md5()
+        for wdl in sorted(graph):
+            if wdl == self._wdl:
+                loc = ''
+            elif isinstance(AutoURI(wdl), HTTPURL):
+                loc = wdl
+            else:
+                loc = os.path.relpath(wdl, root_wdl_dir)
+            h.update('{loc}\t{md5}\n'.format(
+                loc=loc, md5=CaperWDLParser(wdl).md5).encode())
+        return h.hexdigest()
+
+    def __resolve_import_graph(self, root_wdl_dir):
+        """Resolve import graph of all sub-WDLs (recursively) in main-WDL.
+        Graph is traversed level by level and
+        sub-WDLs in each level are read/parsed concurrently.
+        Each unique sub-WDL is read/parsed only once
+        even if it's imported by multiple WDLs.
+
+        Args:
+            root_wdl_dir:
+                Local directory of main WDL.
         Returns:
-            None if key not found or any error occurs.
+            dict of {WDL: list of resolved sub-WDLs imported in it}
+            for main-WDL and all sub-WDLs. See __resolve_imports() for
+            how sub-WDLs are resolved.
         """
-        try:
-            wdl = parse_document(AutoURI(self._wdl).read())
-            if key in wdl.workflow.meta:
-                return wdl.workflow.meta[key]
-        except:
-            pass
-        return None
+        graph = {}
+        seen = {self._wdl}
+        frontier = [self._wdl]
+        with ThreadPoolExecutor(
+                max_workers=CaperWDLParser.MAX_NUM_IMPORT_FETCHERS) as executor:
+            while frontier:
+                resolved = list(executor.map(
+                    lambda wdl: CaperWDLParser.__resolve_imports(
+                        wdl, root_wdl_dir, is_root=wdl == self._wdl),
+                    frontier))
+                next_frontier = []
+                for wdl, sub_wdls in zip(frontier, resolved):
+                    graph[wdl] = sub_wdls
+                    for sub_wdl in sub_wdls:
+                        if sub_wdl not in seen:
+                            seen.add(sub_wdl)
+                            next_frontier.append(sub_wdl)
+                frontier = next_frontier
+        return graph
 
-    def __recurse_subworkflow(
-        self,
-        root_zip_dir=None,
-        root_wdl_dir=None,
-        imported_as_url=False,
-        depth=0):
-        """Recurse imported sub-WDLs in main-WDL.
+    @staticmethod
+    def __resolve_imports(wdl, root_wdl_dir, is_root=False):
+        """Resolve imports in a WDL.
 
         Unlike Cromwell, Womtool does not take imports.zip while validating WDLs.
-        All sub-WDLs should be in a correct directory structure relative to the 
+        All sub-WDLs should be in a correct directory structure relative to the
         root WDL.
         For Womtool, we should make a temporary directory and unpack imports.zip there and
         need to make a copy of root WDL on it. Then run Womtool to validate them.
-        This function is to make such imports.zip.
+        zip_subworkflows() is to make such imports.zip.
 
         Sub-WDLs imported as relative path simply inherit parent's directory.
-        Sub-WDLs imported as URL does not inherit parent's directory but root 
+        Sub-WDLs imported as URL does not inherit parent's directory but root
         WDL's directory.
         Sub-WDLs imported as absolute path are not allowed. This can work with "caper run"
         but not with "caper submit" (or Cromwell submit).
 
-        Args:
-            depth: Recursion depth
         Returns:
-            Total number of subworkflows:
-                Sub WDL files "recursively" localized on "root_zip_dir".
+            List of sub-WDLs: URL for a sub-WDL imported as URL.
+                Absolute path for a sub-WDL imported as relative path.
         """
-        if depth > CaperWDLParser.RECURSION_DEPTH_LIMIT:
-            raise ValueError(
-                'Reached recursion depth limit while zipping subworkflows recursively. '
-                'Possible clyclic import or self-refencing in WDLs? wdl={wdl}'.format(
-                    wdl=self._wdl))
-
-        if imported_as_url:
+        imported_as_url = isinstance(AutoURI(wdl), HTTPURL)
+        if imported_as_url or is_root:
             main_wdl_dir = root_wdl_dir
         else:
-            main_wdl_dir = AbsPath(self._wdl).dirname
+            main_wdl_dir = os.path.dirname(wdl)
 
-        num_sub_wf_packed = 0
-        imports = self.find_imports()
-        for sub_rel_to_parent in imports:
+        result = []
+        for sub_rel_to_parent in CaperWDLParser(wdl).find_imports():
             u_sub = AutoURI(sub_rel_to_parent)
 
             if isinstance(u_sub, HTTPURL):
                 sub_abs = u_sub.uri
-                imported_as_url_sub = True
             elif isinstance(u_sub, AbsPath):
                 raise ValueError(
                     'For sub WDL zipping, absolute path is not allowed for sub WDL. '
                     'main={main}, sub={sub}'.format(
-                        main=self._wdl, sub=sub_rel_to_parent))
+                        main=wdl, sub=sub_rel_to_parent))
             else:
                 sub_abs = os.path.realpath(
                     os.path.join(main_wdl_dir, sub_rel_to_parent))
-                u_sub_abs = AbsPath(sub_abs)
-                if not u_sub_abs.exists:
+                if not os.path.exists(sub_abs):
                     raise FileNotFoundError(
                         'Sub WDL does not exist. Did you import main WDL '
                         'as a URL but sub WDL references a local file? '
                         'main={main}, sub={sub}, imported_as_url={i}'.format(
-                            main=self._wdl, sub=sub_rel_to_parent, i=imported_as_url))
+                            main=wdl, sub=sub_rel_to_parent, i=imported_as_url))
                 if not sub_abs.startswith(root_wdl_dir):
                     raise ValueError(
                         'Sub WDL exists but it is out of root WDL directory. '
@@ -172,19 +278,171 @@ class CaperWDLParser(object):
                         'Or main WDL is imported as an URL but sub WDL '
                         'has "../"? '
                         'main={main}, sub={sub}, imported_as_url={i}'.format(
-                            main=self._wdl, sub=sub_rel_to_parent, i=imported_as_url))
-
-                # make a copy on zip_dir
-                rel_path = os.path.relpath(sub_abs, root_wdl_dir)
-                cp_dest = os.path.join(root_zip_dir, rel_path)
-
-                u_sub_abs.cp(cp_dest)
-                num_sub_wf_packed += 1
-                imported_as_url_sub = False
-
-            num_sub_wf_packed += CaperWDLParser(sub_abs).__recurse_subworkflow(
-                root_zip_dir=root_zip_dir,
-                root_wdl_dir=root_wdl_dir,
-                imported_as_url=imported_as_url_sub,
-                depth=depth + 1)
-        return num_sub_wf_packed
+                            main=wdl, sub=sub_rel_to_parent, i=imported_as_url))
+            result.append(sub_abs)
+        return result
+
+    @staticmethod
+    def __find_cyclic_import(root, graph):
+        """Find a cycle in import graph with an iterative DFS.
+
+        Returns:
+            List of WDLs in a cycle (e.g. [a, b, a]). None if not found.
+        """
+        VISITING, DONE = 1, 2
+        state = {root: VISITING}
+        path = [root]
+        stack = [iter(graph[root])]
+        while stack:
+            sub_wdl = next(stack[-1], None)
+            if sub_wdl is None:
+                state[path.pop()] = DONE
+                stack.pop()
+            elif state.get(sub_wdl) == VISITING:
+                return path[path.index(sub_wdl):] + [sub_wdl]
+            elif sub_wdl not in state:
+                state[sub_wdl] = VISITING
+                path.append(sub_wdl)
+                stack.append(iter(graph[sub_wdl]))
+        return None
+
+    def __get_cached(self):
+        """Get a cache entry for WDL. Read/summarize it if not cached.
+
+        Returns:
+            dict of {
+                'contents': contents of WDL,
+                'md5': md5 hash of contents,
+                'summary': see __summarize()
+            }
+        """
+        u = AutoURI(self._wdl)
+        if isinstance(u, AbsPath):
+            try:
+                st = os.stat(u.uri)
+                key = (u.uri, st.st_mtime, st.st_size)
+            except OSError:
+                key = (u.uri,)
+        else:
+            key = (u.uri,)
+
+        with CaperWDLParser._mem_cache_lock:
+            entry = CaperWDLParser._mem_cache.get(key)
+            if entry is not None:
+                CaperWDLParser._mem_cache.move_to_end(key)
+                return entry
+
+        try:
+            contents = u.read()
+        except Exception:
+            if not u.exists:
+                raise ValueError(
+                    'WDL does not exist: wdl={wdl}'.format(wdl=self._wdl))
+            raise
+        md5 = hashlib.md5(contents.encode()).hexdigest()
+        summary = CaperWDLParser.__load_summary(md5)
+        if summary is None:
+            summary = CaperWDLParser.__summarize(contents)
+            CaperWDLParser.__save_summary(md5, summary)
+        entry = {
+            'contents': contents,
+            'md5': md5,
+            'summary': summary
+        }
+
+        with CaperWDLParser._mem_cache_lock:
+            CaperWDLParser._mem_cache[key] = entry
+            while len(CaperWDLParser._mem_cache) > \
+                    CaperWDLParser.MAX_MEM_CACHE_SIZE:
+                CaperWDLParser._mem_cache.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def __summarize(contents):
+        """Parse WDL's contents with miniwdl and find values for Caper.
+
+        Returns:
+            dict of {
+                'version': SUMMARY_VERSION,
+                'imports': list of imports found by miniwdl
+                           (None if failed to parse),
+                'workflow_meta': {key: val} for Caper's keys found in
+                                 workflow's meta section,
+                'comment_imports': list of imports found by regex,
+                'comment_docker': list of docker found in WDL comments,
+                'comment_singularity': list of singularity found in
+                                       WDL comments
+            }
+        """
+        imports = None
+        workflow_meta = {}
+        try:
+            wdl = parse_document(contents)
+            imports = [i.uri for i in wdl.imports]
+            if wdl.workflow is not None:
+                for key in (CaperWDLParser.WDL_WORKFLOW_META_DOCKER,
+                            CaperWDLParser.WDL_WORKFLOW_META_SINGULARITY):
+                    if key in wdl.workflow.meta:
+                        workflow_meta[key] = wdl.workflow.meta[key]
+        except:
+            pass
+
+        return {
+            'version': CaperWDLParser.SUMMARY_VERSION,
+            'imports': imports,
+            'workflow_meta': workflow_meta,
+            'comment_imports': CaperWDLParser.__find_val(
+                contents, CaperWDLParser.RE_PATTERN_WDL_IMPORT),
+            'comment_docker': CaperWDLParser.__find_val(
+                contents, CaperWDLParser.RE_PATTERN_WDL_COMMENT_DOCKER),
+            'comment_singularity': CaperWDLParser.__find_val(
+                contents, CaperWDLParser.RE_PATTERN_WDL_COMMENT_SINGULARITY)
+        }
+
+    @staticmethod
+    def __load_summary(md5):
+        """Load a summary from on-disk cache.
+
+        Returns:
+            None if not found or invalid.
+        """
+        if CaperWDLParser.SUMMARY_CACHE is None:
+            return None
+        f = CaperWDLParser.SUMMARY_CACHE.get(md5)
+        if f is None:
+            return None
+        try:
+            with open(f) as fp:
+                summary = json.loads(fp.read())
+            if summary.get('version') == CaperWDLParser.SUMMARY_VERSION:
+                logger.debug('Loaded cached WDL summary: {f}'.format(f=f))
+                return summary
+        except Exception:
+            logger.debug('Ignored invalid WDL summary: {f}'.format(f=f))
+        return None
+
+    @staticmethod
+    def __save_summary(md5, summary):
+        """Save a summary to on-disk cache. Any error is ignored
+        since it's just a cache.
+        """
+        if CaperWDLParser.SUMMARY_CACHE is None:
+            return
+        try:
+            CaperWDLParser.SUMMARY_CACHE.write(
+                md5, json.dumps(summary, default=str))
+        except Exception as e:
+            logger.debug(
+                'Failed to write WDL summary: {md5}, e={e}'.format(
+                    md5=md5, e=e))
+
+    @staticmethod
+    def __find_val(contents, regex_val):
+        result = []
+        for line in contents.split('\n'):
+            r = re.findall(regex_val, line)
+            if len(r) > 0:
+                ret = r[0].strip()
+                if len(ret) > 0:
+                    result.append(ret)
+        return result
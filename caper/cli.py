@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 import logging
 import sys
-from autouri import AbsPath, GCSURI, S3URI, URIBase
-from .caper import Caper
-from .caper_args import parse_caper_arguments
-from .caper_check import check_caper_conf
-from .caper_init import init_caper_conf
+import time
+from .caper_backend import get_backend
+from .caper_hook_args import parse_hook_arguments
+from .cluster_status import ClusterStatusCache
+from .local_slot import LocalSlotAllocator
+from .slurm_array import SlurmArrayBroker
 
 
 def init_logging(args):
@@ -20,9 +21,79 @@ def init_logging(args):
     logging.getLogger('filelock').setLevel('CRITICAL')
 
 
+def local_slot(args):
+    """Acquire a local slot for a task or show utilization.
+    Acquisition is called by Cromwell for each task on local backend so
+    messages are written to STDERR, which goes to a task's stderr.submit
+    """
+    allocator = LocalSlotAllocator(
+        local_slot_dir=args.get('local_slot_dir'),
+        max_cpu=args.get('local_max_cpu'),
+        max_memory_mb=args.get('local_max_memory_mb'))
+    if args.get('local_slot_action') == 'acquire':
+        t = time.time()
+        u = allocator.acquire(
+            cpu=args.get('cpu'), memory_mb=args.get('memory_mb'))
+        print(
+            '[Caper] Acquired a local slot (cpu={c}, memory_mb={m}) after '
+            'waiting for {t:.1f} sec. cpu: {cpu}/{max_cpu}, '
+            'memory_mb: {memory_mb}/{max_memory_mb}, running: {num_running}, '
+            'waiting: {num_waiting}'.format(
+                c=args.get('cpu'), m=args.get('memory_mb'),
+                t=time.time() - t, **u),
+            file=sys.stderr)
+    else:
+        u = allocator.utilization()
+        print('running\twaiting\tcpu\tmax_cpu\tmemory_mb\tmax_memory_mb')
+        print('{num_running}\t{num_waiting}\t{cpu}\t{max_cpu}\t'
+              '{memory_mb}\t{max_memory_mb}'.format(**u))
+
+
+def run_hook(args):
+    """Run a hook subcommand called by Cromwell for each task/job.
+    """
+    action = args['action']
+    if action == 'check-alive':
+        # called by Cromwell for each job. must be quick and quiet
+        alive = ClusterStatusCache(
+            get_backend(args.get('backend')),
+            cluster_status_dir=args.get('cluster_status_dir'),
+            max_retries=args.get('check_alive_max_retries'),
+            backoff_sec=args.get('retry_backoff_sec'),
+            max_backoff_sec=args.get('retry_max_backoff_sec'),
+            jitter=args.get('retry_jitter')).check_alive(args['job_id'])
+        if alive:
+            print(args['job_id'])
+        sys.exit(0 if alive else 1)
+    elif action == 'local-slot':
+        local_slot(args)
+        sys.exit(0)
+    elif action == 'sbatch':
+        # called by Cromwell for each task. must behave like sbatch
+        rc, stdout, stderr = SlurmArrayBroker.submit(
+            args['sbatch_args'],
+            slurm_array_dir=args.get('slurm_array_dir'))
+        sys.stdout.write(stdout)
+        sys.stderr.write(stderr)
+        sys.exit(rc if rc >= 0 else 1)
+
+
 def main():
     """CLI for Caper
     """
+    # hook subcommands are called by Cromwell for each task/job.
+    # run them before importing heavy modules (e.g. autouri)
+    args = parse_hook_arguments()
+    if args is not None:
+        run_hook(args)
+
+    from autouri import AbsPath, GCSURI, S3URI
+    from .caper import Caper
+    from .caper_args import parse_caper_arguments
+    from .caper_check import check_caper_conf
+    from .caper_init import init_caper_conf
+    from .caper_wdl_parser import CaperWDLParser
+
     # parse arguments: note that args is a dict
     args = parse_caper_arguments()
 
@@ -48,6 +119,11 @@ def main():
     S3URI.init_s3uri(
         loc_prefix=args.get('tmp_s3_bucket')
     )
+    # on-disk cache for parsed WDLs
+    CaperWDLParser.init_wdl_parser(
+        cache_dir=args.get('cache_dir'),
+        max_cache_size=args.get('max_cache_size') * 1024 * 1024
+    )
 
     c = Caper(args)
     if action == 'run':
@@ -66,6 +142,8 @@ def main():
         c.unhold()
     elif action in ['troubleshoot', 'debug']:
         c.troubleshoot()
+    elif action == 'cache':
+        c.cache()
     else:
         raise ValueError(
         	'Unsupported or unspecified action. act={a}'.format(a=action))
@@ -0,0 +1,278 @@
+"""ClusterStatusCache: shared cache of job IDs alive on a cluster engine
+"""
+
+import getpass
+import json
+import logging
+import os
+import random
+import re
+import socket
+import time
+from subprocess import Popen, PIPE, TimeoutExpired
+from threading import Event, Thread
+from .caper_backend import BACKEND_SLURM, BACKEND_SGE, BACKEND_PBS
+
+
+logger = logging.getLogger(__name__)
+
+
+class ClusterStatusCache(object):
+    """Cache of job IDs of a user alive (pending/running) on
+    a cluster engine (SLURM, SGE or PBS).
+
+    A daemon thread (one per Caper server or Caper run) runs a single bulk
+    query (squeue/qstat) for all jobs of a user every sec_interval and
+    writes job IDs to a status file atomically.
+    Cromwell's check-alive for each job ("caper check-alive JOB_ID") reads
+    this file instead of querying a cluster engine for each job.
+
+    A job found in a fresh status file is alive. Otherwise (a finished
+    job, a new job submitted after the last bulk query or a stale status
+    file), a cluster engine is queried directly for a job.
+    A job is never inferred dead from its job ID since job IDs wrap around
+    (e.g. SLURM's MaxJobId, SGE's 9999999).
+
+    squeue lists each task of an array job (JOBID_TASKID, see
+    SlurmArrayBroker) separately (--array).
+
+    A status file is per backend, user and host (where Cromwell runs).
+    """
+    DEFAULT_CLUSTER_STATUS_DIR = '~/.caper/cluster_status'
+    SEC_DEFAULT_INTERVAL = 30.0
+    # status file older than this number of intervals is ignored
+    MAX_AGE_IN_INTERVALS = 3
+    SEC_QUERY_TIMEOUT = 120.0
+
+    # direct query for a single job. max trials and delay before a retry
+    # squeue on a busy cluster can fail. so retry
+    # (same as the original check-alive command for SLURM)
+    # delay doubles for each retry up to max_backoff_sec (with jitter)
+    DIRECT_QUERY_NUM_TRIALS = {
+        BACKEND_SLURM: 3,
+        BACKEND_SGE: 1,
+        BACKEND_PBS: 1,
+    }
+    SEC_DIRECT_QUERY_RETRY = 30.0
+
+    BACKENDS = (BACKEND_SLURM, BACKEND_SGE, BACKEND_PBS)
+    RE_PATTERN_JOB_ID = r'^(\d+)'
+
+    def __init__(self, backend, cluster_status_dir=DEFAULT_CLUSTER_STATUS_DIR,
+                 sec_interval=SEC_DEFAULT_INTERVAL, user=None,
+                 max_retries=None, backoff_sec=None, max_backoff_sec=None,
+                 jitter=None):
+        """
+        Args:
+            backend:
+                slurm, sge or pbs.
+            cluster_status_dir:
+                Directory for status files.
+            sec_interval:
+                Interval for bulk queries in seconds.
+            user:
+                Find jobs of this user. Current user if not defined.
+            max_retries:
+                Number of retries for a direct query.
+                DIRECT_QUERY_NUM_TRIALS - 1 if not defined.
+            backoff_sec, max_backoff_sec, jitter:
+                Delay before the first retry, maximum delay and
+                fraction (0.0 to 1.0) of a delay randomly reduced.
+        """
+        if backend not in ClusterStatusCache.BACKENDS:
+            raise ValueError(
+                'Unsupported backend for cluster status: {b}'.format(
+                    b=backend))
+        self._backend = backend
+        self._sec_interval = sec_interval
+        self._user = user if user is not None else getpass.getuser()
+        self._status_file = os.path.join(
+            os.path.expanduser(cluster_status_dir),
+            '{backend}.{user}.{host}.json'.format(
+                backend=backend, user=self._user,
+                host=socket.gethostname()))
+        self._num_trials = ClusterStatusCache.DIRECT_QUERY_NUM_TRIALS[backend] \
+            if max_retries is None else max_retries + 1
+        self._backoff_sec = ClusterStatusCache.SEC_DIRECT_QUERY_RETRY \
+            if backoff_sec is None else backoff_sec
+        self._max_backoff_sec = self._backoff_sec \
+            if max_backoff_sec is None else max_backoff_sec
+        self._jitter = 0.0 if jitter is None else jitter
+        self._stop_event = Event()
+        self._thread = None
+
+    @property
+    def status_file(self):
+        return self._status_file
+
+    def start(self):
+        """Start a daemon thread for bulk queries.
+        """
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = Thread(target=self.__update_periodically, daemon=True)
+        self._thread.start()
+        logger.info(
+            'Cluster status cache: {f}, interval={i}s'.format(
+                f=self._status_file, i=self._sec_interval))
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def update(self):
+        """Run a bulk query and write job IDs to a status file.
+
+        Returns:
+            Set of job IDs. None if a bulk query failed.
+        """
+        t = time.time()
+        job_ids = self.__query_all()
+        if job_ids is None:
+            return None
+        os.makedirs(os.path.dirname(self._status_file), exist_ok=True)
+        tmp_file = '{f}.{pid}.tmp'.format(f=self._status_file, pid=os.getpid())
+        with open(tmp_file, 'w') as fp:
+            fp.write(json.dumps({
+                'backend': self._backend,
+                'user': self._user,
+                'time': t,
+                'sec_interval': self._sec_interval,
+                'job_ids': sorted(job_ids)}))
+        os.replace(tmp_file, self._status_file)
+        return job_ids
+
+    def check_alive(self, job_id):
+        """Check if a job is alive (pending or running).
+        Answered from a status file if possible.
+        Otherwise a cluster engine is queried directly.
+        """
+        job_id = str(job_id)
+        alive = self.__check_alive_from_status_file(job_id)
+        if alive is None:
+            alive = self.__query_job(job_id)
+        return alive
+
+    def __update_periodically(self):
+        while not self._stop_event.is_set():
+            try:
+                if self.update() is None:
+                    logger.warning(
+                        'Failed to query status of jobs on {b}.'.format(
+                            b=self._backend))
+            except Exception as e:
+                logger.warning(
+                    'Exception caught while updating cluster status. '
+                    '{e}'.format(e=str(e)))
+            self._stop_event.wait(self._sec_interval)
+
+    def __check_alive_from_status_file(self, job_id):
+        """
+        Returns:
+            True if a job is found in a fresh status file. Otherwise None.
+        """
+        try:
+            with open(self._status_file, 'r') as fp:
+                status = json.loads(fp.read())
+        except (OSError, ValueError):
+            return None
+        # interval of a daemon which wrote the status file
+        max_age = status['sec_interval'] * \
+            ClusterStatusCache.MAX_AGE_IN_INTERVALS
+        if time.time() - status['time'] > max_age:
+            return None
+        if job_id in set(status['job_ids']):
+            return True
+        return None
+
+    def __query_all(self):
+        """Bulk query for all jobs of a user.
+
+        Returns:
+            Set of job IDs. None if failed.
+        """
+        if self._backend == BACKEND_SLURM:
+            cmd = ['squeue', '--noheader', '--array', '--user', self._user,
+                   '--format=%i']
+        else:
+            cmd = ['qstat', '-u', self._user]
+        rc, stdout = ClusterStatusCache.__run(cmd)
+        if rc:
+            return None
+        return ClusterStatusCache.parse_job_ids(self._backend, stdout)
+
+    def __query_job(self, job_id):
+        """Query a cluster engine directly for a job.
+        """
+        delay = self._backoff_sec
+        for trial in range(self._num_trials):
+            if self._backend == BACKEND_SLURM:
+                # squeue -j JOB_ID doesn't return 1 when there is no such job
+                _, stdout = ClusterStatusCache.__run(
+                    ['squeue', '--noheader', '--array', '-j', job_id,
+                     '--format=%i'])
+                if job_id in stdout.split():
+                    return True
+            elif self._backend == BACKEND_SGE:
+                rc, _ = ClusterStatusCache.__run(['qstat', '-j', job_id])
+                if not rc:
+                    return True
+            else:
+                rc, _ = ClusterStatusCache.__run(['qstat', job_id])
+                if not rc:
+                    return True
+            if trial < self._num_trials - 1:
+                time.sleep(delay * (1.0 - self._jitter * random.random()))
+                delay = min(delay * 2, max(self._max_backoff_sec,
+                                           self._backoff_sec))
+        return False
+
+    @staticmethod
+    def parse_job_ids(backend, stdout):
+        """Parse job IDs from STDOUT of a bulk query.
+
+        SLURM (squeue --array --format=%i):
+            One job ID per line. An array job's task is shown as
+            JOBID_TASKID so that both JOBID_TASKID and JOBID are included.
+        SGE/PBS (qstat -u USER):
+            Job ID is the first column. A header is ignored.
+            PBS's job ID (e.g. 1234.server) is truncated to digits.
+        """
+        job_ids = set()
+        for line in stdout.splitlines():
+            cols = line.split()
+            if not cols:
+                continue
+            if backend == BACKEND_SLURM:
+                job_ids.add(cols[0])
+                job_ids.add(cols[0].split('_')[0])
+            else:
+                m = re.findall(ClusterStatusCache.RE_PATTERN_JOB_ID, cols[0])
+                if m:
+                    job_ids.add(m[0])
+        return job_ids
+
+    @staticmethod
+    def __run(cmd):
+        """
+        Returns:
+            Tuple of (return code, STDOUT). Return code is -1 if
+            a command is not found or timed out.
+        """
+        try:
+            p = Popen(cmd, stdout=PIPE, stderr=PIPE)
+        except OSError as e:
+            logger.debug('Failed to run {cmd}. {e}'.format(cmd=cmd, e=e))
+            return -1, ''
+        try:
+            stdout, _ = p.communicate(
+                timeout=ClusterStatusCache.SEC_QUERY_TIMEOUT)
+        except TimeoutExpired:
+            p.kill()
+            p.communicate()
+            return -1, ''
+        return p.returncode, stdout.decode(errors='replace')
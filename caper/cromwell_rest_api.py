@@ -1,9 +1,13 @@
-import fnmatch
 import io
 import json
 import logging
+import re
 import requests
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .workflow_matcher import WorkflowMatcher
 
 
 logger = logging.getLogger(__name__)
@@ -18,19 +22,59 @@ class CromwellRestAPI(object):
     ENDPOINT_SUBMIT = '/api/workflows/v1'
     ENDPOINT_ABORT = '/api/workflows/v1/{wf_id}/abort'
     ENDPOINT_RELEASE_HOLD = '/api/workflows/v1/{wf_id}/releaseHold'
+    ENDPOINT_DESCRIBE = '/api/womtool/v1/describe'
     KEY_LABEL = 'cromwell_rest_api_label'
     PARAMS_WORKFLOWS = {
         'additionalQueryResultFields': 'labels'
     }
+    RE_PATTERN_WORKFLOW_ID = \
+        r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
+    # to keep URL of a query short enough
+    MAX_VALUES_PER_QUERY = 20
+    DEFAULT_PAGE_SIZE = 1000
+    DEFAULT_CHUNK_SIZE = 1024 * 1024
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_MAX_WORKERS = 8
+    DEFAULT_MAX_RETRIES = 3
+    DEFAULT_BACKOFF_FACTOR = 0.5
+    RETRY_STATUS_FORCELIST = (502, 503, 504)
+    STATUS_ERROR = 'error'
+    # fail fast if there is no server
+    SEC_CONNECT_TIMEOUT_DESCRIBE = 3.0
+    SEC_READ_TIMEOUT_DESCRIBE = 60.0
 
     def __init__(self, ip='localhost', port=8000,
-                 user=None, password=None):
+                 user=None, password=None,
+                 pool_size=DEFAULT_POOL_SIZE,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Args:
+            pool_size:
+                Maximum number of keep-alive connections kept in
+                a session's connection pool.
+            max_retries:
+                Number of retries for a failed connection or for
+                a gateway error (502, 503, 504) on idempotent requests.
+            backoff_factor:
+                Backoff factor for retries. Sleeps
+                {backoff_factor} * (2 ** ({number of retries} - 1))
+                seconds between retries.
+            max_workers:
+                Maximum number of concurrent requests when
+                a request is made for each of multiple workflows
+                (abort, release_hold and get_metadata).
+                1 means serial requests.
+        """
         self._ip = ip
         self._port = port
+        self._max_workers = max_workers
 
         self._user = user
         self._password = password
         self.__init_auth()
+        self.__init_session(pool_size, max_retries, backoff_factor)
 
     def submit(self, source, dependencies=None, inputs_file=None,
                options_file=None, labels_file=None, on_hold=False):
@@ -63,22 +107,63 @@ class CromwellRestAPI(object):
         logger.debug('submit: {r}'.format(r=r))
         return r
 
+    def describe(self, source, inputs_file=None):
+        """Validate a workflow (and its inputs) with Cromwell server's
+        built-in womtool, which is already loaded on a running JVM.
+        Sub-WDLs (imports) are not supported.
+
+        It does not retry and does not exit on failure
+        so that a caller can fall back to a standalone womtool.
+
+        Returns:
+            JSON response with keys "valid" and "errors" (and others).
+            None if a server or its womtool endpoint is not available.
+        """
+        manifest = {
+            'workflowSource':
+                CromwellRestAPI.__get_string_io_from_file(source)
+        }
+        if inputs_file is not None:
+            manifest['workflowInputs'] = \
+                CromwellRestAPI.__get_string_io_from_file(inputs_file)
+        url = CromwellRestAPI.QUERY_URL.format(
+                ip=self._ip,
+                port=self._port) + CromwellRestAPI.ENDPOINT_DESCRIBE
+        try:
+            # not self._session to avoid retrying on a refused connection
+            resp = requests.post(
+                url, files=manifest, auth=self._auth,
+                headers={'accept': 'application/json'},
+                timeout=(CromwellRestAPI.SEC_CONNECT_TIMEOUT_DESCRIBE,
+                         CromwellRestAPI.SEC_READ_TIMEOUT_DESCRIBE))
+            if not resp.ok:
+                logger.debug(
+                    'describe: code={c}, contents={cont}, url={url}'.format(
+                        c=resp.status_code, cont=resp.content, url=url))
+                return None
+            r = resp.json()
+        except Exception as e:
+            logger.debug('describe: server is not available. e={e}'.format(e=e))
+            return None
+        logger.debug('describe: {r}'.format(r=r))
+        return r
+
     def abort(self, workflow_ids=None, labels=None):
         """Abort workflows matching workflow IDs or labels
 
         Returns:
             List of JSON responses from POST request
-            for aborting workflows
+            for aborting workflows. See __request_for_each_workflow()
+            for a failed request.
         """
         workflows = self.find(workflow_ids, labels)
         if workflows is None:
             return None
-        result = []
-        for w in workflows:
-            r = self.__request_post(
-                CromwellRestAPI.ENDPOINT_ABORT.format(
-                    wf_id=w['id']))
-            result.append(r)
+        result = self.__request_for_each_workflow(
+            lambda wf_id: self.__request_post(
+                CromwellRestAPI.ENDPOINT_ABORT.format(wf_id=wf_id),
+                exit_on_error=False),
+            workflows)
         logger.debug('abort: {r}'.format(r=result))
         return result
 
@@ -87,17 +172,17 @@ class CromwellRestAPI(object):
 
         Returns:
             List of JSON responses from POST request
-            for releasing hold of workflows
+            for releasing hold of workflows. See __request_for_each_workflow()
+            for a failed request.
         """
         workflows = self.find(workflow_ids, labels)
         if workflows is None:
             return None
-        result = []
-        for w in workflows:
-            r = self.__request_post(
-                CromwellRestAPI.ENDPOINT_RELEASE_HOLD.format(
-                    wf_id=w['id']))
-            result.append(r)
+        result = self.__request_for_each_workflow(
+            lambda wf_id: self.__request_post(
+                CromwellRestAPI.ENDPOINT_RELEASE_HOLD.format(wf_id=wf_id),
+                exit_on_error=False),
+            workflows)
         logger.debug('release_hold: {r}'.format(r=result))
         return result
 
@@ -119,21 +204,75 @@ class CromwellRestAPI(object):
         """
         return self.__request_get(CromwellRestAPI.ENDPOINT_BACKEND)
 
-    def get_metadata(self, workflow_ids=None, labels=None):
+    def get_metadata(self, workflow_ids=None, labels=None,
+                     include_keys=None, exclude_keys=None):
         """Retrieve metadata for workflows matching workflow IDs or labels
 
+        Args:
+            include_keys:
+                List of metadata keys to be included.
+                Cromwell server filters out all other keys.
+                e.g. ['status', 'executionStatus'] for a tiny metadata
+                with workflow's status and status of each call.
+            exclude_keys:
+                List of metadata keys to be excluded.
+
         Returns:
-            List of metadata JSONs
+            List of metadata JSONs. See __request_for_each_workflow()
+            for a failed request.
         """
         workflows = self.find(workflow_ids, labels)
         if workflows is None:
             return None
-        result = []
-        for w in workflows:
-            m = self.__request_get(
-                CromwellRestAPI.ENDPOINT_METADATA.format(wf_id=w['id']))
-            result.append(m)
-        return result
+        params = {}
+        if include_keys:
+            params['includeKey'] = include_keys
+        if exclude_keys:
+            params['excludeKey'] = exclude_keys
+        return self.__request_for_each_workflow(
+            lambda wf_id: self.__request_get(
+                CromwellRestAPI.ENDPOINT_METADATA.format(wf_id=wf_id),
+                params=params,
+                exit_on_error=False),
+            workflows)
+
+    def write_metadata(self, workflow_id, fp,
+                       include_keys=None, exclude_keys=None,
+                       chunk_size=DEFAULT_CHUNK_SIZE):
+        """Stream metadata JSON for a workflow into a binary file object
+        chunk by chunk. Response is never fully loaded on memory
+        so that memory usage is bounded by chunk_size
+        regardless of size of metadata.
+        Raises an exception on failure.
+
+        Args:
+            workflow_id:
+                Workflow ID string (not a wildcard).
+            fp:
+                Binary file object to write metadata JSON to.
+            include_keys, exclude_keys:
+                See get_metadata().
+            chunk_size:
+                Size of each chunk in bytes.
+        """
+        params = {}
+        if include_keys:
+            params['includeKey'] = include_keys
+        if exclude_keys:
+            params['excludeKey'] = exclude_keys
+        url = CromwellRestAPI.QUERY_URL.format(
+                ip=self._ip,
+                port=self._port) + \
+            CromwellRestAPI.ENDPOINT_METADATA.format(wf_id=workflow_id)
+        with self._session.get(
+                url, auth=self._auth, params=params, stream=True,
+                headers={'accept': 'application/json'}) as resp:
+            if not resp.ok:
+                raise Exception(
+                    'GET: code={c}, contents={cont}, url={url}'.format(
+                        c=resp.status_code, cont=resp.content, url=url))
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                fp.write(chunk)
 
     def get_labels(self, workflow_id):
         """Get labels JSON for a specified workflow
@@ -176,10 +315,42 @@ class CromwellRestAPI(object):
         logger.debug('update_labels: {r}'.format(r=r))
         return r
 
-    def find(self, workflow_ids=None, labels=None):
+    def find(self, workflow_ids=None, labels=None, status=None,
+             submission=None, start=None, end=None,
+             include_subworkflows=None):
         """Find workflows by matching workflow IDs, label (key, value) tuples.
         Wildcards (? and *) are allowed for string workflow IDs and values in
         a tuple label. Search criterion is (workflow_ids OR labels).
+        Other search criteria (status, submission, start, end and
+        include_subworkflows) are ANDed with it.
+
+        See iter_find() for details about args.
+
+        Returns:
+            List of matched workflow JSONs
+        """
+        result = list(self.iter_find(
+            workflow_ids=workflow_ids,
+            labels=labels,
+            status=status,
+            submission=submission,
+            start=start,
+            end=end,
+            include_subworkflows=include_subworkflows))
+        logger.debug('find: {r}'.format(r=result))
+        return result
+
+    def iter_find(self, workflow_ids=None, labels=None, status=None,
+                  submission=None, start=None, end=None,
+                  include_subworkflows=None, page_size=DEFAULT_PAGE_SIZE,
+                  matcher=None):
+        """Generator version of find().
+        Workflows are retrieved page by page from Cromwell server.
+
+        Search criteria are sent to Cromwell server as query parameters
+        so that only matched workflows are retrieved.
+        Client-side matching is done only when a wildcard is used
+        in workflow_ids or values in labels.
 
         Args:
             workflow_ids:
@@ -188,50 +359,95 @@ class CromwellRestAPI(object):
             labels:
                 List of (key, val) tuples: [(key: val), (key2: val2), ...].
                 OR search for multiple tuples
+            status:
+                List of workflow status strings (e.g. Running, Succeeded).
+                OR search for multiple statuses
+            submission:
+                Find workflows submitted at or after this date/time.
+                (e.g. 2019-06-13T10:07:00.000Z)
+            start:
+                Find workflows started at or after this date/time.
+            end:
+                Find workflows ended at or before this date/time.
+            include_subworkflows:
+                Include subworkflows or not.
+                If not defined, Cromwell defaults to include them.
+            page_size:
+                Number of workflows per page.
+            matcher:
+                Pre-built WorkflowMatcher object.
+                If defined, workflow_ids and labels are ignored.
+
+        Yields:
+            Matched workflow JSON
+        """
+        if matcher is None:
+            matcher = WorkflowMatcher(workflow_ids, labels)
+        if matcher.is_empty:
+            return
+        workflow_ids = matcher.workflow_ids
+        labels = matcher.labels
+
+        params = {}
+        if status:
+            params['status'] = status
+        if submission is not None:
+            params['submission'] = submission
+        if start is not None:
+            params['start'] = start
+        if end is not None:
+            params['end'] = end
+        if include_subworkflows is not None:
+            params['includeSubworkflows'] = \
+                'true' if include_subworkflows else 'false'
+
+        if matcher.matches_all:
+            yield from self.__query_workflows(params, page_size)
+            return
+        if matcher.has_wildcard:
+            # cannot search for a wildcard on Cromwell server
+            for workflows in self.__query_workflows(
+                    params, page_size, by_page=True):
+                yield from matcher.filter(workflows)
+            return
+
+        # exact search for IDs and labels on Cromwell server.
+        # Cromwell ANDs different query parameters (id AND labelor)
+        # so search separately for IDs and labels
+        # then take the union of them
+        queries = []
+        valid_ids = [
+            wf_id for wf_id in workflow_ids or []
+            if re.match(CromwellRestAPI.RE_PATTERN_WORKFLOW_ID, wf_id)]
+        for i in range(0, len(valid_ids), CromwellRestAPI.MAX_VALUES_PER_QUERY):
+            queries.append(
+                {'id': valid_ids[i:i + CromwellRestAPI.MAX_VALUES_PER_QUERY]})
+        labelor = [
+            '{k}:{v}'.format(k=k, v=v) for k, v in labels or []]
+        for i in range(0, len(labelor), CromwellRestAPI.MAX_VALUES_PER_QUERY):
+            queries.append(
+                {'labelor': labelor[i:i + CromwellRestAPI.MAX_VALUES_PER_QUERY]})
+
+        found = set()
+        for q in queries:
+            q.update(params)
+            for w in self.__query_workflows(q, page_size):
+                if w['id'] not in found:
+                    found.add(w['id'])
+                    yield w
 
-        Returns:
-            List of matched workflow JSONs
+    @staticmethod
+    def is_error_response(r):
+        """Check if a response in a list returned from
+        abort(), release_hold() or get_metadata() is an error
         """
-        r = self.__request_get(
-            CromwellRestAPI.ENDPOINT_WORKFLOWS,
-            params=CromwellRestAPI.PARAMS_WORKFLOWS)
-        if r is None:
-            return None
-        workflows = r['results']
-        if workflows is None:
-            return None
-        matched = set()
-        for w in workflows:
-            if 'id' not in w:
-                continue
-            if workflow_ids is not None:
-                for wf_id in workflow_ids:
-                    if fnmatch.fnmatchcase(w['id'], wf_id):
-                        matched.add(w['id'])
-                        break
-            if w['id'] in matched:
-                continue
-            if labels is not None and 'labels' in w:
-                labels_ = w['labels']
-                for k, v in labels:
-                    if k in labels_:
-                        v_ = labels_[k]
-                        if isinstance(v_, str) and isinstance(v, str):
-                            # wildcard allowed for str values
-                            if fnmatch.fnmatchcase(v_, v):
-                                matched.add(w['id'])
-                                break
-                        elif v_ == v:
-                            matched.add(w['id'])
-                            break
-        result = []
-        for w in workflows:
-            if 'id' not in w:
-                continue
-            if w['id'] in matched:
-                result.append(w)
-        logger.debug('find: {r}'.format(r=result))
-        return result
+        return isinstance(r, dict) and \
+            r.get('status') == CromwellRestAPI.STATUS_ERROR
+
+    def close(self):
+        """Close all pooled connections
+        """
+        self._session.close()
 
     def __init_auth(self):
         """Init auth object
@@ -241,9 +457,115 @@ class CromwellRestAPI(object):
         else:
             self._auth = None
 
-    def __request_get(self, endpoint, params=None):
+    def __init_session(self, pool_size, max_retries, backoff_factor):
+        """Init a session shared by all requests.
+        A session keeps connections to a Cromwell server alive
+        so that they are reused instead of opening a new TCP connection
+        for each request.
+        """
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=CromwellRestAPI.RETRY_STATUS_FORCELIST,
+            raise_on_status=False)
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def __query_workflows(self, params, page_size, by_page=False):
+        """Retrieve workflows from Cromwell server page by page.
+
+        Args:
+            by_page:
+                Yield a list of workflows for each page.
+
+        Yields:
+            Workflow JSON (with labels)
+        """
+        found = set()
+        num_retrieved = 0
+        page = 1
+        while True:
+            params_ = dict(CromwellRestAPI.PARAMS_WORKFLOWS)
+            params_.update(params)
+            params_['page'] = page
+            params_['pageSize'] = page_size
+            r = self.__request_get(
+                CromwellRestAPI.ENDPOINT_WORKFLOWS,
+                params=params_)
+            if r is None or not r.get('results'):
+                return
+            workflows = r['results']
+            page_workflows = []
+            for w in workflows:
+                # a workflow can be shifted to the next page
+                # if a new workflow is submitted while paging
+                if 'id' not in w or w['id'] in found:
+                    continue
+                found.add(w['id'])
+                page_workflows.append(w)
+            if by_page:
+                yield page_workflows
+            else:
+                yield from page_workflows
+            num_retrieved += len(workflows)
+            total = r.get('totalResultsCount')
+            if len(workflows) < page_size or \
+                    total is not None and num_retrieved >= total:
+                return
+            page += 1
+
+    def __request_for_each_workflow(self, request_fnc, workflows):
+        """Make a request for each workflow.
+        Requests are made concurrently with a thread pool of
+        self._max_workers threads.
+
+        Args:
+            request_fnc:
+                Function that takes a workflow ID and returns a JSON response.
+            workflows:
+                List of workflow JSONs (from find()).
+
+        Returns:
+            List of JSON responses in the same order as workflows.
+            A failed request does not stop others. It is replaced with
+            {"id": WORKFLOW_ID, "status": "error", "message": ERROR_MESSAGE}.
+        """
+        def request(w):
+            wf_id = w['id']
+            try:
+                r = request_fnc(wf_id)
+                if r is not None:
+                    return r
+                msg = 'Request failed. See the error log.'
+            except Exception as e:
+                logger.error(
+                    'Request failed for a workflow: wf_id={wf_id}, '
+                    'e={e}'.format(wf_id=wf_id, e=e))
+                msg = str(e)
+            return {
+                'id': wf_id,
+                'status': CromwellRestAPI.STATUS_ERROR,
+                'message': msg}
+
+        num_workers = min(self._max_workers, len(workflows))
+        if num_workers <= 1:
+            return [request(w) for w in workflows]
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            return list(executor.map(request, workflows))
+
+    def __request_get(self, endpoint, params=None, exit_on_error=True):
         """GET request
 
+        Args:
+            exit_on_error:
+                Exit if it fails to connect to a server.
+                Otherwise, raise an exception.
+
         Returns:
             JSON response
         """
@@ -251,10 +573,12 @@ class CromwellRestAPI(object):
                 ip=self._ip,
                 port=self._port) + endpoint
         try:
-            resp = requests.get(
+            resp = self._session.get(
                 url, auth=self._auth, params=params,
                 headers={'accept': 'application/json'})
         except Exception as e:
+            if not exit_on_error:
+                raise
             logger.exception('Help: cannot connect to server. '\
                   'Check if server is dead or still spinning up.')
             sys.exit(1)
@@ -267,9 +591,14 @@ class CromwellRestAPI(object):
                     c=resp.status_code, cont=resp.content, url=url))
             return None
 
-    def __request_post(self, endpoint, manifest=None):
+    def __request_post(self, endpoint, manifest=None, exit_on_error=True):
         """POST request
 
+        Args:
+            exit_on_error:
+                Exit if it fails to connect to a server.
+                Otherwise, raise an exception.
+
         Returns:
             JSON response
         """
@@ -277,10 +606,12 @@ class CromwellRestAPI(object):
                 ip=self._ip,
                 port=self._port) + endpoint
         try:
-            resp = requests.post(
+            resp = self._session.post(
                 url, files=manifest, auth=self._auth,
                 headers={'accept': 'application/json'})
         except Exception as e:
+            if not exit_on_error:
+                raise
             logger.error(e)
             sys.exit(1)
 
@@ -302,7 +633,7 @@ class CromwellRestAPI(object):
                 ip=self._ip,
                 port=self._port) + endpoint
         try:
-            resp = requests.patch(
+            resp = self._session.patch(
                 url, data=data, auth=self._auth,
                 headers={'accept': 'application/json',
                          'content-type': 'application/json'})
@@ -315,7 +646,7 @@ class CromwellRestAPI(object):
         else:
             logger.error(
                 'PATCH: code={c}, contents={cont}, url={url}, json={j}'.format(
-                    c=resp.status_code, cont=resp.content, url=url, j=json))
+                    c=resp.status_code, cont=resp.content, url=url, j=data))
             return None
 
     @staticmethod
@@ -0,0 +1,223 @@
+"""LocalSlotAllocator: lock-file based admission of local jobs by cpu/memory
+"""
+
+import fcntl
+import json
+import logging
+import os
+import socket
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+class LocalSlotAllocator(object):
+    """Packs local jobs by their declared number of cpus and memory against
+    a machine's capacity.
+
+    A job (a shell running Cromwell's submit command on Local backend)
+    calls "caper local-slot acquire" before running a task.
+    It blocks until the job fits in the remaining capacity.
+    Then the job's PID is registered as running. A slot is released
+    when the job's process is gone so that a killed/crashed job
+    never leaks a slot. A process is identified with its PID and start time
+    to prevent a reused PID from holding a slot.
+
+    Allocations are stored in a JSON state file per host, which is
+    read/written while holding an exclusive lock (flock) on a lock file.
+
+    A job larger than the capacity is admitted only when no other job is
+    running. Younger small jobs can be admitted ahead of an older waiting
+    job which doesn't fit (backfilling) until the older one waits for
+    SEC_MAX_BACKFILL. After that, younger jobs wait for it.
+    """
+    DEFAULT_LOCAL_SLOT_DIR = '~/.caper/local_slot'
+    DEFAULT_CPU = 1
+    DEFAULT_MEMORY_MB = 0
+    SEC_MIN_POLL_INTERVAL = 0.5
+    SEC_MAX_POLL_INTERVAL = 5.0
+    SEC_MAX_BACKFILL = 300.0
+
+    def __init__(self, local_slot_dir=DEFAULT_LOCAL_SLOT_DIR,
+                 max_cpu=None, max_memory_mb=None):
+        """
+        Args:
+            local_slot_dir:
+                Directory for a state file and a lock file.
+            max_cpu:
+                Number of cpus of a machine.
+                Number of cpus available for this process if not defined.
+            max_memory_mb:
+                Memory of a machine in MB.
+                Total physical memory if not defined.
+        """
+        local_slot_dir = os.path.expanduser(local_slot_dir)
+        host = socket.gethostname()
+        self._state_file = os.path.join(
+            local_slot_dir, '{host}.json'.format(host=host))
+        self._lock_file = os.path.join(
+            local_slot_dir, '{host}.lock'.format(host=host))
+        self._max_cpu = max_cpu if max_cpu else \
+            LocalSlotAllocator.get_num_cpus()
+        self._max_memory_mb = max_memory_mb if max_memory_mb else \
+            LocalSlotAllocator.get_memory_mb()
+
+    @property
+    def state_file(self):
+        return self._state_file
+
+    def acquire(self, cpu=None, memory_mb=None, pid=None):
+        """Block until a job fits in the remaining capacity and
+        register it as running.
+
+        Args:
+            cpu, memory_mb:
+                Resources declared for a job.
+            pid:
+                PID of a job's process. Parent process of this process
+                if not defined (e.g. shell running "caper local-slot").
+        Returns:
+            Utilization (see utilization()) right after acquisition.
+        """
+        if cpu is None:
+            cpu = LocalSlotAllocator.DEFAULT_CPU
+        if memory_mb is None:
+            memory_mb = LocalSlotAllocator.DEFAULT_MEMORY_MB
+        if pid is None:
+            pid = os.getppid()
+        key = str(pid)
+        entry = {
+            'cpu': cpu,
+            'memory_mb': memory_mb,
+            'start_time': LocalSlotAllocator.__get_proc_start_time(pid),
+            'time': time.time(),
+        }
+        interval = LocalSlotAllocator.SEC_MIN_POLL_INTERVAL
+        while True:
+            with self.__locked_state() as state:
+                waiting = state['waiting']
+                if key in waiting:
+                    entry['time'] = waiting[key]['time']
+                if self.__can_admit(state, key, entry):
+                    waiting.pop(key, None)
+                    state['running'][key] = entry
+                    return self.__get_utilization(state)
+                waiting[key] = entry
+            time.sleep(interval)
+            interval = min(interval * 2, LocalSlotAllocator.SEC_MAX_POLL_INTERVAL)
+
+    def release(self, pid=None):
+        """Release a slot explicitly.
+        Not required if a job's process is gone.
+        """
+        if pid is None:
+            pid = os.getppid()
+        with self.__locked_state() as state:
+            state['running'].pop(str(pid), None)
+            state['waiting'].pop(str(pid), None)
+
+    def utilization(self):
+        """
+        Returns:
+            dict of number of running/waiting jobs and
+            used/max cpus and memory.
+        """
+        with self.__locked_state() as state:
+            return self.__get_utilization(state)
+
+    def __can_admit(self, state, key, entry):
+        running = state['running'].values()
+        if not running:
+            return True
+        used_cpu = sum(e['cpu'] for e in running)
+        used_memory_mb = sum(e['memory_mb'] for e in running)
+        if used_cpu + entry['cpu'] > self._max_cpu or \
+                used_memory_mb + entry['memory_mb'] > self._max_memory_mb:
+            return False
+        # don't backfill ahead of a job waiting too long
+        now = time.time()
+        for k, e in state['waiting'].items():
+            if k != key and e['time'] < entry['time'] and \
+                    now - e['time'] > LocalSlotAllocator.SEC_MAX_BACKFILL:
+                return False
+        return True
+
+    def __get_utilization(self, state):
+        running = state['running'].values()
+        return {
+            'num_running': len(state['running']),
+            'num_waiting': len(state['waiting']),
+            'cpu': sum(e['cpu'] for e in running),
+            'max_cpu': self._max_cpu,
+            'memory_mb': sum(e['memory_mb'] for e in running),
+            'max_memory_mb': self._max_memory_mb,
+        }
+
+    @contextmanager
+    def __locked_state(self):
+        """Lock and load a state file. Dead jobs are removed from it.
+        It's written back on exit.
+        """
+        os.makedirs(os.path.dirname(self._lock_file), exist_ok=True)
+        with open(self._lock_file, 'a') as fp_lock:
+            fcntl.flock(fp_lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self._state_file, 'r') as fp:
+                        state = json.loads(fp.read())
+                except (OSError, ValueError):
+                    state = {}
+                state.setdefault('running', {})
+                state.setdefault('waiting', {})
+                for d in (state['running'], state['waiting']):
+                    for k in [k for k, e in d.items()
+                              if not LocalSlotAllocator.__is_alive(k, e)]:
+                        del d[k]
+                yield state
+                tmp_file = '{f}.{pid}.tmp'.format(
+                    f=self._state_file, pid=os.getpid())
+                with open(tmp_file, 'w') as fp:
+                    fp.write(json.dumps(state))
+                os.replace(tmp_file, self._state_file)
+            finally:
+                fcntl.flock(fp_lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def __is_alive(key, entry):
+        pid = int(key)
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # owned by another user
+            pass
+        start_time = LocalSlotAllocator.__get_proc_start_time(pid)
+        return start_time is None or entry['start_time'] is None or \
+            start_time == entry['start_time']
+
+    @staticmethod
+    def __get_proc_start_time(pid):
+        """Start time of a process in clock ticks after boot (Linux only).
+        None if not available.
+        """
+        try:
+            with open('/proc/{pid}/stat'.format(pid=pid), 'r') as fp:
+                stat = fp.read()
+        except OSError:
+            return None
+        # 2nd field (comm) can have spaces. 22nd field is start time
+        return int(stat[stat.rindex(')') + 2:].split()[19])
+
+    @staticmethod
+    def get_num_cpus():
+        if hasattr(os, 'sched_getaffinity'):
+            return len(os.sched_getaffinity(0))
+        return os.cpu_count()
+
+    @staticmethod
+    def get_memory_mb():
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') \
+            // (1024 * 1024)
@@ -0,0 +1,267 @@
+"""MetadataIndex: compact per-call index of Cromwell's metadata JSON
+"""
+
+import gzip
+import json
+import logging
+from collections import Counter, namedtuple, OrderedDict
+from decimal import Decimal
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+logger = logging.getLogger(__name__)
+
+
+CallEntry = namedtuple('CallEntry', [
+    'workflow_id', 'task', 'shard_index', 'attempt', 'status', 'rc',
+    'job_id', 'stdout', 'stderr', 'run_start', 'run_end'])
+
+
+class MetadataIndex(object):
+    """Index of calls in a (possibly huge) metadata JSON.
+
+    Metadata JSON is parsed as a stream of JSON events so that only
+    small values for indexed items are materialized. Large values
+    (e.g. inputs/outputs of calls) are skipped without being built.
+    Calls in subworkflows are flattened into a single list.
+
+    Incremental parsing uses ijson (a dependency of Caper).
+    If it's not available then a whole JSON is loaded in memory first.
+    """
+    CALL_KEYS = {
+        'shardIndex': 'shard_index',
+        'attempt': 'attempt',
+        'executionStatus': 'status',
+        'returnCode': 'rc',
+        'jobId': 'job_id',
+        'stdout': 'stdout',
+        'stderr': 'stderr',
+    }
+    COMPLETED_STATUSES = ('Done', 'Succeeded')
+
+    def __init__(self):
+        self.workflow_id = None
+        self.status = None
+        self.name = None
+        # list of CallEntry
+        self.calls = []
+        # list of [position in self.calls, workflow ID, failures]
+        # position is where a (sub)workflow's calls start
+        self.failures = []
+
+    @classmethod
+    def from_file(cls, metadata_file):
+        """Build an index from a local metadata JSON file (.json or .json.gz).
+        """
+        index = cls()
+        open_ = gzip.open if metadata_file.endswith('.gz') else open
+        with open_(metadata_file, 'rb') as fp:
+            if ijson is None:
+                events = MetadataIndex.__iter_events(json.loads(fp.read()))
+            else:
+                events = ijson.basic_parse(fp)
+            index.__build(events)
+        return index
+
+    @classmethod
+    def from_dict(cls, metadata):
+        """Build an index from a metadata dict (e.g. from Cromwell server).
+        """
+        index = cls()
+        index.__build(MetadataIndex.__iter_events(metadata))
+        return index
+
+    def filter_calls(self, statuses=None, show_completed_task=True):
+        """
+        Args:
+            statuses:
+                List of call statuses (executionStatus) to be included.
+            show_completed_task:
+                Include completed calls (Done/Succeeded).
+        Returns:
+            List of CallEntry.
+        """
+        result = []
+        for c in self.calls:
+            if statuses is not None and c.status not in statuses:
+                continue
+            if not show_completed_task and \
+                    c.status in MetadataIndex.COMPLETED_STATUSES:
+                continue
+            result.append(c)
+        return result
+
+    def summary(self):
+        """Number of calls for each status.
+
+        Returns:
+            dict of {task: Counter of {status: count}} with a key '*'
+            for all tasks.
+        """
+        result = OrderedDict()
+        result['*'] = Counter()
+        for c in self.calls:
+            if c.task not in result:
+                result[c.task] = Counter()
+            result[c.task][c.status] += 1
+            result['*'][c.status] += 1
+        return result
+
+    def __build(self, events):
+        events = iter(events)
+        ev, val = next(events)
+        if ev == 'start_array':
+            # metadata can be wrapped in a list
+            ev, val = next(events)
+        if ev != 'start_map':
+            raise ValueError('Invalid metadata JSON.')
+        wf = self.__parse_workflow(events)
+        self.failures = [f for f in self.failures if f[2] is not None]
+        self.workflow_id = wf.get('id')
+        self.status = wf.get('status')
+        self.name = wf.get('workflowName')
+
+    def __parse_workflow(self, events):
+        """Parse a (sub)workflow map. start_map is already consumed.
+
+        Returns:
+            dict of scalar values (id, status, workflowName).
+        """
+        wf = {}
+        pos = len(self.calls)
+        # reserve a slot to keep failures in order of (sub)workflows
+        failures = [pos, None, None]
+        self.failures.append(failures)
+        for key in MetadataIndex.__iter_keys(events):
+            ev, val = next(events)
+            if key in ('id', 'status', 'workflowName'):
+                wf[key] = MetadataIndex.__build_value(events, ev, val)
+            elif key == 'failures':
+                failures[2] = MetadataIndex.__build_value(events, ev, val)
+            elif key == 'calls' and ev == 'start_map':
+                self.__parse_calls(events)
+            else:
+                MetadataIndex.__skip_value(events, ev)
+
+        # workflow ID can come after calls
+        if 'id' in wf:
+            for i in range(pos, len(self.calls)):
+                if self.calls[i].workflow_id is None:
+                    self.calls[i] = self.calls[i]._replace(
+                        workflow_id=wf['id'])
+        failures[1] = wf.get('id')
+        return wf
+
+    def __parse_calls(self, events):
+        for task in MetadataIndex.__iter_keys(events):
+            ev, val = next(events)
+            if ev != 'start_array':
+                MetadataIndex.__skip_value(events, ev)
+                continue
+            while True:
+                ev, val = next(events)
+                if ev == 'end_array':
+                    break
+                if ev != 'start_map':
+                    MetadataIndex.__skip_value(events, ev)
+                    continue
+                self.__parse_call(events, task)
+
+    def __parse_call(self, events, task):
+        call = dict.fromkeys(CallEntry._fields)
+        call['task'] = task
+        is_subworkflow = False
+        for key in MetadataIndex.__iter_keys(events):
+            ev, val = next(events)
+            if key in MetadataIndex.CALL_KEYS:
+                call[MetadataIndex.CALL_KEYS[key]] = \
+                    MetadataIndex.__build_value(events, ev, val)
+            elif key == 'executionEvents' and ev == 'start_array':
+                for ev_ in MetadataIndex.__iter_array(events):
+                    if call['run_start'] is None and \
+                            isinstance(ev_, dict) and \
+                            ev_.get('description', '').startswith('Running'):
+                        call['run_start'] = ev_.get('startTime')
+                        call['run_end'] = ev_.get('endTime')
+            elif key == 'subWorkflowMetadata' and ev == 'start_map':
+                is_subworkflow = True
+                self.__parse_workflow(events)
+            else:
+                MetadataIndex.__skip_value(events, ev)
+        if not is_subworkflow:
+            self.calls.append(CallEntry(**call))
+
+    @staticmethod
+    def __iter_keys(events):
+        """Iterate over keys of a map. start_map is already consumed.
+        Value of each key must be consumed by a caller.
+        """
+        while True:
+            ev, val = next(events)
+            if ev == 'end_map':
+                return
+            yield val
+
+    @staticmethod
+    def __iter_array(events):
+        """Iterate over materialized items of an array.
+        start_array is already consumed.
+        """
+        while True:
+            ev, val = next(events)
+            if ev == 'end_array':
+                return
+            yield MetadataIndex.__build_value(events, ev, val)
+
+    @staticmethod
+    def __build_value(events, ev, val):
+        """Materialize a value starting with an event.
+        """
+        if ev == 'start_map':
+            d = {}
+            for key in MetadataIndex.__iter_keys(events):
+                ev_, val_ = next(events)
+                d[key] = MetadataIndex.__build_value(events, ev_, val_)
+            return d
+        elif ev == 'start_array':
+            return list(MetadataIndex.__iter_array(events))
+        elif isinstance(val, Decimal):
+            # ijson parses a non-integer number as Decimal
+            return float(val)
+        return val
+
+    @staticmethod
+    def __skip_value(events, ev):
+        """Skip a value starting with an event without materializing it.
+        """
+        if ev not in ('start_map', 'start_array'):
+            return
+        depth = 1
+        while depth:
+            ev, _ = next(events)
+            if ev in ('start_map', 'start_array'):
+                depth += 1
+            elif ev in ('end_map', 'end_array'):
+                depth -= 1
+
+    @staticmethod
+    def __iter_events(obj):
+        """Generate ijson-like basic events from a Python object.
+        """
+        if isinstance(obj, dict):
+            yield 'start_map', None
+            for k, v in obj.items():
+                yield 'map_key', k
+                yield from MetadataIndex.__iter_events(v)
+            yield 'end_map', None
+        elif isinstance(obj, list):
+            yield 'start_array', None
+            for v in obj:
+                yield from MetadataIndex.__iter_events(v)
+            yield 'end_array', None
+        else:
+            yield 'scalar', obj
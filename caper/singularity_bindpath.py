@@ -0,0 +1,197 @@
+"""Find directories to be bound for singularity (SINGULARITY_BINDPATH)
+"""
+
+import os
+from autouri import URIBase
+from autouri.loc_aux import recurse_json
+from functools import lru_cache
+
+
+@lru_cache(maxsize=65536)
+def realpath(path):
+    """Cached os.path.realpath.
+    Resolved from a cached realpath of its parent so that
+    only one lstat() is required for each new path.
+    """
+    parent, basename = os.path.split(path)
+    if not basename or basename in (os.curdir, os.pardir) or \
+            os.path.islink(path):
+        return os.path.realpath(path)
+    return os.path.join(realpath(parent), basename)
+
+
+def find_dirnames(input_json_file):
+    """Find dirnames of all files in input JSON file.
+    This function will recursively visit all values in input JSON and
+    also JSON, TSV, CSV files in the input JSON itself.
+    Files with some extensions (defined by Autouri's
+    URIBase.LOC_RECURSE_EXT_AND_FNC) are recursively visited.
+
+    Returns:
+        Set of dirnames. File can be a soft-link and singularity will want
+        to have access to both soft-link and real one so that
+        dirnames of both soft-link and realpath are included.
+    """
+    with open(input_json_file, 'r') as fp:
+        input_json_contents = fp.read()
+
+    dirnames = set()
+    visited = set()
+
+    def find_dirname(s):
+        path = os.path.expanduser(s)
+        if not os.path.isabs(path) or path in visited:
+            return None, False
+        visited.add(path)
+        ext = os.path.splitext(path)[1]
+        fnc_recurse = URIBase.LOC_RECURSE_EXT_AND_FNC.get(ext)
+        if fnc_recurse is not None:
+            with open(path, 'r') as fp:
+                fnc_recurse(fp.read(), find_dirname)
+
+        dirname = os.path.dirname(path)
+        dirnames.add(dirname)
+        if os.path.islink(path):
+            dirnames.add(os.path.dirname(realpath(path)))
+        else:
+            dirnames.add(realpath(dirname))
+        return None, False
+
+    recurse_json(input_json_contents, find_dirname)
+    return dirnames
+
+
+def add_parents(dirnames, common_root_search_level):
+    """Add all (but not too high level) parent directories.
+    e.g. /a/b/c/d/e/f/g/h with common_root_search_level = 5
+    add all the followings:
+        /a/b/c/d/e/f/g/h (org)
+        /a/b/c/d/e/f/g
+        /a/b/c/d/e/f
+        /a/b/c/d/e
+        /a/b/c/d (minimum level = common_root_search_level-1)
+    """
+    result = set(dirnames)
+    for d in dirnames:
+        dir_arr = d.split(os.sep)
+        for i in range(len(dir_arr) - 1, common_root_search_level - 1, -1):
+            parent = os.sep.join(dir_arr[:i])
+            if parent in result:
+                # all its parents are already added
+                break
+            result.add(parent)
+    return result
+
+
+def find_minimal_cover(dirnames):
+    """Remove directories which are under another directory in dirnames.
+    Directories are compared component-wise (/a/bc is not under /a/b).
+
+    All directories under a directory d (with a trailing os.sep) are
+    contiguous right after it in a sorted list so that a single linear scan
+    after sorting is enough: O(n log n).
+
+    Returns:
+        Sorted list of directories.
+    """
+    result = []
+    last_root = None
+    for d in sorted(d.rstrip(os.sep) + os.sep for d in dirnames):
+        if last_root is not None and d.startswith(last_root):
+            continue
+        last_root = d
+        result.append(d.rstrip(os.sep) or os.sep)
+    return result
+
+
+def find_bindpath(input_json_file, common_root_search_level):
+    """Find paths to be bound for singularity
+    by finding common roots for all files in input JSON file.
+
+    Args:
+        input_json_file:
+            localized input JSON file so that all files in it are already
+            recursively localized
+        common_root_search_level:
+            Do not go up higher than this level to find common roots.
+    Returns:
+        Comma-separated string of directories.
+    """
+    dirnames = add_parents(
+        find_dirnames(input_json_file), common_root_search_level)
+    return ','.join(find_minimal_cover(dirnames))
+
+
+def main():
+    """Benchmark with 100k synthetic file paths.
+    Original nested-loop algorithm is too slow for 100k paths
+    so that it's compared on a smaller subset only.
+
+    Usage:
+        python -m caper.singularity_bindpath
+    """
+    import json
+    import random
+    import time
+    from tempfile import TemporaryDirectory
+
+    def naive(dirnames):
+        bindpaths = set()
+        for i, d1 in enumerate(sorted(dirnames, reverse=True)):
+            overlap_found = False
+            for j, d2 in enumerate(sorted(dirnames, reverse=True)):
+                if i >= j:
+                    continue
+                if d1.startswith(d2):
+                    overlap_found = True
+                    break
+            if not overlap_found:
+                bindpaths.add(d1)
+        return bindpaths
+
+    num_files = 100000
+    num_files_naive = 1000
+    common_root_search_level = 5
+    random.seed(0)
+
+    with TemporaryDirectory() as tmp_d:
+        files = [
+            os.path.join(
+                tmp_d, 'proj{}'.format(random.randint(0, 9)),
+                'sample{}'.format(random.randint(0, 999)),
+                'cell{}'.format(i), 'R{}.fastq.gz'.format(i % 2 + 1))
+            for i in range(num_files)]
+        input_json_file = os.path.join(tmp_d, 'inputs.json')
+        with open(input_json_file, 'w') as fp:
+            fp.write(json.dumps({'fastqs': files}))
+
+        t0 = time.perf_counter()
+        bindpath = find_bindpath(input_json_file, common_root_search_level)
+        t1 = time.perf_counter()
+        print('files={n}, bindpath={b}'.format(n=num_files, b=bindpath))
+        print('find_bindpath: {:.3f} sec'.format(t1 - t0))
+
+        dirnames = add_parents(
+            {os.path.dirname(f) for f in files[:num_files_naive]},
+            common_root_search_level)
+        t0 = time.perf_counter()
+        r_naive = naive(dirnames)
+        t1 = time.perf_counter()
+        r_cover = find_minimal_cover(dirnames)
+        t2 = time.perf_counter()
+
+        # naive one compares strings instead of path components
+        # so that it misses /a/b10 if /a/b1 exists
+        roots = set(r_cover)
+        for d in dirnames:
+            assert any(
+                d == r or d.startswith(r + os.sep) for r in roots), d
+        print('dirs={n} (from {m} files), naive={n1}, cover={n2}'.format(
+            n=len(dirnames), m=num_files_naive, n1=len(r_naive),
+            n2=len(r_cover)))
+        print('naive nested loop: {:.3f} sec'.format(t1 - t0))
+        print('find_minimal_cover: {:.3f} sec'.format(t2 - t1))
+
+
+if __name__ == '__main__':
+    main()
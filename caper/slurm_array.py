@@ -0,0 +1,489 @@
+"""SlurmArrayBroker: coalesce SLURM submissions into array jobs
+"""
+
+import json
+import logging
+import os
+import re
+import shlex
+import socket
+import time
+import uuid
+from collections import OrderedDict
+from subprocess import Popen, PIPE, TimeoutExpired
+from threading import Event, Thread
+
+
+logger = logging.getLogger(__name__)
+
+
+class SlurmArrayBroker(object):
+    """Broker for SLURM submissions (one per Caper server or Caper run).
+
+    Cromwell's submit for each task runs "caper sbatch", a drop-in
+    replacement for sbatch. It writes a request to a spool directory and
+    waits for a response. A broker's daemon thread collects requests every
+    sec_window and coalesces tasks with identical sbatch options except for
+    per-task ones (job name, working directory, STDOUT/STDERR files and
+    a wrapped command) into one "sbatch --array" submission.
+    Each task gets "Submitted batch job ARRAY_JOB_ID_INDEX" so that
+    Cromwell's job-id-regex, kill (scancel) and check-alive (squeue) work
+    on an array task as a job.
+
+    A task which cannot be coalesced (a single task in a window or
+    a task without --wrap) is submitted with sbatch as it is.
+    "caper sbatch" runs sbatch by itself if there is no live broker.
+
+    Array jobs are submitted from a broker's process so that
+    its environment variables are exported to tasks (--export=ALL)
+    instead of those of Cromwell's submit.
+
+    A spool directory is per host (where Cromwell runs).
+    A request is claimed by atomically renaming it (with a broker's PID)
+    so that it's submitted only once even if multiple brokers share
+    a spool dir. A client waits for a response once its request is claimed.
+    Requests claimed by a dead broker are requeued when a broker starts.
+    Every claimed request gets a response (rc=1 if a broker fails to
+    process it). A client gives up (rc=1) if there is no response
+    within a timeout (see CLIENT_TIMEOUT_IN_WINDOWS).
+
+    A broker's heartbeat is written from its own thread so that
+    it's kept fresh while a broker is blocked on a long sbatch.
+
+    Tasks in an array job write STDOUT/STDERR to their own files.
+    Array job's STDOUT/STDERR (e.g. SLURM's messages about a task killed
+    for exceeding time/memory limit) are written to
+    ARRAY_JOB_ID_INDEX.out/.err in "arrays" of a spool dir.
+    """
+    DEFAULT_SLURM_ARRAY_DIR = '~/.caper/slurm_array'
+    SEC_DEFAULT_WINDOW = 5.0
+    DEFAULT_MAX_ARRAY_SIZE = 1000
+    # broker is dead if its heartbeat is older than this number of windows
+    MAX_HEARTBEAT_AGE_IN_WINDOWS = 6
+    SEC_MIN_HEARTBEAT_AGE = 60.0
+    SEC_CLIENT_POLL_INTERVAL = 0.5
+    SEC_SBATCH_TIMEOUT = 120.0
+    # client gives up waiting for a response after
+    # SEC_SBATCH_TIMEOUT + this number of broker's windows
+    CLIENT_TIMEOUT_IN_WINDOWS = 6
+
+    RE_PATTERN_SUBMITTED_JOB_ID = r'Submitted batch job (\d+)'
+    # sbatch options for each task. tasks in an array job should have
+    # the same options except for these.
+    SBATCH_TASK_OPTIONS = ('-J', '-D', '-o', '-e', '--wrap')
+
+    DIR_REQUESTS = 'requests'
+    DIR_CLAIMED = 'claimed'
+    DIR_RESPONSES = 'responses'
+    DIR_ARRAYS = 'arrays'
+    HEARTBEAT_FILE = 'broker.json'
+
+    def __init__(self, slurm_array_dir=DEFAULT_SLURM_ARRAY_DIR,
+                 sec_window=SEC_DEFAULT_WINDOW,
+                 max_array_size=DEFAULT_MAX_ARRAY_SIZE):
+        """
+        Args:
+            slurm_array_dir:
+                Directory for spool directories.
+            sec_window:
+                Tasks arriving within this window in seconds are coalesced.
+            max_array_size:
+                Maximum number of tasks in an array job.
+                Should be smaller than SLURM's MaxArraySize.
+        """
+        self._spool_dir = SlurmArrayBroker.get_spool_dir(slurm_array_dir)
+        self._sec_window = sec_window
+        self._max_array_size = max_array_size
+        self._stop_event = Event()
+        self._thread = None
+        self._heartbeat_thread = None
+
+    @property
+    def spool_dir(self):
+        return self._spool_dir
+
+    def start(self):
+        """Start a daemon thread for coalescing submissions.
+        """
+        if self._thread is not None:
+            return
+        for d in (SlurmArrayBroker.DIR_REQUESTS, SlurmArrayBroker.DIR_CLAIMED,
+                  SlurmArrayBroker.DIR_RESPONSES, SlurmArrayBroker.DIR_ARRAYS):
+            os.makedirs(os.path.join(self._spool_dir, d), exist_ok=True)
+        self.__requeue_orphaned_requests()
+        self._stop_event.clear()
+        self.__write_heartbeat()
+        self._heartbeat_thread = Thread(
+            target=self.__write_heartbeat_periodically, daemon=True)
+        self._heartbeat_thread.start()
+        self._thread = Thread(target=self.__process_periodically, daemon=True)
+        self._thread.start()
+        logger.info(
+            'SLURM array broker: {d}, window={w}s'.format(
+                d=self._spool_dir, w=self._sec_window))
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self._heartbeat_thread.join()
+        self._heartbeat_thread = None
+        try:
+            os.remove(os.path.join(
+                self._spool_dir, SlurmArrayBroker.HEARTBEAT_FILE))
+        except OSError:
+            pass
+
+    def process(self):
+        """Claim all requests in a spool directory and submit them.
+
+        Returns:
+            Number of processed requests.
+        """
+        requests_dir = os.path.join(
+            self._spool_dir, SlurmArrayBroker.DIR_REQUESTS)
+        claimed_dir = os.path.join(
+            self._spool_dir, SlurmArrayBroker.DIR_CLAIMED)
+        groups = OrderedDict()
+        num_requests = 0
+        for f in sorted(os.listdir(requests_dir)):
+            if not f.endswith('.json'):
+                continue
+            claimed_file = os.path.join(
+                claimed_dir, '{pid}.{f}'.format(pid=os.getpid(), f=f))
+            try:
+                os.rename(os.path.join(requests_dir, f), claimed_file)
+            except OSError:
+                # claimed by another broker or cancelled by a client
+                continue
+            num_requests += 1
+            request = {'id': f[:-len('.json')], 'claimed_file': claimed_file}
+            try:
+                with open(claimed_file, 'r') as fp:
+                    request.update(json.loads(fp.read()))
+                split = SlurmArrayBroker.split_sbatch_args(
+                    request['sbatch_args'])
+            except Exception as e:
+                self.__respond_error(
+                    [request],
+                    'Failed to read a SLURM submission request. {e}'.format(
+                        e=str(e)))
+                continue
+            # tasks which cannot be coalesced are grouped by themselves
+            key = request['id'] if split is None else tuple(split[0])
+            groups.setdefault(key, []).append(request)
+
+        for group in groups.values():
+            for i in range(0, len(group), self._max_array_size):
+                requests = group[i:i + self._max_array_size]
+                try:
+                    self.__submit(requests)
+                except Exception as e:
+                    self.__respond_error(
+                        requests,
+                        'Failed to submit SLURM jobs via a broker. '
+                        '{e}'.format(e=str(e)))
+        return num_requests
+
+    def __process_periodically(self):
+        while not self._stop_event.is_set():
+            try:
+                self.process()
+            except Exception as e:
+                logger.warning(
+                    'Exception caught while processing SLURM submissions. '
+                    '{e}'.format(e=str(e)))
+            self._stop_event.wait(self._sec_window)
+
+    def __write_heartbeat_periodically(self):
+        while not self._stop_event.wait(self._sec_window):
+            try:
+                self.__write_heartbeat()
+            except Exception as e:
+                logger.warning(
+                    'Failed to write SLURM array broker\'s heartbeat. '
+                    '{e}'.format(e=str(e)))
+
+    def __requeue_orphaned_requests(self):
+        """Move requests claimed by a dead broker on this host back
+        to requests so that their clients get a response.
+        A job can be submitted twice if a broker died while
+        running sbatch for it.
+        """
+        claimed_dir = os.path.join(
+            self._spool_dir, SlurmArrayBroker.DIR_CLAIMED)
+        for f in os.listdir(claimed_dir):
+            pid, _, request_file = f.partition('.')
+            if not request_file.endswith('.json') or \
+                    SlurmArrayBroker.__is_pid_alive(pid):
+                continue
+            try:
+                os.rename(
+                    os.path.join(claimed_dir, f),
+                    os.path.join(
+                        self._spool_dir, SlurmArrayBroker.DIR_REQUESTS,
+                        request_file))
+            except OSError:
+                continue
+            logger.warning(
+                'Requeued a SLURM submission claimed by a dead broker '
+                '(PID {pid}): {f}'.format(pid=pid, f=request_file))
+
+    def __write_heartbeat(self):
+        heartbeat_file = os.path.join(
+            self._spool_dir, SlurmArrayBroker.HEARTBEAT_FILE)
+        tmp_file = '{f}.{pid}.tmp'.format(f=heartbeat_file, pid=os.getpid())
+        with open(tmp_file, 'w') as fp:
+            fp.write(json.dumps({
+                'time': time.time(),
+                'pid': os.getpid(),
+                'sec_window': self._sec_window}))
+        os.replace(tmp_file, heartbeat_file)
+
+    def __submit(self, requests):
+        """Submit requests as an array job (or a job for a single request)
+        and write a response for each request.
+        """
+        if len(requests) == 1:
+            request = requests[0]
+            rc, stdout, stderr = SlurmArrayBroker.run_sbatch(
+                request['sbatch_args'], cwd=request['cwd'])
+            self.__respond(request, rc, stdout, stderr)
+            return
+
+        common_args, first_task = SlurmArrayBroker.split_sbatch_args(
+            requests[0]['sbatch_args'])
+        script_file = os.path.join(
+            self._spool_dir, SlurmArrayBroker.DIR_ARRAYS,
+            '{id}.sh'.format(id=requests[0]['id']))
+        array_prefix = os.path.join(
+            self._spool_dir, SlurmArrayBroker.DIR_ARRAYS, '%A_%a')
+        with open(script_file, 'w') as fp:
+            fp.write(SlurmArrayBroker.__make_array_script(requests))
+        try:
+            rc, stdout, stderr = SlurmArrayBroker.run_sbatch(
+                ['--array=0-{n}'.format(n=len(requests) - 1),
+                 '-J', first_task.get('-J', 'caper_array'),
+                 '-o', array_prefix + '.out', '-e', array_prefix + '.err'] +
+                common_args + [script_file])
+        finally:
+            # sbatch keeps its own copy of a script
+            os.remove(script_file)
+
+        m = re.search(SlurmArrayBroker.RE_PATTERN_SUBMITTED_JOB_ID, stdout)
+        if rc or m is None:
+            logger.warning(
+                'Failed to submit an array job for {n} tasks. {e}'.format(
+                    n=len(requests), e=stderr))
+            for request in requests:
+                self.__respond(request, rc or 1, stdout, stderr)
+            return
+        job_id = m.group(1)
+        logger.info('Submitted an array job {j} for {n} tasks.'.format(
+            j=job_id, n=len(requests)))
+        for i, request in enumerate(requests):
+            self.__respond(
+                request, 0,
+                'Submitted batch job {j}_{i}\n'.format(j=job_id, i=i), '')
+
+    def __respond(self, request, rc, stdout, stderr):
+        response_file = os.path.join(
+            self._spool_dir, SlurmArrayBroker.DIR_RESPONSES,
+            '{id}.json'.format(id=request['id']))
+        tmp_file = response_file + '.tmp'
+        with open(tmp_file, 'w') as fp:
+            fp.write(json.dumps(
+                {'rc': rc, 'stdout': stdout, 'stderr': stderr}))
+        os.replace(tmp_file, response_file)
+        request['responded'] = True
+        try:
+            os.remove(request['claimed_file'])
+        except OSError:
+            pass
+
+    def __respond_error(self, requests, err):
+        """Respond with rc=1 to claimed requests without a response
+        so that their clients don't wait for it.
+        """
+        logger.warning(err)
+        for request in requests:
+            if request.get('responded'):
+                continue
+            try:
+                self.__respond(request, 1, '', err + '\n')
+            except Exception as e:
+                logger.error(
+                    'Failed to respond to a SLURM submission request: '
+                    '{id}. {e}'.format(id=request['id'], e=str(e)))
+
+    @staticmethod
+    def __make_array_script(requests):
+        """Shell script for an array job. Each array index runs its task's
+        wrapped command in the same way as "sbatch --wrap"
+        with the task's own working directory and STDOUT/STDERR files.
+        """
+        lines = ['#!/bin/sh', 'case "$SLURM_ARRAY_TASK_ID" in']
+        for i, request in enumerate(requests):
+            _, task = SlurmArrayBroker.split_sbatch_args(
+                request['sbatch_args'])
+            out = task.get('-o', os.devnull)
+            lines.append(
+                '{i}) exec > {o} 2> {e}; cd {d} && '
+                'exec /bin/sh -c {w};;'.format(
+                    i=i,
+                    o=shlex.quote(out),
+                    e=shlex.quote(task.get('-e', out)),
+                    d=shlex.quote(task.get('-D', request['cwd'])),
+                    w=shlex.quote(task['--wrap'])))
+        lines.append('esac')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def __is_pid_alive(pid):
+        try:
+            os.kill(int(pid), 0)
+        except ValueError:
+            return False
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # owned by another user
+            pass
+        return True
+
+    @staticmethod
+    def split_sbatch_args(sbatch_args):
+        """Split sbatch's args into common ones and per-task ones.
+
+        Returns:
+            Tuple of (list of common args, dict of per-task options).
+            None if they cannot be split (without --wrap).
+        """
+        common_args = []
+        task = {}
+        i = 0
+        while i < len(sbatch_args):
+            arg = sbatch_args[i]
+            if arg in SlurmArrayBroker.SBATCH_TASK_OPTIONS:
+                if i + 1 >= len(sbatch_args):
+                    return None
+                task[arg] = sbatch_args[i + 1]
+                i += 2
+                continue
+            common_args.append(arg)
+            i += 1
+        if '--wrap' not in task:
+            return None
+        return common_args, task
+
+    @staticmethod
+    def get_spool_dir(slurm_array_dir):
+        return os.path.join(
+            os.path.expanduser(slurm_array_dir), socket.gethostname())
+
+    @staticmethod
+    def read_heartbeat(spool_dir):
+        """
+        Returns:
+            dict of broker's heartbeat. None if not found or invalid.
+        """
+        try:
+            with open(os.path.join(
+                    spool_dir, SlurmArrayBroker.HEARTBEAT_FILE), 'r') as fp:
+                return json.loads(fp.read())
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def is_broker_alive(spool_dir):
+        heartbeat = SlurmArrayBroker.read_heartbeat(spool_dir)
+        if heartbeat is None:
+            return False
+        max_age = max(
+            heartbeat['sec_window'] *
+            SlurmArrayBroker.MAX_HEARTBEAT_AGE_IN_WINDOWS,
+            SlurmArrayBroker.SEC_MIN_HEARTBEAT_AGE)
+        return time.time() - heartbeat['time'] <= max_age
+
+    @staticmethod
+    def submit(sbatch_args, slurm_array_dir=DEFAULT_SLURM_ARRAY_DIR):
+        """Submit a job via a broker. Runs sbatch directly if there is
+        no live broker or a job cannot be coalesced.
+        This is called by "caper sbatch" (Cromwell's submit for each task).
+
+        Returns:
+            Tuple of (return code, STDOUT, STDERR) of sbatch.
+        """
+        spool_dir = SlurmArrayBroker.get_spool_dir(slurm_array_dir)
+        if SlurmArrayBroker.split_sbatch_args(sbatch_args) is None or \
+                not SlurmArrayBroker.is_broker_alive(spool_dir):
+            return SlurmArrayBroker.run_sbatch(sbatch_args)
+        heartbeat = SlurmArrayBroker.read_heartbeat(spool_dir) or {}
+        sec_timeout = SlurmArrayBroker.SEC_SBATCH_TIMEOUT + \
+            SlurmArrayBroker.CLIENT_TIMEOUT_IN_WINDOWS * heartbeat.get(
+                'sec_window', SlurmArrayBroker.SEC_DEFAULT_WINDOW)
+
+        request_id = '{t:.6f}_{u}'.format(t=time.time(), u=uuid.uuid4().hex)
+        request_file = os.path.join(
+            spool_dir, SlurmArrayBroker.DIR_REQUESTS,
+            '{id}.json'.format(id=request_id))
+        response_file = os.path.join(
+            spool_dir, SlurmArrayBroker.DIR_RESPONSES,
+            '{id}.json'.format(id=request_id))
+        with open(request_file + '.tmp', 'w') as fp:
+            fp.write(json.dumps(
+                {'sbatch_args': sbatch_args, 'cwd': os.getcwd()}))
+        os.replace(request_file + '.tmp', request_file)
+
+        t_start = time.time()
+        while True:
+            time.sleep(SlurmArrayBroker.SEC_CLIENT_POLL_INTERVAL)
+            try:
+                with open(response_file, 'r') as fp:
+                    response = json.loads(fp.read())
+                os.remove(response_file)
+                return response['rc'], response['stdout'], response['stderr']
+            except OSError:
+                pass
+            timed_out = time.time() - t_start > sec_timeout
+            if not timed_out and SlurmArrayBroker.is_broker_alive(spool_dir):
+                continue
+            # broker is gone or too slow.
+            # cancel a request and run sbatch by itself
+            try:
+                os.remove(request_file)
+            except OSError:
+                if not timed_out:
+                    # already claimed. it may have been submitted so
+                    # wait for a response. a request claimed by
+                    # a dead broker is requeued when a broker starts
+                    continue
+                return 1, '', (
+                    'No response from SLURM array broker within {t:.0f} '
+                    'sec after it claimed a request ({id}). A job may have '
+                    'been submitted.\n'.format(t=sec_timeout, id=request_id))
+            return SlurmArrayBroker.run_sbatch(sbatch_args)
+
+    @staticmethod
+    def run_sbatch(sbatch_args, cwd=None):
+        """
+        Returns:
+            Tuple of (return code, STDOUT, STDERR). Return code is -1 if
+            sbatch is not found or timed out.
+        """
+        try:
+            p = Popen(['sbatch'] + sbatch_args, stdout=PIPE, stderr=PIPE,
+                      cwd=cwd)
+        except OSError as e:
+            return -1, '', 'Failed to run sbatch. {e}\n'.format(e=e)
+        try:
+            stdout, stderr = p.communicate(
+                timeout=SlurmArrayBroker.SEC_SBATCH_TIMEOUT)
+        except TimeoutExpired:
+            p.kill()
+            p.communicate()
+            return -1, '', 'sbatch timed out.\n'
+        return p.returncode, stdout.decode(errors='replace'), \
+            stderr.decode(errors='replace')
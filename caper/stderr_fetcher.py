@@ -0,0 +1,161 @@
+"""StderrFetcher: fetch tasks' stderr files concurrently for troubleshooting
+"""
+
+import codecs
+import logging
+import os
+import requests
+import sys
+from autouri import AutoURI, AbsPath, GCSURI, S3URI, HTTPURL
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import get_ident
+
+
+logger = logging.getLogger(__name__)
+
+
+class StderrFetcher(object):
+    """Fetches stderr files on a bounded thread pool.
+    Results are yielded in the original order as soon as they are ready
+    so that they can be printed incrementally.
+
+    Two modes:
+        Full mode (tail_size is None):
+            Remote files are localized and local files are not read
+            at all. Call print_file() to print a file chunk by chunk.
+        Tail mode:
+            Only the last tail_size bytes are read with a range request
+            without localizing a file.
+    """
+    DEFAULT_NUM_THREADS = 16
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, num_threads=DEFAULT_NUM_THREADS, tail_size=None):
+        """
+        Args:
+            num_threads:
+                Maximum number of concurrent fetches.
+                Also, up to twice of this number of files are fetched ahead
+                of printing.
+            tail_size:
+                Read the last tail_size bytes of a file only.
+        """
+        self._num_threads = num_threads
+        self._tail_size = tail_size
+
+    @property
+    def tail_size(self):
+        return self._tail_size
+
+    def fetch(self, uris):
+        """Fetch stderr files.
+
+        Args:
+            uris:
+                Iterable of stderr URIs. None is allowed.
+        Yields:
+            Tuple of (uri, result) in the original order.
+            result is None if a file does not exist or failed to fetch.
+            Otherwise, it's a local file path in full mode or
+            a bytes object in tail mode.
+        """
+        window = deque()
+        max_window = 2 * self._num_threads
+        with ThreadPoolExecutor(max_workers=self._num_threads) as executor:
+            for uri in uris:
+                window.append((uri, executor.submit(self.__fetch, uri)))
+                if len(window) >= max_window:
+                    u, future = window.popleft()
+                    yield u, future.result()
+            while window:
+                u, future = window.popleft()
+                yield u, future.result()
+
+    def __fetch(self, uri):
+        if uri is None:
+            return None
+        try:
+            u = AutoURI(uri, thread_id=get_ident())
+            if not u.is_valid or not u.exists:
+                return None
+            if self._tail_size is not None:
+                return StderrFetcher.read_tail(
+                    u, self._tail_size, thread_id=get_ident())
+            if isinstance(u, AbsPath):
+                return u.uri
+            return AbsPath.localize(u)
+        except Exception as e:
+            logger.warning(
+                'Failed to fetch stderr file. {u}, {e}'.format(u=uri, e=str(e)))
+            return None
+
+    @staticmethod
+    def read_tail(uri, size, thread_id=-1):
+        """Read the last size bytes of a file with a range request.
+
+        Returns:
+            bytes object.
+        """
+        u = AutoURI(uri, thread_id=thread_id)
+        if isinstance(u, AbsPath):
+            with open(u.uri, 'rb') as fp:
+                fp.seek(0, os.SEEK_END)
+                fp.seek(max(fp.tell() - size, 0))
+                return fp.read()
+
+        elif isinstance(u, GCSURI):
+            blob, _ = u.get_blob()
+            if blob is None or not blob.size:
+                return b''
+            return blob.download_as_string(
+                start=max(blob.size - size, 0), end=blob.size - 1)
+
+        elif isinstance(u, S3URI):
+            bucket, path = u.get_bucket_path()
+            cl = S3URI.get_boto3_client(thread_id)
+            try:
+                obj = cl.get_object(
+                    Bucket=bucket, Key=path,
+                    Range='bytes=-{size}'.format(size=size))
+            except cl.exceptions.ClientError as e:
+                # 416: empty object
+                if e.response['Error']['Code'] == 'InvalidRange':
+                    return b''
+                raise
+            return obj['Body'].read()
+
+        elif isinstance(u, HTTPURL):
+            headers = requests.utils.default_headers()
+            headers['Range'] = 'bytes=-{size}'.format(size=size)
+            r = requests.get(
+                u.uri, stream=True, allow_redirects=True, headers=headers)
+            if r.status_code == 416:
+                return b''
+            r.raise_for_status()
+            if r.status_code == 206:
+                return r.content
+            # server ignored range request. keep the last chunks only
+            b = b''
+            for chunk in r.iter_content(chunk_size=StderrFetcher.CHUNK_SIZE):
+                b = (b + chunk)[-size:]
+            return b
+
+        return u.read(byte=True)[-size:]
+
+    @staticmethod
+    def print_file(local_file, fp=None):
+        """Print a local file chunk by chunk without reading it all in memory.
+        """
+        if fp is None:
+            fp = sys.stdout
+        # a multi-byte character can be split across chunks
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        with open(local_file, 'rb') as fp_in:
+            while True:
+                chunk = fp_in.read(StderrFetcher.CHUNK_SIZE)
+                if not chunk:
+                    break
+                fp.write(decoder.decode(chunk))
+        fp.write(decoder.decode(b'', final=True))
+        fp.flush()
@@ -0,0 +1,241 @@
+"""WorkflowMatcher: match workflows by IDs and labels with wildcards
+"""
+
+import fnmatch
+import re
+from collections import defaultdict
+
+
+class WorkflowMatcher(object):
+    """Matches workflow JSONs (from Cromwell server's query)
+    against workflow ID patterns OR label (key, value) patterns.
+    Wildcards (?, * and [...]) are allowed for string patterns.
+
+    Patterns are compiled only once:
+        - Exact (non-wildcard) patterns are looked up in a hash set.
+        - All wildcard patterns are compiled into a single combined regex.
+    So that matching a workflow does not depend on the number of patterns.
+    """
+    WILDCARD_CHARS = ('*', '?', '[')
+    MATCH_ALL = '*'
+
+    def __init__(self, workflow_ids=None, labels=None):
+        """
+        Args:
+            workflow_ids:
+                List of workflows ID strings: [wf_id, ...].
+            labels:
+                List of (key, val) tuples: [(key: val), (key2: val2), ...].
+        """
+        self._workflow_ids = workflow_ids
+        self._labels = labels
+
+        self._id_exact, self._id_regex = WorkflowMatcher.__compile(
+            workflow_ids or [])
+
+        str_vals = defaultdict(list)
+        self._label_non_str_vals = defaultdict(list)
+        for k, v in labels or []:
+            if isinstance(v, str):
+                str_vals[k].append(v)
+            else:
+                self._label_non_str_vals[k].append(v)
+        self._label_patterns = {
+            k: WorkflowMatcher.__compile(vals)
+            for k, vals in str_vals.items()}
+        self._label_keys = set(str_vals) | set(self._label_non_str_vals)
+
+    @property
+    def workflow_ids(self):
+        return self._workflow_ids
+
+    @property
+    def labels(self):
+        return self._labels
+
+    @property
+    def is_empty(self):
+        """No pattern at all. Nothing will be matched.
+        """
+        return self._workflow_ids is None and self._labels is None
+
+    @property
+    def has_wildcard(self):
+        """Any wildcard in workflow ID patterns or label values.
+        """
+        if self._id_regex is not None:
+            return True
+        return any(
+            regex is not None for _, regex in self._label_patterns.values())
+
+    @property
+    def matches_all(self):
+        """Every workflow will be matched (wildcard * for workflow IDs).
+        """
+        return self._workflow_ids is not None and \
+            WorkflowMatcher.MATCH_ALL in self._workflow_ids
+
+    def match(self, w):
+        """Check if a workflow JSON is matched.
+        """
+        if 'id' not in w:
+            return False
+        if self.matches_all:
+            return True
+        if WorkflowMatcher.__match_str(
+                w['id'], self._id_exact, self._id_regex):
+            return True
+        if 'labels' in w:
+            labels_ = w['labels']
+            for k in self._label_keys:
+                if k in labels_ and self.__match_label(k, labels_[k]):
+                    return True
+        return False
+
+    def filter(self, workflows):
+        """Filter a list of workflow JSONs.
+        Label patterns are matched against a label key -> workflows index
+        so that workflows without such label key are never visited.
+
+        Returns:
+            List of matched workflow JSONs in the original order.
+        """
+        if self.is_empty:
+            return []
+        if self.matches_all:
+            return [w for w in workflows if 'id' in w]
+
+        matched = set()
+        for i, w in enumerate(workflows):
+            if 'id' in w and WorkflowMatcher.__match_str(
+                    w['id'], self._id_exact, self._id_regex):
+                matched.add(i)
+
+        index = WorkflowMatcher.build_label_index(workflows, self._label_keys)
+        for k, indexed in index.items():
+            for i, v in indexed:
+                if i not in matched and self.__match_label(k, v):
+                    matched.add(i)
+
+        return [workflows[i] for i in sorted(matched)]
+
+    @staticmethod
+    def build_label_index(workflows, keys=None):
+        """Build an index of label key -> workflows having such label.
+
+        Args:
+            keys:
+                Index these label keys only. Index all keys if not defined.
+        Returns:
+            dict of {
+                label key: [(index of workflow in workflows, label value), ...]
+            }
+        """
+        index = defaultdict(list)
+        for i, w in enumerate(workflows):
+            if 'id' not in w or 'labels' not in w:
+                continue
+            for k, v in w['labels'].items():
+                if keys is None or k in keys:
+                    index[k].append((i, v))
+        return index
+
+    def __match_label(self, key, val):
+        if isinstance(val, str) and key in self._label_patterns:
+            exact, regex = self._label_patterns[key]
+            if WorkflowMatcher.__match_str(val, exact, regex):
+                return True
+        if key in self._label_non_str_vals:
+            return val in self._label_non_str_vals[key]
+        return False
+
+    @staticmethod
+    def __match_str(s, exact, regex):
+        if s in exact:
+            return True
+        return regex is not None and regex.match(s) is not None
+
+    @staticmethod
+    def __compile(patterns):
+        """Compile patterns into a set of exact patterns
+        and a single regex for all wildcard patterns.
+
+        Returns:
+            Tuple of (set of exact strings, compiled regex or None)
+        """
+        exact = set()
+        globs = []
+        for p in patterns:
+            if any(c in p for c in WorkflowMatcher.WILDCARD_CHARS):
+                globs.append(p)
+            else:
+                exact.add(p)
+        if globs:
+            # fnmatch.translate() returns an anchored regex
+            # so that they can be simply ORed
+            regex = re.compile('|'.join(
+                '(?:{})'.format(fnmatch.translate(p)) for p in globs))
+        else:
+            regex = None
+        return exact, regex
+
+
+def main():
+    """Micro-benchmark against a naive fnmatch loop
+    over 100k synthetic workflow records.
+
+    Usage:
+        python -m caper.workflow_matcher
+    """
+    import random
+    import time
+    import uuid
+
+    num_workflows = 100000
+    random.seed(0)
+    workflows = []
+    for i in range(num_workflows):
+        workflows.append({
+            'id': str(uuid.UUID(int=random.getrandbits(128))),
+            'status': 'Succeeded',
+            'labels': {
+                'caper-str-label': 'sample{}_rep{}'.format(i, i % 3),
+                'caper-user': 'user{}'.format(i % 10)
+            }
+        })
+    samples = random.sample(workflows, 20)
+    workflow_ids = [w['id'] for w in samples[:10]] + \
+        [w['id'][:6] + '*' for w in samples[10:]]
+    labels = [('caper-str-label', 'sample{}?_rep*'.format(i))
+              for i in range(10)]
+    labels += [('caper-str-label', w['labels']['caper-str-label'])
+               for w in samples]
+
+    def naive():
+        result = []
+        for w in workflows:
+            if any(fnmatch.fnmatchcase(w['id'], p) for p in workflow_ids):
+                result.append(w)
+                continue
+            labels_ = w['labels']
+            for k, v in labels:
+                if k in labels_ and fnmatch.fnmatchcase(labels_[k], v):
+                    result.append(w)
+                    break
+        return result
+
+    t0 = time.perf_counter()
+    r_naive = naive()
+    t1 = time.perf_counter()
+    r_matcher = WorkflowMatcher(workflow_ids, labels).filter(workflows)
+    t2 = time.perf_counter()
+
+    assert [w['id'] for w in r_naive] == [w['id'] for w in r_matcher]
+    print('workflows={n}, patterns={p}, matched={m}'.format(
+        n=num_workflows, p=len(workflow_ids) + len(labels), m=len(r_matcher)))
+    print('naive fnmatch: {:.3f} sec'.format(t1 - t0))
+    print('WorkflowMatcher: {:.3f} sec'.format(t2 - t1))
+
+
+if __name__ == '__main__':
+    main()
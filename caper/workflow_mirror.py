@@ -0,0 +1,233 @@
+"""WorkflowMirror: local SQLite mirror of workflow summaries
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import time
+from threading import Lock
+from .workflow_matcher import WorkflowMatcher
+
+
+logger = logging.getLogger(__name__)
+
+
+class WorkflowMirror(object):
+    """Local mirror of workflow summaries, labels and locations of
+    final metadata JSON files on a SQLite DB file.
+
+    It's written by Caper server whenever a workflow starts/finishes
+    or its metadata.json is updated so that Caper clients can
+    list workflows and find metadata of finished workflows
+    without querying Cromwell server (and its DB).
+    Caper server also syncs it with Cromwell server's query result
+    (see sync()) to catch workflows which are not started yet
+    (Submitted/OnHold) or already in Cromwell's DB before a server starts.
+
+    A DB file is per Cromwell server (see get_db_file_for_server()).
+
+    Workflows are returned as the same JSON object as in
+    Cromwell server's query result.
+    """
+    SEC_DB_TIMEOUT = 30.0
+    # (key in Cromwell's query result, column name)
+    SUMMARY_KEYS_AND_COLUMNS = (
+        ('status', 'status'),
+        ('name', 'name'),
+        ('submission', 'submission'),
+        ('start', 'start_time'),
+        ('end', 'end_time'),
+        ('parentWorkflowId', 'parent_workflow_id'),
+    )
+    # workflows with these statuses can change status
+    ACTIVE_STATUSES = ('Submitted', 'OnHold', 'Running', 'Aborting')
+    LOCAL_HOSTS = ('localhost', '127.0.0.1', '0.0.0.0')
+
+    def __init__(self, db_file):
+        """
+        Args:
+            db_file:
+                Local SQLite DB file. Created if it doesn't exist.
+        """
+        db_file = os.path.expanduser(db_file)
+        db_dir = os.path.dirname(db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._db_file = db_file
+        self._lock = Lock()
+        self._conn = sqlite3.connect(
+            db_file, timeout=WorkflowMirror.SEC_DB_TIMEOUT,
+            check_same_thread=False)
+        with self._conn:
+            # readers (clients) don't block a writer (server)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS workflows ('
+                'id TEXT PRIMARY KEY, status TEXT, name TEXT, '
+                'submission TEXT, start_time TEXT, end_time TEXT, '
+                'parent_workflow_id TEXT, metadata_uri TEXT, updated REAL)')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS labels ('
+                'workflow_id TEXT, key TEXT, value TEXT, '
+                'PRIMARY KEY (workflow_id, key))')
+
+    @property
+    def db_file(self):
+        return self._db_file
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM workflows').fetchone()[0]
+
+    def update(self, workflow, metadata_uri=None):
+        """Insert or update a workflow.
+
+        Args:
+            workflow:
+                Workflow JSON from Cromwell server's query result.
+            metadata_uri:
+                URI of final metadata JSON file.
+                Previous one is kept if not defined.
+        """
+        wf_id = workflow['id']
+        cols = [c for _, c in WorkflowMirror.SUMMARY_KEYS_AND_COLUMNS]
+        values = [
+            workflow.get(k) for k, _ in WorkflowMirror.SUMMARY_KEYS_AND_COLUMNS]
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO workflows (id) VALUES (?)', (wf_id,))
+            self._conn.execute(
+                'UPDATE workflows SET {cols}, '
+                'metadata_uri=COALESCE(?, metadata_uri), updated=? '
+                'WHERE id=?'.format(
+                    cols=', '.join('{c}=?'.format(c=c) for c in cols)),
+                values + [metadata_uri, time.time(), wf_id])
+            labels = workflow.get('labels')
+            if labels:
+                self._conn.execute(
+                    'DELETE FROM labels WHERE workflow_id=?', (wf_id,))
+                self._conn.executemany(
+                    'INSERT INTO labels VALUES (?, ?, ?)',
+                    [(wf_id, k, v) for k, v in labels.items()])
+
+    def sync(self, cromwell_rest_api, full=False):
+        """Sync with Cromwell server's query result.
+
+        Args:
+            cromwell_rest_api:
+                CromwellRestAPI object for a Cromwell server.
+            full:
+                Sync all workflows on Cromwell server.
+                Otherwise, sync active workflows (ACTIVE_STATUSES) only
+                and then workflows which were active in the mirror but
+                are not anymore on Cromwell server.
+        Returns:
+            Number of synced workflows.
+        """
+        status = None if full else list(WorkflowMirror.ACTIVE_STATUSES)
+        synced = set()
+        for w in cromwell_rest_api.iter_find(workflow_ids=['*'], status=status):
+            self.update(w)
+            synced.add(w['id'])
+        if not full:
+            inactive = [
+                w['id'] for w in self.find(['*'], status=status)
+                if w['id'] not in synced]
+            for w in cromwell_rest_api.find(workflow_ids=inactive):
+                self.update(w)
+                synced.add(w['id'])
+        return len(synced)
+
+    def iter_find(self, matcher, status=None, include_subworkflows=None):
+        """Find workflows in the mirror.
+
+        Args:
+            matcher:
+                WorkflowMatcher object.
+            status:
+                List of workflow statuses.
+            include_subworkflows:
+                Include subworkflows or not. Included if not defined.
+        Yields:
+            Workflow JSON (same as in Cromwell's query result)
+            in order of submission.
+        """
+        if matcher.is_empty:
+            return
+        where = []
+        params = []
+        if status:
+            where.append(
+                'status IN ({})'.format(','.join('?' * len(status))))
+            params.extend(status)
+        if include_subworkflows is False:
+            where.append('parent_workflow_id IS NULL')
+        sql = 'SELECT id, {cols} FROM workflows'.format(
+            cols=', '.join(
+                c for _, c in WorkflowMirror.SUMMARY_KEYS_AND_COLUMNS))
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY submission'
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            labels = {}
+            for wf_id, k, v in self._conn.execute(
+                    'SELECT workflow_id, key, value FROM labels'):
+                labels.setdefault(wf_id, {})[k] = v
+
+        for row in rows:
+            w = {'id': row[0]}
+            for (k, _), v in zip(
+                    WorkflowMirror.SUMMARY_KEYS_AND_COLUMNS, row[1:]):
+                if v is not None:
+                    w[k] = v
+            if row[0] in labels:
+                w['labels'] = labels[row[0]]
+            if matcher.match(w):
+                yield w
+
+    def find(self, workflow_ids=None, labels=None, status=None,
+             include_subworkflows=None):
+        return list(self.iter_find(
+            WorkflowMatcher(workflow_ids, labels), status=status,
+            include_subworkflows=include_subworkflows))
+
+    def get_metadata_uris(self, workflow_ids):
+        """Find URIs of final metadata JSON files.
+
+        Returns:
+            dict of {workflow_id: metadata_uri} for workflows with
+            a final metadata JSON file.
+        """
+        result = {}
+        with self._lock:
+            for wf_id in workflow_ids:
+                row = self._conn.execute(
+                    'SELECT metadata_uri FROM workflows WHERE id=?',
+                    (wf_id,)).fetchone()
+                if row is not None and row[0] is not None:
+                    result[wf_id] = row[0]
+        return result
+
+    def close(self):
+        self._conn.close()
+
+    @staticmethod
+    def get_db_file_for_server(db_file, ip, port):
+        """Make a DB file path for a Cromwell server by
+        adding server's hostname and port to a DB file's basename.
+        e.g. ~/.caper/default_workflow_mirror.db (localhost:8000) ->
+        ~/.caper/default_workflow_mirror.{hostname}_8000.db
+
+        A local address is replaced with a hostname so that
+        a server and clients on a different host (e.g. ip/port
+        read from a server heartbeat file) find the same DB file.
+        """
+        if ip in WorkflowMirror.LOCAL_HOSTS:
+            ip = socket.gethostname()
+        root, ext = os.path.splitext(os.path.expanduser(db_file))
+        return '{root}.{ip}_{port}{ext}'.format(
+            root=root, ip=ip, port=port, ext=ext)
@@ -0,0 +1,213 @@
+"""WorkflowTable: column-oriented table of workflows for "caper list"
+"""
+
+import csv
+import json
+import sys
+
+
+class WorkflowTable(object):
+    """Column-oriented table of workflow JSONs (from Cromwell server's query).
+    Each field is stored as a list (column) instead of a dict per workflow.
+    Filters are computed column by column into a list of selected row
+    indices and rows are never materialized until they are written.
+
+    Special fields:
+        workflow_id: same as id.
+        str_label, user: values of Caper's special labels.
+        parent_workflow_id: ID of a parent workflow for a subworkflow.
+    """
+    FIELD_ID = 'id'
+    FIELD_WORKFLOW_ID = 'workflow_id'
+    FIELD_STATUS = 'status'
+    FIELD_SUBMISSION = 'submission'
+    FIELD_PARENT_WORKFLOW_ID = 'parent_workflow_id'
+    FIELD_STR_LABEL = 'str_label'
+    FIELD_USER = 'user'
+    # always stored for filtering
+    BASE_FIELDS = (
+        FIELD_ID, FIELD_STATUS, FIELD_SUBMISSION, FIELD_PARENT_WORKFLOW_ID,
+        FIELD_STR_LABEL, FIELD_USER)
+
+    OUTPUT_FORMAT_TSV = 'tsv'
+    OUTPUT_FORMAT_CSV = 'csv'
+    OUTPUT_FORMAT_JSONL = 'jsonl'
+    OUTPUT_FORMATS = (OUTPUT_FORMAT_TSV, OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_JSONL)
+    # number of rows to be written at once
+    WRITE_BUFFER_ROWS = 10000
+
+    def __init__(self, fields, key_str_label, key_user):
+        """
+        Args:
+            fields:
+                List of fields (keys in workflow JSON or special fields)
+                to be stored.
+            key_str_label, key_user:
+                Label keys for special fields str_label and user.
+        """
+        self._key_str_label = key_str_label
+        self._key_user = key_user
+        self._fields = list(WorkflowTable.BASE_FIELDS)
+        for f in fields:
+            if f not in self._fields and f != WorkflowTable.FIELD_WORKFLOW_ID:
+                self._fields.append(f)
+        self._columns = {f: [] for f in self._fields}
+
+    def __len__(self):
+        return len(self._columns[WorkflowTable.FIELD_ID])
+
+    @property
+    def fields(self):
+        return self._fields
+
+    def column(self, field):
+        if field == WorkflowTable.FIELD_WORKFLOW_ID:
+            field = WorkflowTable.FIELD_ID
+        return self._columns[field]
+
+    def extend(self, workflows):
+        """Append workflow JSONs to columns.
+        Workflows without an ID are ignored.
+        """
+        key_str_label = self._key_str_label
+        key_user = self._key_user
+        other_fields = [
+            (f, self._columns[f]) for f in self._fields
+            if f not in WorkflowTable.BASE_FIELDS]
+        col_id = self._columns[WorkflowTable.FIELD_ID]
+        col_status = self._columns[WorkflowTable.FIELD_STATUS]
+        col_submission = self._columns[WorkflowTable.FIELD_SUBMISSION]
+        col_parent = self._columns[WorkflowTable.FIELD_PARENT_WORKFLOW_ID]
+        col_str_label = self._columns[WorkflowTable.FIELD_STR_LABEL]
+        col_user = self._columns[WorkflowTable.FIELD_USER]
+
+        for w in workflows:
+            if 'id' not in w:
+                continue
+            labels = w.get('labels') or {}
+            col_id.append(w['id'])
+            col_status.append(w.get('status'))
+            col_submission.append(w.get('submission'))
+            col_parent.append(w.get('parentWorkflowId'))
+            col_str_label.append(labels.get(key_str_label))
+            col_user.append(labels.get(key_user))
+            for f, col in other_fields:
+                col.append(w.get(f))
+        return self
+
+    def take(self, indices):
+        """Make a new table with selected rows.
+        """
+        t = WorkflowTable.__new__(WorkflowTable)
+        t._key_str_label = self._key_str_label
+        t._key_user = self._key_user
+        t._fields = self._fields
+        t._columns = {
+            f: [col[i] for i in indices] for f, col in self._columns.items()}
+        return t
+
+    def filter(self, statuses=None, users=None, submitted_after=None,
+               submitted_before=None, hide_subworkflow=False):
+        """Filter rows. All conditions are ANDed.
+
+        Args:
+            statuses:
+                List of workflow statuses.
+            users:
+                List of values for Caper's user label.
+            submitted_after, submitted_before:
+                Date/time strings. Compared with submission date/time by
+                a simple string comparison. Both are exclusive.
+                e.g. 2019-06-13, 2019-06-13T10:07
+                Workflows without submission date/time are not filtered.
+            hide_subworkflow:
+                Hide subworkflows.
+        Returns:
+            New filtered table.
+        """
+        selected = range(len(self))
+        if hide_subworkflow:
+            col = self._columns[WorkflowTable.FIELD_PARENT_WORKFLOW_ID]
+            selected = [i for i in selected if not col[i]]
+        if statuses:
+            statuses = set(statuses)
+            col = self._columns[WorkflowTable.FIELD_STATUS]
+            selected = [i for i in selected if col[i] in statuses]
+        if users:
+            users = set(users)
+            col = self._columns[WorkflowTable.FIELD_USER]
+            selected = [i for i in selected if col[i] in users]
+        if submitted_after is not None:
+            col = self._columns[WorkflowTable.FIELD_SUBMISSION]
+            selected = [
+                i for i in selected
+                if col[i] is None or col[i] > submitted_after]
+        if submitted_before is not None:
+            col = self._columns[WorkflowTable.FIELD_SUBMISSION]
+            selected = [
+                i for i in selected
+                if col[i] is None or col[i] < submitted_before]
+        if isinstance(selected, range):
+            return self
+        return self.take(selected)
+
+    def sort(self, field, reverse=False, limit=None):
+        """Sort rows by a field. None comes first (last if reversed).
+        Original order is kept for ties.
+
+        Args:
+            limit:
+                Keep the first N rows after sorting.
+        Returns:
+            New sorted table.
+        """
+        indices = range(len(self))
+        if field is not None:
+            col = self.column(field)
+            indices = sorted(
+                indices, key=lambda i: (col[i] is not None, col[i]),
+                reverse=reverse)
+        if limit is not None:
+            indices = indices[:limit]
+        return self.take(indices)
+
+    def write(self, formats, output_format=OUTPUT_FORMAT_TSV, fp=None):
+        """Write rows with a header (except for JSON lines) on fp.
+
+        Args:
+            formats:
+                List of fields to be written.
+            output_format:
+                tsv, csv or jsonl.
+        """
+        if fp is None:
+            fp = sys.stdout
+        if output_format not in WorkflowTable.OUTPUT_FORMATS:
+            raise ValueError(
+                'Unsupported output format: {f}'.format(f=output_format))
+        cols = [self.column(f) if f in self._fields or
+                f == WorkflowTable.FIELD_WORKFLOW_ID else None
+                for f in formats]
+
+        if output_format == WorkflowTable.OUTPUT_FORMAT_CSV:
+            writer = csv.writer(fp, lineterminator='\n')
+            writer.writerow(formats)
+        elif output_format == WorkflowTable.OUTPUT_FORMAT_TSV:
+            fp.write('\t'.join(formats) + '\n')
+
+        n = len(self)
+        for start in range(0, n, WorkflowTable.WRITE_BUFFER_ROWS):
+            end = min(start + WorkflowTable.WRITE_BUFFER_ROWS, n)
+            rows = [
+                [None if col is None else col[i] for col in cols]
+                for i in range(start, end)]
+            if output_format == WorkflowTable.OUTPUT_FORMAT_CSV:
+                writer.writerows(rows)
+            elif output_format == WorkflowTable.OUTPUT_FORMAT_TSV:
+                fp.write(''.join(
+                    '\t'.join(str(v) for v in row) + '\n' for row in rows))
+            else:
+                fp.write(''.join(
+                    json.dumps(dict(zip(formats, row))) + '\n'
+                    for row in rows))
+        fp.flush()
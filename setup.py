@@ -23,5 +23,5 @@ setuptools.setup(
         'Operating System :: POSIX :: Linux',
     ],
     install_requires=['pyhocon>=0.3.53', 'requests', 'pyopenssl', 'autouri>=0.1.2.1',
-                      'miniwdl']
+                      'miniwdl', 'ijson']
 )